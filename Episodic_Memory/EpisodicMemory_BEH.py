@@ -22,9 +22,10 @@ This version of the task uses pictures, an earlier version used words instead.
 The pictures were gotten from --  "cvcl.mit.edu/MM/"
 
 Note:
-This task is set up to run with just one set size (1)
-However there is some currently unused code in this script for running with trials at other set sizes (more bars than 1)
-I've chosen to leave this code here in case it's helpful for someone who wishes to modify the code for more set size conditions.
+This task is set up to run with just one set size (1), which is how CNTRACS ran it.
+Other set sizes (several colored bars paired with each picture) can be run by changing 'setSizes' below.
+In that case the participant clicks every bar during encoding, and at test the cursor takes the color of the probed bar.
+All the bars of a trial are drawn in a single call (one ElementArrayStim), so frame time doesn't grow with set size.
 '''
 
 ## Import modules
@@ -32,6 +33,7 @@ from psychopy import visual, monitors, core, event, sound, data, gui, prefs
 prefs.general['audioLib'] = ['pyo']
 import math, random, numpy, os, glob, csv
 import pandas as pd
+from image_similarity import load_similarity_index, assemble_blocks
 
 
 ## Important: set seed for randomization.
@@ -131,51 +133,58 @@ dvaArrayItemLength = 1 # length of bars
 dvaArrayItemWidth = 0.1 # width of bars
 
 ## Conditions, locations info
-setSizes            =[1] # Just 1 set size now
+setSizes            =[1] # Just 1 set size now, e.g. [1,3] splits the pictures between set sizes 1 and 3
 numTrialsPerBlock   =int(expInfo['BlockLength']) #pairs per block
-numTrialsPerSetSize =int(len(imageFiles)) #picture-bar pairs
+numTrialsPerSetSize =int(len(imageFiles)/len(setSizes)) #picture-bar pairs
+minItemSeparation   =20 # minimum degrees of arc between bars paired with the same picture (set sizes > 1)
 numBlocksBetweenBreaks = 10
-sortedTrials        =list(range(0,numTrialsPerSetSize*len(setSizes)))
-randomizedTrials    =list(range(0,numTrialsPerSetSize*len(setSizes)))
-random.shuffle(randomizedTrials) # uses a seed defined at the top
+numBlocksPerTest    =1 # blocks encoded before each test phase, >1 gives delayed tests with the blocks' pictures interleaved
+minHashDistance     =10 # pictures in the same block must differ by at least this many (of 64) perceptual hash bits
+sortedTrials        =list(range(0,len(imageFiles))) # one trial per picture
+# perceptual hashes of the pictures and their too-similar neighbours, cached in 'Objects_160_hash_index.csv' (only new/changed pictures get hashed)
+imageHashes, imageNeighbours = load_similarity_index(imageFiles, minHashDistance)
+randomizedTrials    =assemble_blocks(imageHashes, imageNeighbours, numTrialsPerBlock, minDistance=minHashDistance) # random order (uses a seed defined at the top), no visually similar pictures within a block
 
 # Note on stimulus locations: The original version used 90, but this led to a bias in what locations were most likely
-numStimulusLocations=numTrialsPerSetSize # currently set so that each of the 160 items can have their own location, original = 90
+numStimulusLocations=len(imageFiles) # currently set so that each of the 160 items can have their own location, original = 90
 locations           =list(range(0,numStimulusLocations))
-colors              =['white']
+singleBarColor      ='#ffffff' # white, the probed bar of set size 1 trials (as in the original task, also in mixed designs)
+# multi-bar trials: same colors as the WM task (usable with red/green color blind individuals), needs at least max(setSizes) colors
+colors              =['#000000', '#1e00b4', '#00aaff', '#ffffff', '#00ff00'] #black/darkblue/cyan/white/lightgreen
 itemSeparation      = 360/numStimulusLocations # even spaced locations, original version used '4' here
-angles              = []
-angle_XYs           = []
 
 
 #  0 degrees (and location 0) is on the right most end of the circle (3 oclock)
 # 90 degrees is on the bottom (6 oclock) and so on around the circle...
 
-for x in range(0,numStimulusLocations):
-    angles.append(x*itemSeparation+1) # this +1 offset works for our purposes, breaks if numStimulusLocations >= 360
-    # the +1 offset ^ is not strictly needed, just takes angles off the cardinal axes
-    angle_X=math.cos((x*itemSeparation+1)*math.pi/180)*dvaArrayRadius
-    angle_Y=-math.sin((x*itemSeparation+1)*math.pi/180)*dvaArrayRadius
-    angle_XYs.append([angle_X, angle_Y])
+# this +1 offset works for our purposes, breaks if numStimulusLocations >= 360
+# the +1 offset is not strictly needed, just takes angles off the cardinal axes
+angles              = numpy.arange(numStimulusLocations)*itemSeparation+1
+angle_XYs           = numpy.column_stack([numpy.cos(numpy.radians(angles)), -numpy.sin(numpy.radians(angles))])*dvaArrayRadius
 
 ### Make trial list
 
 tList=[]
 
-for x in list(range(0,numTrialsPerSetSize*len(setSizes))):
-    ss  =   setSizes[math.trunc(randomizedTrials[x]/numTrialsPerSetSize)]  #set size (in this task, just SS = 1)
+for x in list(range(0,len(sortedTrials))):
+    ss  =   setSizes[min(math.trunc(randomizedTrials[x]/numTrialsPerSetSize), len(setSizes)-1)]  #set size (in this task, just SS = 1)
     pl  =   [randomizedTrials[x]%numStimulusLocations]                     #probed location 
-    pc  =   colors[randomizedTrials[x]%len(colors)]                        #probed color (in this task, just white)
 
     if ss == 1: # always true in this version
+        pc  =   singleBarColor                                  #probed color
         ul  = []
         uc  = []
 
     else:
-        temp = range(0,len(locations))
-        temp.remove(pl[0])
-        ul  =   random.sample(temp,ss-1)                    #unprobed locations
-        uc  =   [i for i in colors if i != pc]              #unprobed colors
+        pc  =   colors[randomizedTrials[x]%len(colors)]         #probed color
+        ul  =   []                                      #unprobed locations, at least minItemSeparation from the other bars
+        for item in range(ss-1):
+            sep = numpy.abs((angles[:,None] - angles[pl+ul] + 180) % 360 - 180) # angular distance of every location to the bars so far
+            temp = numpy.flatnonzero(numpy.all(sep >= minItemSeparation, axis=1))
+            ul.append(int(random.choice(temp)))
+        tempc = list(colors)
+        tempc.remove(pc)
+        uc  =   random.sample(tempc,ss-1)                   #unprobed colors
 
     alll=   pl + ul
     allc=   [pc] + uc
@@ -200,13 +209,14 @@ for x in list(range(0,numTrialsPerSetSize*len(setSizes))):
         'trialOnsetRespWindow': 0,
         'trialTestOrder'    :   0,
         'blockNumber'       :   math.trunc(sortedTrials[x]/numTrialsPerBlock),
+        'setSize'           :   ss,
         'probedLocation'    :   pl,
         'probedColor'       :   pc,
         'allLocations'      :   alll,
         'allColors'         :   allc,
-        'allOrientations'   :   [i * itemSeparation+1 for i in alll],
-        'probedXY'          :   angle_XYs[randomizedTrials[x]%numStimulusLocations],
-        'allXY'             :   [angle_XYs[i] for i in alll],
+        'allOrientations'   :   angles[alll],
+        'probedXY'          :   angle_XYs[randomizedTrials[x]%numStimulusLocations].tolist(),
+        'allXY'             :   angle_XYs[alll],
         'image'             :   thisImage, # defined above
         'imageFile'         :   imageFiles[randomizedTrials[x]], 
         'durITI'            :   tITI, #jittered
@@ -225,6 +235,7 @@ for x in list(range(0,numTrialsPerSetSize*len(setSizes))):
         'respXY'            :   [[0,0],[0,0]],
         'respAngle'         :   0,
         'probedAngle'       :   0,
+        'unprobedAngles'    :   [],
         'respError'         :   -1
         })
 
@@ -239,6 +250,25 @@ def diff_wrap(a, b, half=True): # half means the direction doesnt matter
         angle = (180 - numpy.abs(numpy.abs(a - b) - 180)) * -1* numpy.sign(numpy.sin(numpy.radians(a-b)))
     return angle
 
+# block-indexed trial store
+# trials are grouped by 'blockNumber' once, into preallocated index arrays, so encoding records
+# can be looked up by block in O(1) (works for blocks of any length, including a partial last block)
+def build_block_index(trialList):
+    trialBlocks = numpy.array([t['blockNumber'] for t in trialList], dtype=int)
+    blockLengths = numpy.bincount(trialBlocks)
+    blockOffsets = numpy.zeros(len(blockLengths)+1, dtype=int) # trials of block b are blockTrials[blockOffsets[b]:blockOffsets[b+1]]
+    blockOffsets[1:] = numpy.cumsum(blockLengths)
+    blockTrials = numpy.argsort(trialBlocks, kind='stable') # indices into trialList, grouped by block
+    lastTrials = numpy.zeros(len(trialList), dtype=bool) # True for the last encoded trial of each block
+    lastTrials[blockTrials[blockOffsets[1:][blockLengths > 0]-1]] = True
+    return blockOffsets, blockTrials, lastTrials
+
+def get_test_order(blocks):
+    # the trial indices for all the blocks being tested, shuffled together (interleaved across blocks)
+    testOrder = numpy.concatenate([blockTrials[blockOffsets[b]:blockOffsets[b+1]] for b in blocks])
+    random.shuffle(testOrder) # uses a seed defined at the top
+    return testOrder
+
 def give_instructions():
     mywin.flip()
 
@@ -306,7 +336,7 @@ def break_between_blocks(breakNum):
         name=None
         )
     breakText.setText(
-        'Block ' + str(breakNum) + ' of ' + str(int(round(float(numTrialsRequested/numTrialsPerBlock)))) + '.\n\nClick the mouse button when you are ready to continue.'
+        'Block ' + str(breakNum) + ' of ' + str(numBlocks) + '.\n\nClick the mouse button when you are ready to continue.'
         )
     breakText.setAutoDraw(True)
     breakText.draw()
@@ -343,20 +373,27 @@ def setup_trial():
     fixation1.setLineColor(trial['probedColor'])
     fixation1.setFillColor(trial['probedColor'])
 
-    shape0.setLineColor(acs[0])
-    shape0.setFillColor(acs[0])
-    shape0.setOri(aos[0])
-    shape0.setPos(axy[0])
-    mX,mY=axy[0]
-
-    # if running at higher set sizes, need to add more shape objects here.
-    
-    if math.atan2(mY,mX)*180/math.pi>0:
-        angle0= math.atan2(mY,mX)*180/math.pi
-    else:
-        angle0= (2*math.pi + math.atan2(mY,mX))*180/math.pi
-
-    trial['probedAngle']=angle0
+    # all bars go into one ElementArrayStim, unused elements (smaller set sizes) are made transparent
+    nBars = len(axy)
+    barXYs = numpy.zeros((maxSetSize,2))
+    barXYs[:nBars] = axy
+    barOris = numpy.zeros(maxSetSize)
+    barOris[:nBars] = aos
+    barColors = numpy.ones((maxSetSize,3))
+    barColors[:nBars] = numpy.array([[int(c[i:i+2],16) for i in (1,3,5)] for c in acs])/127.5-1 # hex to psychopy rgb (-1 to 1)
+    bars.xys = barXYs
+    bars.oris = barOris
+    bars.colors = barColors
+    bars.opacities = (numpy.arange(maxSetSize) < nBars).astype(float)
+
+    # bar axis and its perpendicular (psychopy orientations are clockwise), used to check clicks on the bars
+    trial['barAxes'] = numpy.column_stack([numpy.cos(numpy.radians(aos)), -numpy.sin(numpy.radians(aos))])
+    trial['barNormals'] = numpy.column_stack([numpy.sin(numpy.radians(aos)), numpy.cos(numpy.radians(aos))])
+
+    barAngles = numpy.degrees(numpy.arctan2(axy[:,1], axy[:,0])) % 360 # angle of every bar, probed bar first
+
+    trial['probedAngle']=barAngles[0]
+    trial['unprobedAngles']=barAngles[1:].tolist()
     trialImageFile = trial['imageFile'] # image file with path
     trialImage.setImage(trialImageFile) # set the image
 
@@ -378,61 +415,71 @@ def present_ITI():
         fixation0.draw()
         mywin.flip()
 
+def bars_clicked(pos):
+    # which bars the cursor (fixation0) overlaps, for all bars of the trial at once
+    d = numpy.asarray(pos) - trial['allXY']
+    return (numpy.abs(numpy.einsum('ij,ij->i', d, trial['barAxes'])) <= dvaArrayItemLength/2 + fixation0.radius) & \
+           (numpy.abs(numpy.einsum('ij,ij->i', d, trial['barNormals'])) <= dvaArrayItemWidth/2 + fixation0.radius)
+
+def timed_flip():
+    # flips and returns the time of the flip on 'clock'
+    # (mywin.flip() returns core.monotonicClock time, not 'clock' time; callOnFlip runs right after the buffer swap)
+    flipTime = []
+    mywin.callOnFlip(lambda: flipTime.append(clock.getTime()))
+    mywin.flip()
+    return flipTime[0]
+
 def present_encoding_array():
+    # The encoding array is locked to the frame count (framesEncoding) rather than polling the clock.
+    # Timing comes from the flip timestamps (on 'clock', like trialOnset),
+    # and the mouse is sampled once right after each flip, so a click is timed by the flip it was seen on.
     correctClicks = 0
+    clicked = numpy.zeros(trial['setSize'], dtype=bool) # bars clicked so far
     mouse.setPos([0,0])
-    backgroundCircle.draw() # draw background
-    trialImage.draw(win = mywin) # draw image
-    shape0.draw()
-    # add more shapes to draw here, if running at higher set sizes
     stimRadius.lineColor=[-0.5,-0.5,-0.5]
-    stimRadius.draw()
     fixation0.pos=mouse.getPos()
-    fixation0.draw()
     fixation1.pos=mouse.getPos()
     warning = sound.Sound('A', octave=3, sampleRate=44100, secs=0.2, stereo=True, volume=0.8)
 
-    mywin.flip()
+    for frame in range(trial['framesEncoding']):
 
-    trial['trialITIDuration'] = clock.getTime()-trial['trialOnset'] #time stamp start of encoding
-    
-    while clock.getTime() - (trial['trialOnset'] + trial['trialITIDuration']) <= trial['durEncoding']:
+        if event.getKeys(keyList=['escape', 'q']):
+            save_data()
+            mywin.close()
+            core.quit()
 
-        while correctClicks == 0 and clock.getTime() - (trial['trialOnset'] + trial['trialITIDuration']) <= trial['durEncoding']:
+        backgroundCircle.draw() # draw background
+        trialImage.draw(win = mywin) # draw image
+        bars.draw() # all bars in one draw call
+        stimRadius.draw()
+        if correctClicks < trial['setSize']: # cursor disappears after all the bars are clicked
+            fixation0.draw()
+        flipTime = timed_flip()
 
-            if event.getKeys(keyList=['escape', 'q']):
-                save_data()
-                mywin.close()
-                core.quit()
+        if frame == 0:
+            encodingOnset = flipTime
+            trial['trialITIDuration'] = encodingOnset-trial['trialOnset'] # trialOnset to the first encoding flip: framesITI flips, ~durITI
 
-            backgroundCircle.draw()
-            trialImage.draw(win = mywin)
-            shape0.draw()
-            stimRadius.draw()
-            fixation0.pos=mouse.getPos()
-            fixation0.draw()
-            fixation1.pos=mouse.getPos()
-            mywin.flip()
+        if correctClicks < trial['setSize']:
             buttons = mouse.getPressed()
 
             if buttons[0]>0:
+                clicked |= bars_clicked(fixation0.pos)
+                if clicked.sum() > correctClicks:
+                    correctClicks = int(clicked.sum())
+                    if correctClicks == trial['setSize']: # RT is when the last bar was clicked
+                        trial['respRT_encoding'] = flipTime - encodingOnset
+                        event.clearEvents()
+                        continue
 
-                if fixation0.overlaps(shape0):
-
-                    trial['respRT_encoding'] = clock.getTime() - (trial['trialOnset'] + trial['trialITIDuration'])
-                    correctClicks+=1
-                    break
+            fixation0.pos=mouse.getPos()
+            fixation1.pos=fixation0.pos
 
-            if clock.getTime() - (trial['trialOnset'] + trial['trialITIDuration']) >= trial['durBeforeWarning'] and trial['respLateWarning_encoding'] == False and correctClicks == 0:
+            if frame+1 >= trial['framesBeforeWarning'] and trial['respLateWarning_encoding'] == False:
                 warning.play(loops = 0)
                 trial['respLateWarning_encoding'] = True
 
-        shape0.draw()
-        backgroundCircle.draw()
-        trialImage.draw(win = mywin)
-        stimRadius.draw()
-        mywin.flip()
-        event.clearEvents()
+    event.clearEvents()
 
 def present_retention_interval():
     mywin.flip()
@@ -448,11 +495,13 @@ def present_retention_interval():
 def present_response_window(i,j):
     mouse = event.Mouse(visible = False, win = mywin)
     mouse.setPos([0,0])
-    tested_trial=trials.getEarlierTrial((numTrialsPerBlock-1)-i)
+    tested_trial=trialsToRun[i] # i is an index from the block-indexed trial store
     warning = sound.Sound('A', octave=3, sampleRate=44100, secs=0.2, stereo=True, volume=0.8)
 
     trialImageFile = tested_trial['imageFile'] # image file with path
     trialImage.setImage(trialImageFile)    
+    fixation1.setLineColor(tested_trial['probedColor'])
+    fixation1.setFillColor(tested_trial['probedColor'])
     tested_trial['trialOnsetRespWindow'] = clock.getTime()-trial['OnsetRetention'] # testing time RELATIVE TO 'OnsetRetention'
     tested_trial['trialTestOrder'] = j
     
@@ -471,7 +520,11 @@ def present_response_window(i,j):
         backgroundCircle.draw()
         trialImage.draw(win = mywin)
         fixation0.pos=mouse.getPos() # changed to fixation0
-        fixation0.draw() # changed to fixation0
+        if tested_trial['setSize'] == 1:
+            fixation0.draw() # changed to fixation0
+        else:
+            fixation1.pos=fixation0.pos
+            fixation1.draw() # cursor in the color of the probed bar
         mywin.flip()
 
         if event.getKeys(keyList=['escape', 'q']):
@@ -550,6 +603,10 @@ def save_data():
             'probedXY',
             'respAngle',
             'probedAngle',
+            'setSize',
+            'probedColor',
+            'allColors',
+            'unprobedAngles',
             'respError'
             ]
         )
@@ -661,21 +718,18 @@ fixationB = visual.Circle(
     fillColor=[-.5,-.5,-.5],
     pos=(0, 0)
     )
-# bar dimensions
-vtx=(
-    (-dvaArrayItemLength/2, -dvaArrayItemWidth/2),
-    (dvaArrayItemLength/2, -dvaArrayItemWidth/2),
-    (dvaArrayItemLength/2, dvaArrayItemWidth/2),
-    (-dvaArrayItemLength/2, dvaArrayItemWidth/2)
-    )
-# the bar stim
-shape0 = visual.ShapeStim(
+# the bars, all bars of a trial are drawn with one ElementArrayStim
+maxSetSize = max(setSizes)
+bars = visual.ElementArrayStim(
     win=mywin,
     autoLog=False,
     units='deg',
-    lineWidth=1,
-    vertices=vtx,
-    closeShape=True
+    nElements=maxSetSize,
+    elementTex=None, # plain rectangles
+    elementMask=None,
+    sizes=[dvaArrayItemLength, dvaArrayItemWidth], # bar dimensions
+    xys=numpy.zeros((maxSetSize,2)),
+    colorSpace='rgb'
     )
 
 # background added for images
@@ -696,8 +750,12 @@ if expInfo['TrialsToAdminister']=='all':
 else:
     numTrialsRequested = int(expInfo['TrialsToAdminister'])
 
+trialsToRun = tList[0:int(numTrialsRequested)] # trial dicts are shared with the TrialHandler, so results written to them get saved
+blockOffsets, blockTrials, lastTrials = build_block_index(trialsToRun)
+numBlocks = len(blockOffsets)-1
+
 trials = data.TrialHandler(
-    trialList=tList[0:int(numTrialsRequested)],
+    trialList=trialsToRun,
     nReps=1,
     method='sequential',
     dataTypes=[],
@@ -722,23 +780,20 @@ for trial in trials:
 
     present_encoding_array()
     
-    # check if time for test
-    if trial['trialNumber']%numTrialsPerBlock == numTrialsPerBlock-1 or trial['trialNumber'] == numTrialsRequested-1:
-
-        present_retention_interval() #prepare to get tested
+    # check if time for test (end of a block, every numBlocksPerTest blocks, or the last trial)
+    if lastTrials[trial['trialNumber']]:
+        blocksEncoded = trial['blockNumber']+1
 
-        if trial['trialNumber']%numTrialsPerBlock == numTrialsPerBlock-1:
-            testrange=list(range(0,numTrialsPerBlock)) 
+        if blocksEncoded%numBlocksPerTest == 0 or trial['trialNumber'] == numTrialsRequested-1:
 
-        elif trial['trialNumber'] == numTrialsRequested-1:
-            testrange=list(range(numTrialsPerBlock-numTrialsRequested%numTrialsPerBlock,numTrialsPerBlock)) 
+            present_retention_interval() #prepare to get tested
 
-        random.shuffle(testrange)
-        j=0
+            testBlocks = range(blocksEncoded-(blocksEncoded-1)%numBlocksPerTest-1, blocksEncoded)
+            j=0
 
-        for i in testrange:
-            present_response_window(i,j)
-            j+=1
+            for i in get_test_order(testBlocks):
+                present_response_window(i,j)
+                j+=1
 
         blockNum += 1
 
@@ -0,0 +1,197 @@
+'''
+Mixture model fitting for the EM task, with covariates, for many participants at once
+
+This is a Python version of the model in EM_analysis_demo.R (von Mises + uniform mixture of the response errors),
+extended so that Pmem and Kappa can vary with trial covariates that the task logs:
+    - serialPosition -> 'trialWithinBlock' (position of the pair in the encoding block)
+    - testOrder      -> 'trialTestOrder' (position of the picture in the shuffled test)
+    - testLag        -> seconds between the onset of the encoding array and the onset of the test for that picture
+
+Pmem and Kappa are linked to a design matrix X (one row per trial):
+    Pmem  = logistic(X @ bPmem)
+    Kappa = exp(X @ bKappa)
+With an intercept-only X this is the same model as the R demo.
+With one-hot columns (one per covariate level) it is a separate Pmem/Kappa per level (the covariate 'grid').
+
+All participants are fit together: the data are padded into (participants x trials) arrays,
+so the likelihood and its exact gradient are evaluated for the whole cohort in one set of array operations.
+Participants do not share parameters, so this gives the same estimates as fitting them one at a time.
+Covariate fits are warm-started from the intercept-only fit of each participant.
+
+Usage (from this folder):
+    python em_mixture_fit.py                                  # fits the demo data file
+    python em_mixture_fit.py path/to/data/*.xlsx serialPosition
+'''
+
+import glob, os, sys
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from scipy.special import i0e, i1e, expit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # session_ids.py, in the repository folder
+from session_ids import session_ids
+
+# same bounds as the R demo (kei_low, kei_high)
+kappaBounds = (0.001, 1000)
+pmemBounds = (1e-6, 1 - 1e-6) # logistic link can't reach exactly 0 or 1
+
+covariateColumns = ['serialPosition', 'testOrder', 'testLag']
+
+## Data ##
+
+def wrap(x, xmin, xmax):
+    # wrap angular differences (same as the R demo)
+    return x - np.floor((x - xmin) / (xmax - xmin)) * (xmax - xmin)
+
+def load_em_data(files):
+    # load any number of EM task output files (.xlsx written by the task, or .csv), and add the error and covariates
+    frames = []
+    for f in files:
+        if f.endswith('.xlsx'):
+            frames.append(pd.read_excel(f))
+        else:
+            frames.append(pd.read_csv(f))
+    dat = pd.concat(frames, ignore_index=True)
+    dat['Participant'] = session_ids(dat)
+
+    dat['error'] = wrap(dat['probedAngle'] - dat['respAngle'], -180, 180)
+    dat['serialPosition'] = dat['trialWithinBlock']
+    dat['testOrder'] = dat['trialTestOrder']
+
+    # 'OnsetRetention' is only logged on the trial that ended the encoding phase,
+    # and 'trialOnsetRespWindow' is relative to it, so each trial is matched to the next retention interval after it
+    lags = np.zeros(len(dat))
+    for participant, rows in dat.groupby('Participant').groups.items():
+        sub = dat.loc[rows]
+        retentionOnsets = np.sort(sub.loc[sub['OnsetRetention'] > 0, 'OnsetRetention'].values)
+        encodingOnsets = (sub['trialOnset'] + sub['trialITIDuration']).values
+        nextRetention = retentionOnsets[np.minimum(np.searchsorted(retentionOnsets, encodingOnsets), len(retentionOnsets) - 1)]
+        lags[dat.index.get_indexer(rows)] = nextRetention + sub['trialOnsetRespWindow'].values - encodingOnsets
+    dat['testLag'] = lags
+
+    return dat
+
+def design_matrix(dat, covariates=(), kind='linear'):
+    # kind='linear' -> intercept + z-scored covariates (Pmem/Kappa change smoothly with the covariates)
+    #                  a covariate that doesn't vary (e.g. one lag in the whole data) is only centered: an all-zero column, slopes stay at 0
+    # kind='cells'  -> one column per level of a single covariate (separate Pmem/Kappa per level)
+    if kind == 'cells':
+        if len(covariates) != 1:
+            raise ValueError("kind='cells' takes exactly one covariate")
+        levels = np.sort(dat[covariates[0]].unique())
+        X = (dat[covariates[0]].values[:, None] == levels[None, :]).astype(float)
+        return X, ['%s=%s' % (covariates[0], lv) for lv in levels]
+
+    cols = [np.ones(len(dat))]
+    for cov in covariates:
+        x = dat[cov].values.astype(float)
+        sd = x.std()
+        cols.append((x - x.mean()) / sd if sd > 0 else x - x.mean())
+    return np.column_stack(cols), ['intercept'] + list(covariates)
+
+def compile_cohort(dat, X):
+    # pad the data into (participants x trials) arrays, with a mask for the padding
+    participants = list(dat['Participant'].unique())
+    groups = dat.groupby('Participant', sort=False).indices
+    nTrials = max(len(groups[p]) for p in participants)
+
+    err = np.zeros((len(participants), nTrials))
+    Xp = np.zeros((len(participants), nTrials, X.shape[1]))
+    mask = np.zeros((len(participants), nTrials), dtype=bool)
+    for i, p in enumerate(participants):
+        idx = groups[p]
+        err[i, :len(idx)] = np.radians(dat['error'].values[idx])
+        Xp[i, :len(idx)] = X[idx]
+        mask[i, :len(idx)] = True
+
+    return {'participants': participants, 'cosErr': np.cos(err), 'X': Xp, 'mask': mask}
+
+## Model ##
+
+def mixture_negLL(theta, cohort):
+    # negative log likelihood (per participant) and its gradient, for all participants at once
+    # theta: (participants, 2 * nCols) -> [bPmem, bKappa]
+    X, cosErr, mask = cohort['X'], cohort['cosErr'], cohort['mask']
+    nCols = X.shape[2]
+    bPmem, bKappa = theta[:, :nCols], theta[:, nCols:]
+
+    pmem = np.clip(expit(np.einsum('ptc,pc->pt', X, bPmem)), *pmemBounds)
+    kappa = np.clip(np.exp(np.einsum('ptc,pc->pt', X, bKappa)), *kappaBounds)
+
+    # von Mises density at the error (mean fixed at 0), using scaled Bessel functions so large kappa doesn't overflow
+    vm = np.exp(kappa * (cosErr - 1)) / (2 * np.pi * i0e(kappa))
+    lik = pmem * vm + (1 - pmem) / (2 * np.pi)
+
+    negLL = -np.sum(np.log(lik) * mask, axis=1)
+
+    # d(log lik) / d(linear predictor)
+    dPmem = (vm - 1 / (2 * np.pi)) * pmem * (1 - pmem) / lik * mask
+    dKappa = pmem * vm * (cosErr - i1e(kappa) / i0e(kappa)) * kappa / lik * mask
+    grad = -np.concatenate([np.einsum('pt,ptc->pc', dPmem, X), np.einsum('pt,ptc->pc', dKappa, X)], axis=1)
+
+    return negLL, grad
+
+def fit_cohort(cohort, start):
+    # fit every participant in one optimisation; participants are independent so the summed objective is separable
+    nPart, nParams = start.shape
+
+    def objective(flat):
+        negLL, grad = mixture_negLL(flat.reshape(nPart, nParams), cohort)
+        return negLL.sum(), grad.ravel()
+
+    res = minimize(objective, start.ravel(), jac=True, method='L-BFGS-B', options={'maxiter': 2000})
+    theta = res.x.reshape(nPart, nParams)
+    return theta, mixture_negLL(theta, cohort)[0]
+
+def fit_mixture(dat, covariates=(), kind='linear', startKappa=10, startPmem=0.7):
+    # returns one row per participant (and per covariate level for kind='cells') with Kappa, Pmem, AvError, Likelihood
+    # the covariate model is warm-started from each participant's intercept-only fit
+
+    X0, _ = design_matrix(dat)
+    base = compile_cohort(dat, X0)
+    start = np.tile([np.log(startPmem / (1 - startPmem)), np.log(startKappa)], (len(base['participants']), 1))
+    theta0, negLL0 = fit_cohort(base, start)
+
+    if not covariates:
+        theta, negLL, colNames = theta0, negLL0, ['intercept']
+    else:
+        X, colNames = design_matrix(dat, covariates, kind)
+        cohort = compile_cohort(dat, X)
+        nCols = X.shape[1]
+        warm = np.zeros((len(cohort['participants']), 2 * nCols))
+        if kind == 'cells':
+            warm[:, :nCols] = theta0[:, [0]] # every level starts at the participant's overall Pmem/Kappa
+            warm[:, nCols:] = theta0[:, [1]]
+        else:
+            warm[:, 0] = theta0[:, 0] # covariate slopes start at 0
+            warm[:, nCols] = theta0[:, 1]
+        theta, negLL = fit_cohort(cohort, warm)
+
+    avError = dat.assign(absErr=dat['error'].abs()).groupby('Participant', sort=False)['absErr'].mean()
+    nCols = len(colNames)
+    rows = []
+    for i, p in enumerate(dict.fromkeys(dat['Participant'])):
+        for c, name in enumerate(colNames):
+            row = {'Participant': p, 'term': name}
+            if kind == 'cells' or name == 'intercept':
+                row['Pmem'] = expit(theta[i, c])
+                row['Kappa'] = np.exp(theta[i, nCols + c])
+            row['bPmem'] = theta[i, c]
+            row['bKappa'] = theta[i, nCols + c]
+            row['AvError'] = avError[p]
+            row['Likelihood'] = negLL[i] # negative log likelihood of the whole participant's model, as in the R demo
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+if __name__ == '__main__':
+    here = os.path.dirname(os.path.abspath(__file__))
+    files = [f for a in sys.argv[1:] if a not in covariateColumns for f in glob.glob(a)] or glob.glob(os.path.join(here, '*.xlsx'))
+    covariates = [a for a in sys.argv[1:] if a in covariateColumns]
+
+    dat = load_em_data(files)
+    print(fit_mixture(dat))
+    for cov in covariates or covariateColumns:
+        print(fit_mixture(dat, [cov], kind='linear'))
+    if covariates:
+        print(fit_mixture(dat, covariates[:1], kind='cells'))
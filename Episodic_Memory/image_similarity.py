@@ -0,0 +1,149 @@
+'''
+Perceptual-hash similarity index for the Episodic Memory pictures
+
+Each picture gets a 64-bit difference hash (dHash): the image is shrunk to 9x8 grayscale pixels
+and each bit records whether a pixel is brighter than its right-hand neighbour.
+Pictures that look alike have hashes that differ in only a few bits (small Hamming distance).
+
+The hashes are cached on disk next to the image folder (e.g. 'Objects_160_hash_index.csv'),
+keyed by file name, size and modification time, so only new or changed pictures get hashed at launch.
+The index also caches each picture's neighbours (pictures closer than a minimum Hamming distance), one column
+per minimum distance used (e.g. 'neighbours_10'), so the pairwise distances are only computed when the pictures
+or the minimum distance change. Neighbour columns are dropped whenever a hash changes or pictures are added/removed.
+
+assemble_blocks() then draws a random trial order in which no two pictures in the same block
+are closer than a minimum Hamming distance, so visually similar objects do not end up in the same block.
+If that is not possible, it fails straight away with the highest minimum distance that works for these pictures.
+'''
+
+import csv, os, random
+import numpy
+from PIL import Image
+
+hashSize = 8 # hash is hashSize x hashSize bits
+
+def dhash(imageFile):
+    # difference hash of one image, as an unsigned 64-bit integer
+    img = Image.open(imageFile).convert('L').resize((hashSize+1, hashSize), Image.LANCZOS)
+    pixels = numpy.asarray(img, dtype=numpy.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int(numpy.packbits(bits).view('>u8')[0])
+
+def index_file_for(imageFiles):
+    return os.path.normpath(os.path.dirname(imageFiles[0])) + '_hash_index.csv'
+
+def load_hash_index(imageFiles, indexFile=None):
+    # returns an array of hashes in the same order as imageFiles, (re)hashing only pictures not already in the cache
+    hashes, neighbours = load_similarity_index(imageFiles, None, indexFile)
+    return hashes
+
+def load_similarity_index(imageFiles, minDistance, indexFile=None):
+    # returns the hashes (same order as imageFiles) and, for each picture, the indices of the pictures
+    # closer than minDistance (None -> hashes only), both from the cache when it is up to date
+    indexFile = indexFile or index_file_for(imageFiles)
+
+    cached = {}
+    fieldNames = []
+    if os.path.exists(indexFile):
+        with open(indexFile, newline='') as f:
+            reader = csv.DictReader(f)
+            cached = {row['image']: row for row in reader}
+            fieldNames = reader.fieldnames
+    neighbourColumns = [c for c in fieldNames if c.startswith('neighbours_')]
+
+    hashes = numpy.zeros(len(imageFiles), dtype=numpy.uint64)
+    rows = []
+    hashesChanged = len(imageFiles) != len(cached)
+    for i, imageFile in enumerate(imageFiles):
+        name = os.path.basename(imageFile)
+        stat = os.stat(imageFile)
+        row = cached.get(name)
+        if row is None or int(row['size']) != stat.st_size or float(row['mtime']) != stat.st_mtime:
+            row = {'image': name, 'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': '%016x' % dhash(imageFile)}
+            hashesChanged = True
+        hashes[i] = int(row['hash'], 16)
+        rows.append(row)
+    if hashesChanged: # neighbour lists are only valid for the exact set of hashes they were computed from
+        neighbourColumns = []
+
+    updated = hashesChanged
+    column = None if minDistance is None else 'neighbours_%d' % minDistance
+    if column is not None and column not in neighbourColumns:
+        tooSimilar = hamming_distances(hashes) < minDistance
+        numpy.fill_diagonal(tooSimilar, False)
+        for row, similar in zip(rows, tooSimilar):
+            row[column] = ';'.join(os.path.basename(imageFiles[j]) for j in numpy.flatnonzero(similar))
+        neighbourColumns.append(column)
+        updated = True
+
+    if updated:
+        tmpFile = indexFile + '.tmp'
+        with open(tmpFile, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['image', 'size', 'mtime', 'hash'] + sorted(neighbourColumns), extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(sorted(rows, key=lambda r: r['image']))
+        os.replace(tmpFile, indexFile)
+
+    if column is None:
+        return hashes, None
+    position = {os.path.basename(imageFile): i for i, imageFile in enumerate(imageFiles)}
+    neighbours = [numpy.array([position[name] for name in row[column].split(';') if name], dtype=int) for row in rows]
+    return hashes, neighbours
+
+def hamming_distances(hashes):
+    # all pairwise Hamming distances between hashes (n x n), using a byte lookup table rather than looping over pairs
+    popcount = numpy.array([bin(b).count('1') for b in range(256)], dtype=numpy.uint8)
+    xor = numpy.bitwise_xor(hashes[:, None], hashes[None, :])
+    return popcount[xor.view(numpy.uint8).reshape(len(hashes), len(hashes), 8)].sum(axis=2)
+
+def block_order(tooSimilar, blockLength, maxAttempts, rng):
+    # random greedy assembly: a random ordering of the pictures where no block holds two pictures marked tooSimilar,
+    # or None if maxAttempts random starts all run out of compatible pictures
+    nItems = len(tooSimilar)
+    if (nItems - 1 - tooSimilar.sum(axis=1)).min() < min(blockLength, nItems) - 1:
+        return None # a picture is too similar to so many others that it can't fill a block
+    for attempt in range(maxAttempts):
+        pool = list(range(nItems))
+        rng.shuffle(pool)
+        order = []
+        while pool:
+            blockConflicts = numpy.zeros(nItems, dtype=bool) # pictures too similar to something already in this block
+            block = []
+            for item in list(pool):
+                if not blockConflicts[item]:
+                    block.append(item)
+                    pool.remove(item)
+                    blockConflicts |= tooSimilar[item]
+                    if len(block) == blockLength:
+                        break
+            if len(block) < blockLength and pool: # ran out of compatible pictures for this block, start over
+                break
+            order.extend(block)
+        if len(order) == nItems:
+            return order
+    return None
+
+def achievable_distance(hashes, blockLength, below, maxAttempts=100):
+    # highest minimum distance under 'below' that block_order manages for these pictures
+    distances = hamming_distances(hashes)
+    numpy.fill_diagonal(distances, hashSize**2 + 1)
+    for minDistance in range(below - 1, 0, -1):
+        if block_order(distances < minDistance, blockLength, maxAttempts, random.Random(0)) is not None:
+            return minDistance
+    return 0
+
+def assemble_blocks(hashes, neighbours, blockLength, minDistance=10, maxAttempts=100, rng=random):
+    # returns a random ordering of range(len(hashes)) where every consecutive chunk of blockLength
+    # pictures has all pairwise hash distances >= minDistance
+    # neighbours: the pictures closer than minDistance to each picture (from load_similarity_index)
+    # uses the module-level 'random' by default, so the task's seed applies
+    nItems = len(hashes)
+    tooSimilar = numpy.zeros((nItems, nItems), dtype=bool)
+    for item, similar in enumerate(neighbours):
+        tooSimilar[item, similar] = True
+
+    order = block_order(tooSimilar, blockLength, maxAttempts, rng)
+    if order is None:
+        raise RuntimeError('Could not assemble blocks of %d pictures with minDistance=%d; the highest minDistance that works '
+                           'for these pictures is %d' % (blockLength, minDistance, achievable_distance(hashes, blockLength, minDistance, maxAttempts)))
+    return order
@@ -14,9 +14,14 @@ This can easily be removed from the script if the experimenter so chooses
 '''
 # Import
 from psychopy import visual, monitors, core, event, data, gui
-import pandas as pd
+from psychopy.hardware import keyboard
 import numpy as np
-import os
+import glob, os
+from PIL import Image
+from stimulus_sets import load_stimulus_set, image_path
+from event_log import start_log, log_event
+from rl_output import open_output, write_trials, close_output
+from session_checkpoint import checkpoint_file, save_checkpoint, load_checkpoint, remove_checkpoint
 
 # Set seed for randomization.
 # In this task, no consistent seed was used by CNTRACS (unlike in the WM and EM tasks)
@@ -29,13 +34,14 @@ sessionInfo = {
     'Seed'          :   seed,
     'TaskFile'      :   os.path.basename(__file__),
     'local_path'    :   os.getcwd(),
-    'set_id'        :   np.random.randint(1, 10),
+    'set_id'        :   np.random.randint(1, len(glob.glob(os.path.join(os.getcwd(), 'rlwmpst', 'V4', 'S_*'))) + 1), # S_1..S_n, see generate_stimulus_sets.py
     'task_id'       :   4,
     'responseWindow':   2.0,
     'feedbackDelay' :   0.5,
     'feedbackDuration': 1.0,
     'trainITI'      :   1.0,
-    'testITI'       :   1.0 
+    'testITI'       :   1.0,
+    'Resume'        :   False # continue a session from its last completed block, see session_checkpoint.py
     }
 
 ## Define a monitor
@@ -49,11 +55,17 @@ dlg = gui.DlgFromDict(
     sessionInfo,
     title='RLWMPST',
     fixed=['Date','Seed','TaskFile','local_path','set_id','task_id','responseWindow','feedbackDelay','feedbackDuration','trainITI','testITI'],
-    order=['Participant','Date','Seed','TaskFile','local_path','set_id','task_id','responseWindow','feedbackDelay','feedbackDuration','trainITI','testITI']
+    order=['Participant','Resume','Date','Seed','TaskFile','local_path','set_id','task_id','responseWindow','feedbackDelay','feedbackDuration','trainITI','testITI']
     )
 
 
 if dlg.OK:
+    checkpoint = None
+    if sessionInfo['Resume']:
+        # same set and date as the interrupted session
+        checkpoint = load_checkpoint(checkpoint_file(sessionInfo))
+        for field in ['Date','set_id','task_id']:
+            sessionInfo[field] = checkpoint[field]
     ## Create a visual window:
     mywin = visual.Window(
         size=my_monitor.getSizePix(),
@@ -73,6 +85,16 @@ if dlg.OK:
     loadingScreen.draw()
     mywin.flip()
     mouse = event.Mouse(visible = True, win = mywin)
+    kb = keyboard.Keyboard() # timestamped key events (psychtoolbox backend when available), used for the trial responses
+    # diagnostics go to a JSON lines file (and the console) from a background thread, see event_log.py
+    start_log(sessionInfo['TaskFile'][:-3]+"_events_"+sessionInfo['Date']+"_"+sessionInfo['Participant']+'.jsonl')
+    log_event('session', **sessionInfo)
+    # all phases go to one long-format file, written block by block, see rl_output.py
+    # (a resumed session gets its own file, so the interrupted one's is kept)
+    dataFile = sessionInfo['TaskFile'][:-3]+"_"+sessionInfo['Date']+"_"+sessionInfo['Participant']
+    if checkpoint is not None:
+        dataFile += '_resume'+str(checkpoint['blocksCompleted'])
+    dataOutput = open_output(dataFile+'.arrows', sessionInfo)
 else:
     core.quit()  # the user hit cancel so exit
 
@@ -81,9 +103,8 @@ else:
 # routes to a folder (s_1 thru S_11) in the V4 folder to load trial orders
 base_path = os.path.join(sessionInfo['local_path'], 'rlwmpst', 'V{}'.format(sessionInfo['task_id']), 'S_{}'.format(sessionInfo['set_id']))
 
-train_instruction_trials = pd.read_csv(os.path.join(base_path, 'train_instruction_10blocks.csv'), index_col=0)
-train_trials = pd.read_csv(os.path.join(base_path, 'train.csv'), index_col=0)
-test_trials = pd.read_csv(os.path.join(base_path, 'test.csv'), index_col=0)
+# trial orders are compiled into a binary bundle by stimulus_sets.py (validated there), see that script to recompile
+stimulusSet = load_stimulus_set(base_path)
 
 jCode = 13
 kCode = 14
@@ -92,16 +113,14 @@ lCode = 15
 ## make trial lists
 
 blockList=[]
-for block in list(range(0,len(train_instruction_trials))):
+for block in stimulusSet['blocks']:
     blockList.append({
-        'blockNumber'   :   block,
-        'setSize'       :   train_instruction_trials['set size'][block],
-        'imageFolder'   :   train_instruction_trials['image folder'][block],
-        'image1'        :   train_instruction_trials['image1'][block],
-        'image2'        :   train_instruction_trials['image2'][block],
-        'image3'        :   train_instruction_trials['image3'][block],
-        'image4'        :   train_instruction_trials['image4'][block],
-        'image5'        :   train_instruction_trials['image5'][block]
+        'blockNumber'   :   len(blockList),
+        'setSize'       :   int(block['setSize']),
+        'imageFolder'   :   int(block['imageFolder']),
+        'previewPaths'  :   [image_path(block['imageFolder'], x) for x in block['images'][:block['setSize']]], # preview images, in stimulus order
+        'trialStart'    :   int(block['trialStart']), # training trials of this block are trainList[trialStart:trialStop]
+        'trialStop'     :   int(block['trialStop'])
         })
 
 pracList=[]
@@ -128,6 +147,7 @@ for x in list(range(0,10)):
         'trialSetSize'      :   2,
         'trialStimFolder'   :   99,
         'trialStimID'       :   (x%2)+1,
+        'trialStimPath'     :   image_path(99, (x%2)+1),
         'trialStimInBlockID':   'NA',
         'trialStimOverallID':   'NA',
         'trialCorrectKey'   :   correctKey,
@@ -149,18 +169,14 @@ for x in list(range(0,10)):
         'resp'              :   0,
         'respACC'           :   0,
         'respKey'           :   '?',
-        'respRT'            :   0.0
+        'respRT'            :   0.0,
+        'achievedITI'       :   0.0, # measured from the flips
+        'achievedFeedbackDelay'     :   0.0,
+        'achievedFeedbackDuration'  :   0.0
         })
 
 trainList = []
-for x in list(range(0,len(train_trials))):
-    if train_trials['correct key#'][x] == jCode:
-        correctKey = 'j'
-    if train_trials['correct key#'][x] == kCode:
-        correctKey = 'k'
-    if train_trials['correct key#'][x] == lCode:
-        correctKey = 'l'
-   
+for x, stim in enumerate(stimulusSet['train']):
     trainList.append({
         'Participant'       :   sessionInfo['Participant'],
         'Date'              :   sessionInfo['Date'],
@@ -172,16 +188,17 @@ for x in list(range(0,len(train_trials))):
         'trainITI'          :   sessionInfo['trainITI'],
         'testITI'           :   sessionInfo['testITI'],
         'blockType'         :   'train',
-        'blockNumber'       :   train_trials['block #'][x],
+        'blockNumber'       :   int(stim['blockNumber']),
         'trialNumber'       :   x,
-        'trialSetSize'      :   train_trials['set size'][x],
-        'trialStimFolder'   :   train_trials['image folder'][x],
-        'trialStimID'       :   train_trials['image number'][x],
-        'trialStimInBlockID':   train_trials['in block stim #'][x],
-        'trialStimOverallID':   train_trials['overall stimulus id'][x],
-        'trialCorrectKey'   :   correctKey,
-        'trialCorrectProb'  :   train_trials['2/1 correct FB proba'][x],
-        'trialCorrectFBVal' :   train_trials['CorrectFB value'][x],
+        'trialSetSize'      :   int(stim['setSize']),
+        'trialStimFolder'   :   int(stim['imageFolder']),
+        'trialStimID'       :   int(stim['imageNumber']),
+        'trialStimPath'     :   str(stim['imagePath']),
+        'trialStimInBlockID':   int(stim['inBlockStimID']),
+        'trialStimOverallID':   int(stim['overallStimID']),
+        'trialCorrectKey'   :   str(stim['correctKey']),
+        'trialCorrectProb'  :   float(stim['correctProb']),
+        'trialCorrectFBVal' :   int(stim['correctFBVal']),
         'trialSetSize_Left'         :   'NA',
         'trialSetSize_Right'        :   'NA',
         'trialStimBlockNum_Left'    :   'NA',
@@ -199,11 +216,14 @@ for x in list(range(0,len(train_trials))):
         'respACC'           :   0,
         'respKey'           :   '?',
         'respRT'            :   0.0,
+        'achievedITI'       :   0.0, # measured from the flips
+        'achievedFeedbackDelay'     :   0.0,
+        'achievedFeedbackDuration'  :   0.0,
         'totalPoints'       :   0
         })
 
 testList = []
-for x in list(range(0,len(test_trials))):
+for x, stim in enumerate(stimulusSet['test']):
     testList.append({
         'Participant'       :   sessionInfo['Participant'],
         'Date'              :   sessionInfo['Date'],
@@ -226,23 +246,26 @@ for x in list(range(0,len(test_trials))):
         'trialCorrectKey'   :   'NA',
         'trialCorrectProb'  :   'NA',
         'trialCorrectFBVal' :   'NA',
-        'trialSetSize_Left'         :   test_trials['left set size'][x],
-        'trialSetSize_Right'        :   test_trials['right set size'][x],
-        'trialStimBlockNum_Left'    :   test_trials['left block number'][x],
-        'trialStimBlockNum_Right'   :   test_trials['right block number'][x],
-        'trialStimFolder_Left'      :   test_trials['left image folder'][x],
-        'trialStimFolder_Right'     :   test_trials['right image folder'][x],
-        'trialStimID_Left'          :   test_trials['left image number'][x],
-        'trialStimID_Right'         :   test_trials['right image number'][x],
-        'trialStimOverallID_Left'   :   test_trials['left stimulus id'][x],
-        'trialStimOverallID_Right'  :   test_trials['right stimulus id'][x],
-        'trialCorrectProb_Left'     :   test_trials['left stim value'][x],
-        'trialCorrectProb_Right'    :   test_trials['right stim value'][x],
+        'trialSetSize_Left'         :   int(stim['left_setSize']),
+        'trialSetSize_Right'        :   int(stim['right_setSize']),
+        'trialStimBlockNum_Left'    :   int(stim['left_blockNumber']),
+        'trialStimBlockNum_Right'   :   int(stim['right_blockNumber']),
+        'trialStimFolder_Left'      :   int(stim['left_imageFolder']),
+        'trialStimFolder_Right'     :   int(stim['right_imageFolder']),
+        'trialStimID_Left'          :   int(stim['left_imageNumber']),
+        'trialStimID_Right'         :   int(stim['right_imageNumber']),
+        'trialStimPath_Left'        :   str(stim['left_imagePath']),
+        'trialStimPath_Right'       :   str(stim['right_imagePath']),
+        'trialStimOverallID_Left'   :   int(stim['left_overallStimID']),
+        'trialStimOverallID_Right'  :   int(stim['right_overallStimID']),
+        'trialCorrectProb_Left'     :   float(stim['left_stimValue']),
+        'trialCorrectProb_Right'    :   float(stim['right_stimValue']),
         'trialOnset'        :   0, #not yet set
         'resp'              :   0,
         'respACC'           :   'NA',
         'respKey'           :   '?',
-        'respRT'            :   0.0
+        'respRT'            :   0.0,
+        'achievedITI'       :   0.0 # measured from the flips
         })
 
 practiceTrials = data.TrialHandler(
@@ -251,8 +274,17 @@ practiceTrials = data.TrialHandler(
     method='sequential',
     dataTypes=[]
     )
+firstBlock = 0
+firstTrial = 0
+if checkpoint is not None:
+    # results of the blocks already done (they are in the interrupted session's data file)
+    for savedTrial in checkpoint['trials']:
+        trainList[savedTrial['trialNumber']].update(savedTrial)
+    firstBlock = checkpoint['blocksCompleted']
+    firstTrial = checkpoint['nextTrial']
+
 trainingTrials = data.TrialHandler(
-    trialList=trainList[0:len(trainList)],
+    trialList=trainList[firstTrial:len(trainList)],
     nReps=1,
     method='sequential',
     dataTypes=[]
@@ -274,139 +306,165 @@ def save_data():
     savingScreen.setAutoDraw(True)
     savingScreen.draw()
     mywin.flip()
-    ## create the datafile
-    practiceTrials.saveAsExcel(
-        fileName=sessionInfo['TaskFile'][:-3]+"_practice_"+sessionInfo['Date']+"_"+sessionInfo['Participant']+'_TRT_'+str(sessionInfo['Session'])+'.csv',
-        sheetName = sessionInfo['Participant']+"_"+sessionInfo['Date'],
-        stimOut=[
-            'Participant',
-            'Date',
-            'Seed',
-            'set_id',
-            'responseWindow',
-            'feedbackDelay',
-            'feedbackDuration',
-            'trainITI',
-            'testITI',
-            'blockType',
-            'blockNumber',
-            'trialNumber',
-            'trialSetSize',
-            'trialStimFolder',
-            'trialStimID',
-            'trialStimInBlockID',
-            'trialStimOverallID',
-            'trialCorrectKey',
-            'trialCorrectProb',
-            'trialCorrectFBVal',
-            'trialSetSize_Left',
-            'trialSetSize_Right',
-            'trialStimBlockNum_Left',
-            'trialStimBlockNum_Right',
-            'trialStimFolder_Left',
-            'trialStimFolder_Right',
-            'trialStimID_Left',
-            'trialStimID_Right',
-            'trialStimOverallID_Left',
-            'trialStimOverallID_Right',
-            'trialCorrectProb_Left',
-            'trialCorrectProb_Right',
-            'trialOnset',
-            'resp',
-            'respACC',
-            'respKey',
-            'respRT'
-        ]
-    )
-    trainingTrials.saveAsExcel(
-        fileName=sessionInfo['TaskFile'][:-3]+"_training_"+sessionInfo['Date']+"_"+sessionInfo['Participant']+'_TRT_'+str(sessionInfo['Session'])+'.csv',
-        sheetName = sessionInfo['Participant']+"_"+sessionInfo['Date'],
-        stimOut=[
-            'Participant',
-            'Date',
-            'Seed',
-            'set_id',
-            'responseWindow',
-            'feedbackDelay',
-            'feedbackDuration',
-            'trainITI',
-            'testITI',
-            'blockType',
-            'blockNumber',
-            'trialNumber',
-            'trialSetSize',
-            'trialStimFolder',
-            'trialStimID',
-            'trialStimInBlockID',
-            'trialStimOverallID',
-            'trialCorrectKey',
-            'trialCorrectProb',
-            'trialCorrectFBVal',
-            'trialSetSize_Left',
-            'trialSetSize_Right',
-            'trialStimBlockNum_Left',
-            'trialStimBlockNum_Right',
-            'trialStimFolder_Left',
-            'trialStimFolder_Right',
-            'trialStimID_Left',
-            'trialStimID_Right',
-            'trialStimOverallID_Left',
-            'trialStimOverallID_Right',
-            'trialCorrectProb_Left',
-            'trialCorrectProb_Right',
-            'trialOnset',
-            'resp',
-            'respACC',
-            'respKey',
-            'respRT',
-            'totalPoints'
-        ]
-    )
-    testTrials.saveAsExcel(
-        fileName=sessionInfo['TaskFile'][:-3]+"_test_"+sessionInfo['Date']+"_"+sessionInfo['Participant']+'_TRT_'+str(sessionInfo['Session'])+'.csv',
-        sheetName = sessionInfo['Participant']+"_"+sessionInfo['Date'],
-        stimOut=[
-            'Participant',
-            'Date',
-            'Seed',
-            'set_id',
-            'responseWindow',
-            'feedbackDelay',
-            'feedbackDuration',
-            'trainITI',
-            'testITI',
-            'blockType',
-            'blockNumber',
-            'trialNumber',
-            'trialSetSize',
-            'trialStimFolder',
-            'trialStimID',
-            'trialStimInBlockID',
-            'trialStimOverallID',
-            'trialCorrectKey',
-            'trialCorrectProb',
-            'trialCorrectFBVal',
-            'trialSetSize_Left',
-            'trialSetSize_Right',
-            'trialStimBlockNum_Left',
-            'trialStimBlockNum_Right',
-            'trialStimFolder_Left',
-            'trialStimFolder_Right',
-            'trialStimID_Left',
-            'trialStimID_Right',
-            'trialStimOverallID_Left',
-            'trialStimOverallID_Right',
-            'trialCorrectProb_Left',
-            'trialCorrectProb_Right',
-            'trialOnset',
-            'resp',
-            'respACC',
-            'respKey',
-            'respRT'
-        ]
-    )
+    save_block()
+    close_output(dataOutput)
+
+completedTrials = [] # run but not yet written
+def save_block():
+    # writes the trials run since the last call as one batch
+    write_trials(dataOutput, completedTrials)
+    del completedTrials[:]
 # end save function
 
+# Stimulus cache
+# Every image gets its own ImageStim, created (decoded from disk and uploaded as a texture) once, ahead of time:
+# a block's images while its preview screen is up, the test images during the test instructions.
+# Trials then just pick the ready-made stimulus, so no trial or feedback screen includes disk I/O.
+# Each file is decoded once (decodedImages), for both its ImageStim and the block previews it appears in.
+decodedImages = {}
+def load_image(imagePath):
+    # imagePath is relative to the task folder and '/' separated (as compiled by stimulus_sets.py)
+    if imagePath not in decodedImages:
+        image = Image.open(os.path.join(sessionInfo['local_path'], *imagePath.split('/')))
+        decodedImages[imagePath] = image.convert('RGBA')
+        image.close()
+    return decodedImages[imagePath]
+
+imageCache = {}
+def get_image_stim(imagePath):
+    if imagePath not in imageCache:
+        imageCache[imagePath] = visual.ImageStim(
+            win=mywin, name='Image',units='deg', 
+            image=load_image(imagePath), mask=None,
+            ori=0, pos=(0, 0), size=5.0)
+    return imageCache[imagePath]
+
+def preload_images(trialList, pathKey):
+    for trial in trialList:
+        get_image_stim(trial[pathKey])
+
+# Block previews
+# The preview images of a block sit in a row, centred, previewSpacing deg apart, for any set size.
+# The row is composed into one texture (transparent between the pictures), so a preview is a single ImageStim draw,
+# and a block's preview is created as a unit when the task loads.
+previewSpacing = 6 # deg between picture centres
+previewSize = 5.0 # deg, same as the trial images
+previewCache = {}
+def preview_positions(setSize):
+    # x position (deg) of each picture in the row
+    return (np.arange(setSize) - (setSize-1)/2.0)*previewSpacing
+
+def get_preview_stim(imagePaths):
+    key = tuple(imagePaths)
+    if key not in previewCache:
+        images = [load_image(path) for path in imagePaths] # decoded once, shared with the trial images
+        pxPerDeg = images[0].size[0]/previewSize
+        xs = preview_positions(len(images))
+        rowWidth = xs[-1] - xs[0] + previewSize # deg
+        row = Image.new('RGBA', (int(round(rowWidth*pxPerDeg)), int(round(previewSize*pxPerDeg))), (0,0,0,0))
+        for image, x in zip(images, xs):
+            image = image.resize((int(round(previewSize*pxPerDeg)),)*2)
+            row.paste(image, (int(round((x - xs[0])*pxPerDeg)), 0))
+        previewCache[key] = visual.ImageStim(
+            win=mywin, name='Preview',units='deg', 
+            image=row, mask=None,
+            ori=0, pos=(0, 0), size=(rowWidth, previewSize))
+    return previewCache[key]
+
+# Frame-driven timing
+# Each phase of a trial is a number of flips, and onsets are the flip timestamps, read from 'clock' on the flip.
+# Response keys come from the Keyboard, whose clock is reset on the stimulus flip,
+# so RT is from stimulus onset to the key event's own timestamp.
+def n_frames(secs):
+    return max(1, int(round(secs/frameDur)))
+
+def flip():
+    # mywin.flip() returns core.monotonicClock time, not 'clock' time, so 'clock' is read on the flip (callOnFlip runs right after the buffer swap)
+    flipTime = []
+    mywin.callOnFlip(lambda: flipTime.append(clock.getTime()))
+    mywin.flip()
+    return flipTime[0]
+
+def present_frames(nFrames, quitKeys=['escape']):
+    # flips nFrames times (stimuli set to autoDraw stay on), returns the time of the first flip
+    for frame in range(nFrames):
+        if kb.getKeys(keyList=quitKeys, waitRelease=False):
+            save_data()
+            mywin.close()
+            core.quit()
+        flipTime = flip()
+        if frame == 0:
+            onset = flipTime
+    return onset
+
+def collect_response(nFrames, respKeys):
+    # shows the stimuli (already set to autoDraw) until a key is pressed or nFrames flips have passed (nFrames=None -> no limit)
+    # returns the stimulus onset and the keys detected on the first frame that had any
+    mywin.callOnFlip(kb.clock.reset)
+    mywin.callOnFlip(kb.clearEvents)
+    frame = 0
+    keys = []
+    while nFrames is None or frame < nFrames:
+        flipTime = flip()
+        if frame == 0:
+            onset = flipTime
+        keys = kb.getKeys(keyList=respKeys+['escape'], waitRelease=False)
+        if keys:
+            break
+        frame += 1
+    if 'escape' in [key.name for key in keys]:
+        save_data()
+        mywin.close()
+        core.quit()
+    return onset, keys
+
+def run_learning_trial(trial, trialStims):
+    # one practice/training trial: ITI, stimulus until response (or responseWindow), feedback delay, feedback
+    # returns True if the response was correct
+    accuracy = False
+
+    itiOnset = present_frames(n_frames(trial['trainITI'])) # blank
+
+    for stim in trialStims:
+        stim.setAutoDraw(True)
+    trial['trialOnset'], keys = collect_response(n_frames(trial['responseWindow']), ['j','k','l'])
+    trial['achievedITI'] = trial['trialOnset'] - itiOnset
+
+    if len(keys) == 1:
+        accuracy = keys[0].name == trial['trialCorrectKey']
+        trial['respACC'] = int(accuracy)
+        trial['resp'] = 1
+        trial['respKey'] = keys[0].name
+        trial['respRT'] = keys[0].rt
+    elif len(keys) > 1:
+        trial['respACC'] = 0
+        trial['resp'] = 1
+        trial['respKey'] = [key.name for key in keys]
+        trial['respRT'] = keys[0].rt
+    responded = len(keys) > 0
+
+    for stim in trialStims:
+        stim.setAutoDraw(False)
+    delayOnset = present_frames(n_frames(trial['feedbackDelay'])) # first flip removes the stimulus
+
+    if not responded:
+        feedbackStim = noResponseText
+    elif not accuracy:
+        feedbackStim = rewardStims[0]
+    else:
+        feedbackStim = rewardStims[int(trial['trialCorrectFBVal'])]
+    feedbackStim.setAutoDraw(True)
+    feedbackOnset = present_frames(n_frames(trial['feedbackDuration']), quitKeys=['escape','q'])
+    trial['achievedFeedbackDelay'] = feedbackOnset - delayOnset
+
+    feedbackStim.setAutoDraw(False)
+    trial['achievedFeedbackDuration'] = flip() - feedbackOnset
+    log_event('trial', blockType=trial['blockType'], trialNumber=trial['trialNumber'], keys=[key.name for key in keys],
+        mashed=len(keys) > 1, correctKey=trial['trialCorrectKey'], respACC=trial['respACC'], respRT=trial['respRT'],
+        achievedITI=trial['achievedITI'], achievedFeedbackDelay=trial['achievedFeedbackDelay'], achievedFeedbackDuration=trial['achievedFeedbackDuration'])
+    kb.clearEvents()
+    return accuracy
+
 
 
 
@@ -525,38 +583,14 @@ testPrompt = visual.TextStim(
     pos = (0,-5),
     text = 'Press 1 to select the left image, and 0 to select the right image.'
     )
-demoStim1 = visual.ImageStim(
-    win=mywin, name='Image',units='deg', 
-    image=os.path.join(sessionInfo['local_path'],'rlwmpst','images99','image1.jpg'), mask=None,
-    ori=0, pos=(-12, 0), size=5.0)
-demoStim2 = visual.ImageStim(
-    win=mywin, name='Image',units='deg', 
-    image=os.path.join(sessionInfo['local_path'],'rlwmpst','images99','image2.jpg'), mask=None,
-    ori=0, pos=(-6, 0), size=5.0)
-demoStim3 = visual.ImageStim(
-    win=mywin, name='Image',units='deg', 
-    image=os.path.join(sessionInfo['local_path'],'rlwmpst','images99','image1.jpg'), mask=None,
-    ori=0, pos=(0, 0), size=5.0)
-demoStim4 = visual.ImageStim(
-    win=mywin, name='Image',units='deg', 
-    image=os.path.join(sessionInfo['local_path'],'rlwmpst','images99','image2.jpg'), mask=None,
-    ori=0, pos=(6, 0), size=5.0)
-demoStim5 = visual.ImageStim(
-    win=mywin, name='Image',units='deg', 
-    image=os.path.join(sessionInfo['local_path'],'rlwmpst','images99','image1.jpg'), mask=None,
-    ori=0, pos=(12, 0), size=5.0)
-trialStimA = visual.ImageStim(
-    win=mywin, name='Image',units='deg', 
-    image=os.path.join(sessionInfo['local_path'],'rlwmpst','images99','image1.jpg'), mask=None,
-    ori=0, pos=(0, 0), size=5.0)
-trialStimB = visual.ImageStim(
-    win=mywin, name='Image',units='deg', 
-    image=os.path.join(sessionInfo['local_path'],'rlwmpst','images99','image2.jpg'), mask=None,
-    ori=0, pos=(3, 0), size=5.0)
-currentReward = visual.ImageStim(
-    win=mywin, name='Image',units='deg', 
-    image=os.path.join(sessionInfo['local_path'],'rlwmpst','reward_images','zero.png'), mask=None,
-    ori=0, pos=(0, 0), size=5.0)
+# one stimulus per feedback image, so feedback screens never load an image
+rewardStims = {}
+for rewardVal, rewardImage in [(0, 'zero.png'), (1, 'small_reward.png'), (2, 'large_reward.png')]:
+    rewardStims[rewardVal] = visual.ImageStim(
+        win=mywin, name='Image',units='deg', 
+        image=os.path.join(sessionInfo['local_path'],'rlwmpst','reward_images',rewardImage), mask=None,
+        ori=0, pos=(0, 0), size=5.0)
+currentReward = rewardStims[0]
 backButton = visual.ImageStim(
     win=mywin, name='Image',units='deg', 
     image=os.path.join(sessionInfo['local_path'],'rlwmpst','back.jpg'), mask=None,
@@ -568,234 +602,135 @@ forwardButton = visual.ImageStim(
 backButton.size     *= [1,0.5]
 forwardButton.size  *= [1,0.5]
 
+preload_images(pracList, 'trialStimPath') # practice images
+demoPreview = get_preview_stim([image_path(99,1), image_path(99,2)]) # preview shown in the instructions
+for block in blockList:
+    get_preview_stim(block['previewPaths'])
+
 loadingScreen.setAutoDraw(False)
 
 mywin.flip()
 clock = core.Clock() #start global clock
-
-# new instructions
-intro_text.setAutoDraw(True)
-forwardButton.setAutoDraw(True)
-i = 0
-while i < len(intro_textText):
-    if i > 0:
-        backButton.setAutoDraw(True)
+frameRate = mywin.getMsPerFrame(nFrames=60, showVisual=False, msg='', msDelay=0.0)
+frameDur = frameRate[0]/1000 # seconds
+
+if checkpoint is None:
+    # new instructions
+    intro_text.setAutoDraw(True)
+    forwardButton.setAutoDraw(True)
+    i = 0
+    while i < len(intro_textText):
+        if i > 0:
+            backButton.setAutoDraw(True)
     
-    intro_text.setText(intro_textText[i])
-    mywin.flip()
+        intro_text.setText(intro_textText[i])
+        mywin.flip()
     
-    allKeys = event.getKeys(keyList=['escape', 'left', 'right'])
-    for thisKey in allKeys:
-        if thisKey in ['escape']:
-            mywin.close()
-            core.quit()
+        allKeys = event.getKeys(keyList=['escape', 'left', 'right'])
+        for thisKey in allKeys:
+            if thisKey in ['escape']:
+                mywin.close()
+                core.quit()
             
-        if thisKey in ['left']:
+            if thisKey in ['left']:
+                i -=1
+                core.wait(.20)
+            if thisKey in ['right']:
+                i +=1
+                core.wait(.20)
+    
+        if mouse.isPressedIn(backButton):
             i -=1
             core.wait(.20)
-        if thisKey in ['right']:
-            i +=1
-            core.wait(.20)
-    
-    if mouse.isPressedIn(backButton):
-        i -=1
-        core.wait(.20)
         
-    if mouse.isPressedIn(forwardButton):
-        i += 1
-        core.wait(.20)
-    
-    event.clearEvents()
-
-backButton.setAutoDraw(False)
-forwardButton.setAutoDraw(False)
-intro_text.setAutoDraw(False)
-mouse.setVisible(False)
-
-demo_text.setAutoDraw(True)
-for x in range(0,len(demo_textText)):
-    demo_text.setText(demo_textText[x])
-    if x == len(demo_textText)-1:
-        demoStim1.pos = (-3,0)
-        demoStim2.pos = (3,0)
-        demoStim1.setAutoDraw(True)
-        demoStim2.setAutoDraw(True)
-        demo_text.pos = (0,5)
+        if mouse.isPressedIn(forwardButton):
+            i += 1
+            core.wait(.20)
     
-    mywin.flip()
-    allKeys = event.waitKeys(keyList=['escape','j','k','l','space'])
-    for thisKey in allKeys:
-        if thisKey in ['escape']:
-            mywin.close()
-            core.quit()
-        elif thisKey in ['j','k','l','space']:
-            event.clearEvents()
-
-demoStim1.setAutoDraw(False)
-demoStim2.setAutoDraw(False)
-demoStim1.pos = (-12,0)
-demoStim2.pos = (-6,0)
-demo_text.pos = (0,0)
-demo_text.setAutoDraw(False)
-
-mywin.flip()
+        event.clearEvents()
 
-# PRACTICE #
-for trial in practiceTrials:
+    backButton.setAutoDraw(False)
+    forwardButton.setAutoDraw(False)
+    intro_text.setAutoDraw(False)
+    mouse.setVisible(False)
 
-    accuracy = False
-    responded = False
-    allKeys = event.waitKeys(maxWait=trial['trainITI'],keyList=['escape'])
-    for thisKey in allKeys or []:
-        if thisKey in ['escape']:
-            save_data()
-            mywin.close()
-            core.quit()
-    trialStimA.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(trial['trialStimFolder']),'image'+str(trial['trialStimID'])+'.jpg')
-    trialStimA.setAutoDraw(True)
-    practiceText1.setAutoDraw(True)
-    practiceText2.setAutoDraw(True)
-    
-    mywin.flip()
-    trial['trialOnset'] = clock.getTime()
+    demo_text.setAutoDraw(True)
+    for x in range(0,len(demo_textText)):
+        demo_text.setText(demo_textText[x])
+        if x == len(demo_textText)-1:
+            demoPreview.setAutoDraw(True)
+            demo_text.pos = (0,5)
     
-    allKeys = event.waitKeys(maxWait=trial['responseWindow'],keyList=['j','k','l','escape'])
-    print(allKeys)
-    if allKeys and len(allKeys) == 1:
-        print('no mashing detected')
+        mywin.flip()
+        allKeys = event.waitKeys(keyList=['escape','j','k','l','space'])
         for thisKey in allKeys:
-            if thisKey in ['escape',]:
-                save_data()
+            if thisKey in ['escape']:
                 mywin.close()
                 core.quit()
-            elif thisKey in ['j','k','l']:
-                if thisKey == trial['trialCorrectKey']:
-                    trial['respACC'] = 1
-                    accuracy = True
-                else:
-                    trial['respACC'] = 0
-                    accuracy = False
-        trial['resp'] = 1
-        trial['respKey'] = thisKey
-        trial['respRT'] = clock.getTime()-trial['trialOnset']
-        responded = True
-    elif allKeys and len(allKeys) >> 1:
-        print('buttons mashed')
-        trial['respACC'] = 0
-        accuracy = False
-        trial['resp'] = 1
-        trial['respKey'] = allKeys
-        trial['respRT'] = clock.getTime()-trial['trialOnset']
-        responded = True
-    else:
-        responded = False
+            elif thisKey in ['j','k','l','space']:
+                event.clearEvents()
+
+    demoPreview.setAutoDraw(False)
+    demo_text.pos = (0,0)
+    demo_text.setAutoDraw(False)
 
-    event.clearEvents()
-    trialStimA.setAutoDraw(False)
-    practiceText1.setAutoDraw(False)
-    practiceText2.setAutoDraw(False)
     mywin.flip()
-    
-    allKeys = event.waitKeys(maxWait=trial['feedbackDelay'],keyList=['escape'])
-    for thisKey in allKeys or []:
-        if thisKey in ['escape']:
-            save_data()
-            mywin.close()
-            core.quit()
-    if not responded:
-        noResponseText.setAutoDraw(True)
-    elif responded and not accuracy:
-        currentReward.image = os.path.join(sessionInfo['local_path'],'rlwmpst','reward_images','zero.png')
-        currentReward.setAutoDraw(True)
-    else:
-        if trial['trialCorrectFBVal'] == 1:
-            currentReward.image = os.path.join(sessionInfo['local_path'],'rlwmpst','reward_images','small_reward.png')
-        elif trial['trialCorrectFBVal'] == 2:
-            currentReward.image = os.path.join(sessionInfo['local_path'],'rlwmpst','reward_images','large_reward.png')
-        currentReward.setAutoDraw(True)
-    
+
+    # PRACTICE #
+    for trial in practiceTrials:
+        run_learning_trial(trial, [get_image_stim(trial['trialStimPath']), practiceText1, practiceText2])
+        completedTrials.append(trial)
+    save_block()
+
+    # practice is over
+    intro_text.setText(
+        'End of practice, do you have any questions?\n\n'
+        '       [Press space to continue.]'
+        )
+
+    intro_text.draw()
     mywin.flip()
-        
-    allKeys = event.waitKeys(maxWait=trial['feedbackDuration'],keyList=['escape','q'])
-    for thisKey in allKeys or []:
-        if thisKey in ['escape','q']:
-            save_data()
+
+    allKeys = event.waitKeys(keyList=['escape','j','k','l','space'])
+    for thisKey in allKeys:
+        if thisKey in ['escape']:
             mywin.close()
             core.quit()
-    currentReward.setAutoDraw(False)
-    noResponseText.setAutoDraw(False)
-    mywin.flip()
-
-# practice is over
-intro_text.setText(
-    'End of practice, do you have any questions?\n\n'
-    '       [Press space to continue.]'
-    )
-
-intro_text.draw()
-mywin.flip()
+        elif thisKey in ['j','k','l','space']:
+            event.clearEvents()
 
-allKeys = event.waitKeys(keyList=['escape','j','k','l','space'])
-for thisKey in allKeys:
-    if thisKey in ['escape']:
+    core.wait(1)
+else:
+    intro_text.setText(
+        'Welcome back! The task continues with block ' + str(firstBlock) + '.\n\n'
+        '       [Press space to continue.]'
+        )
+    intro_text.draw()
+    mywin.flip()
+    allKeys = event.waitKeys(keyList=['escape','space'])
+    if 'escape' in allKeys:
         mywin.close()
         core.quit()
-    elif thisKey in ['j','k','l','space']:
-        event.clearEvents()
-
-core.wait(1)
+    mouse.setVisible(False)
+    core.wait(1)
 
 # #
 
 # TRAIN #
 totalPoints = 0
 newBlockTrialNum = 0
-for currentBlock in range(0,len(blockList)):
-
-    if blockList[currentBlock]['setSize'] == 5:
-        demoStim1.setAutoDraw(True)
-        demoStim2.setAutoDraw(True)
-        demoStim3.setAutoDraw(True)
-        demoStim4.setAutoDraw(True)
-        demoStim5.setAutoDraw(True)
-        demoStim1.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image1']))+'.jpg') # added int()
-        demoStim2.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image2']))+'.jpg')
-        demoStim3.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image3']))+'.jpg')
-        demoStim4.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image4']))+'.jpg')
-        demoStim5.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image5']))+'.jpg')
-    elif blockList[currentBlock]['setSize'] == 4:
-        demoStim1.pos = (-9,0)
-        demoStim2.pos = (-3,0)
-        demoStim3.pos = (3,0)
-        demoStim4.pos = (9,0)
-        demoStim1.setAutoDraw(True)
-        demoStim2.setAutoDraw(True)
-        demoStim3.setAutoDraw(True)
-        demoStim4.setAutoDraw(True)
-        demoStim1.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image1']))+'.jpg')
-        demoStim2.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image2']))+'.jpg')
-        demoStim3.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image3']))+'.jpg')
-        demoStim4.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image4']))+'.jpg')
-    elif blockList[currentBlock]['setSize'] == 3:
-        demoStim1.pos = (-6,0)
-        demoStim2.pos = (0,0)
-        demoStim3.pos = (6,0)
-        demoStim1.setAutoDraw(True)
-        demoStim2.setAutoDraw(True)
-        demoStim3.setAutoDraw(True)
-        demoStim1.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image1']))+'.jpg')
-        demoStim2.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image2']))+'.jpg')
-        demoStim3.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image3']))+'.jpg')
-    elif blockList[currentBlock]['setSize'] == 2:
-        demoStim1.pos = (-3,0)
-        demoStim2.pos = (3,0)
-        demoStim1.setAutoDraw(True)
-        demoStim2.setAutoDraw(True)
-        demoStim1.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image1']))+'.jpg')
-        demoStim2.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(blockList[currentBlock]['imageFolder'])),'image'+str(int(blockList[currentBlock]['image2']))+'.jpg')
+if checkpoint is not None:
+    totalPoints = checkpoint['totalPoints']
+    newBlockTrialNum = firstTrial
+for currentBlock in range(firstBlock,len(blockList)):
+
+    blockPreview = get_preview_stim(blockList[currentBlock]['previewPaths'])
+    blockPreview.setAutoDraw(True)
     demo_text.setAutoDraw(True)
     demo_text.pos = (0,5)
     mywin.flip()
+    # load this block's trial images while the preview is up (it waits for a key anyway)
+    preload_images(trainList[blockList[currentBlock]['trialStart']:blockList[currentBlock]['trialStop']], 'trialStimPath')
     allKeys = event.waitKeys(keyList=['escape','space','j','k','l'])
     for thisKey in allKeys:
         if thisKey in ['escape']:
@@ -803,113 +738,28 @@ for currentBlock in range(0,len(blockList)):
             core.quit()
         elif thisKey in ['space','j','k','l']:
             event.clearEvents()
-    demoStim1.setAutoDraw(False)
-    demoStim2.setAutoDraw(False)
-    demoStim3.setAutoDraw(False)
-    demoStim4.setAutoDraw(False)
-    demoStim5.setAutoDraw(False)
+    blockPreview.setAutoDraw(False)
     demo_text.setAutoDraw(False)
-    demoStim1.pos = (-12,0)
-    demoStim2.pos = (-6,0)
-    demoStim3.pos = (0,0)
-    demoStim4.pos = (6,0)
-    demoStim5.pos = (12,0)
     
     mywin.flip()
     
     # start block
     for num, trial in enumerate(trainingTrials, start=newBlockTrialNum):
         
-        accuracy = False
-        responded = False
-        
-        allKeys = event.waitKeys(maxWait=trial['trainITI'],keyList=['escape'])
-        for thisKey in allKeys or []:
-            if thisKey in ['escape']:
-                save_data()
-                mywin.close()
-                core.quit()
-        trialStimA.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(trial['trialStimFolder'])),'image'+str(int(trial['trialStimID']))+'.jpg') # added int()
-        trialStimA.setAutoDraw(True)
-        
-        mywin.flip()
-        trial['trialOnset'] = clock.getTime()
-        
-        allKeys = event.waitKeys(maxWait=trial['responseWindow'],keyList=['j','k','l','escape'],clearEvents=False)
-        
-        if allKeys and len(allKeys) == 1:
-            print('no mashing detected')
-            for thisKey in allKeys:
-                if thisKey in ['escape',]:
-                    save_data()
-                    mywin.close()
-                    core.quit()
-                elif thisKey in ['j','k','l']:
-                    if thisKey == trial['trialCorrectKey']:
-                        trial['respACC'] = 1
-                        accuracy = True
-                    else:
-                        trial['respACC'] = 0
-                        accuracy = False
-            trial['resp'] = 1
-            trial['respKey'] = thisKey
-            trial['respRT'] = clock.getTime()-trial['trialOnset']
-            responded = True
-        elif allKeys and len(allKeys) >> 1:
-            print('buttons mashed')
-            trial['respACC'] = 0
-            accuracy = False
-            trial['resp'] = 1
-            trial['respKey'] = allKeys
-            trial['respRT'] = clock.getTime()-trial['trialOnset']
-            responded = True
-        else:
-            responded = False
-        
-        event.clearEvents()
-        trialStimA.setAutoDraw(False)
-        mywin.flip()
-
-        allKeys = event.waitKeys(maxWait=trial['feedbackDelay'],keyList=['escape'])
-        for thisKey in allKeys or []:
-            if thisKey in ['escape']:
-                save_data()
-                mywin.close()
-                core.quit()
-        if not responded:
-            noResponseText.setAutoDraw(True)
-        elif responded and not accuracy:
-            currentReward.image = os.path.join(sessionInfo['local_path'],'rlwmpst','reward_images','zero.png')
-            currentReward.setAutoDraw(True)
-        else:
-            if trial['trialCorrectFBVal'] == 1:
-                currentReward.image = os.path.join(sessionInfo['local_path'],'rlwmpst','reward_images','small_reward.png')
-            elif trial['trialCorrectFBVal'] == 2:
-                currentReward.image = os.path.join(sessionInfo['local_path'],'rlwmpst','reward_images','large_reward.png')
-            currentReward.setAutoDraw(True)
-        mywin.flip()
-
-        allKeys = event.waitKeys(maxWait=trial['feedbackDuration'],keyList=['escape','q'])
-        for thisKey in allKeys or []:
-            if thisKey in ['escape','q']:
-                save_data()
-                mywin.close()
-                core.quit()
-        currentReward.setAutoDraw(False)
-        noResponseText.setAutoDraw(False)
+        run_learning_trial(trial, [get_image_stim(trial['trialStimPath'])]) # preloaded during the block preview
         
         trialPoints = trial['trialCorrectFBVal']*trial['respACC'] # get points from trial
         totalPoints = totalPoints + trialPoints
         trial['totalPoints'] = totalPoints
-        #
-        print(thisKey + ' ' + trial['trialCorrectKey'])
-        print('total points accumulated: '+ str(totalPoints))
-        #
-        mywin.flip()
+        completedTrials.append(trial)
+        log_event('points', trialNumber=trial['trialNumber'], trialPoints=trialPoints, totalPoints=totalPoints)
         
         if trial['trialNumber'] > 0:
-            if (trial['trialNumber'] + 1 - newBlockTrialNum) % (blockList[currentBlock]['setSize'] * 10) == 0:
+            if trial['trialNumber'] + 1 == blockList[currentBlock]['trialStop']: # block ranges come from the compiled stimulus set
                 newBlockTrialNum = trial['trialNumber'] + 1
+                log_event('end of block', block=currentBlock, totalPoints=totalPoints)
+                save_block()
+                save_checkpoint(checkpoint_file(sessionInfo), sessionInfo, currentBlock+1, newBlockTrialNum, totalPoints, trainList[0:newBlockTrialNum])
                 endOfBlock_text.text = 'End of block ' + str(currentBlock) + '. [Press space to continue]'
                 endOfBlock_text.setAutoDraw(True)
                 mywin.flip()
@@ -917,6 +767,8 @@ for currentBlock in range(0,len(blockList)):
                 for thisKey in allKeys:
                     if thisKey in ['escape']:
                         save_data()
+                        mywin.close()
+                        core.quit()
                     elif thisKey in ['space','j','k','l']:
                         event.clearEvents()
                 endOfBlock_text.setAutoDraw(False)
@@ -925,6 +777,9 @@ for currentBlock in range(0,len(blockList)):
 # Test #
 testInstructions.setAutoDraw(True)
 mywin.flip()
+# load the test images while the instructions are up
+preload_images(testList, 'trialStimPath_Left')
+preload_images(testList, 'trialStimPath_Right')
 allKeys = event.waitKeys(keyList=['escape','space'])
 for thisKey in allKeys:
     if thisKey in ['escape']:
@@ -934,50 +789,33 @@ for thisKey in allKeys:
     elif thisKey in ['space']:
         event.clearEvents()
 testInstructions.setAutoDraw(False)
-trialStimA.pos = (-3,0)
-trialStimB.pos = (3,0)
 
 for trial in testTrials:
-    mywin.flip()
-    responded = False
-    allKeys = event.waitKeys(maxWait=trial['testITI'],keyList=['escape'])
-    for thisKey in allKeys or []:
-        if thisKey in ['escape']:
-            save_data()
-            mywin.close()
-            core.quit()
-    trialStimA.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(trial['trialStimFolder_Left'])),'image'+str(int(trial['trialStimID_Left']))+'.jpg')
+    itiOnset = present_frames(n_frames(trial['testITI'])) # blank
+    trialStimA = get_image_stim(trial['trialStimPath_Left'])
+    trialStimA.pos = (-3,0)
     trialStimA.setAutoDraw(True)
-    trialStimB.image = os.path.join(sessionInfo['local_path'],'rlwmpst','images'+str(int(trial['trialStimFolder_Right'])),'image'+str(int(trial['trialStimID_Right']))+'.jpg')
+    trialStimB = get_image_stim(trial['trialStimPath_Right'])
+    trialStimB.pos = (3,0)
     trialStimB.setAutoDraw(True)
     
-    mywin.flip()
+    trial['trialOnset'], keys = collect_response(None, ['0','1']) # no time limit
+    trial['achievedITI'] = trial['trialOnset'] - itiOnset
     
-    trial['trialOnset'] = clock.getTime()
-    allKeys = event.waitKeys(keyList=['0','1','escape'])
-
-    for thisKey in allKeys or []:
-        if thisKey in ['escape',]:
-            save_data()
-            mywin.close()
-            core.quit()
-        elif thisKey in ['0','1'] and len(allKeys) == 1:
-            trial['resp'] = 1
-            trial['respKey'] = thisKey
-            trial['respRT'] = clock.getTime()-trial['trialOnset']
-            responded = True
-        elif len(allKeys) >> 1:
-            trial['resp'] = 1
-            trial['respKey'] = allKeys
-            trial['respRT'] = clock.getTime()-trial['trialOnset']
-            responded = True
-        else:
-            responded = False
+    trial['resp'] = 1
+    trial['respRT'] = keys[0].rt
+    if len(keys) == 1:
+        trial['respKey'] = keys[0].name
+    else:
+        trial['respKey'] = [key.name for key in keys]
     
     trialStimA.setAutoDraw(False)
     trialStimB.setAutoDraw(False)
-    mywin.flip()
-    event.clearEvents()
+    flip()
+    log_event('trial', blockType=trial['blockType'], trialNumber=trial['trialNumber'], keys=[key.name for key in keys],
+        mashed=len(keys) > 1, respRT=trial['respRT'], achievedITI=trial['achievedITI'])
+    completedTrials.append(trial)
+    kb.clearEvents()
 
 # payout
 payout = str(int(totalPoints / 50) + (totalPoints % 50 > 0))  # Divide points by 50 to get money payout (rounded up)
@@ -992,5 +830,6 @@ testInstructions.setAutoDraw(False)
 
 # END
 save_data()
+remove_checkpoint(checkpoint_file(sessionInfo))
 core.wait(2)
 core.quit()
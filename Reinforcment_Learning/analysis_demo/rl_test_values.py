@@ -0,0 +1,173 @@
+'''
+Value model for the RL test phase, for many participants at once
+
+In the test phase participants pick one of two pictures learned in different blocks.
+Each pick is modelled as a Bradley-Terry (logistic) choice between the latent values of the two pictures:
+    P(left) = logistic(bias + value_left - value_right)
+where each picture's value depends on its reward probability and the set size of the block it was learned in,
+plus a picture-specific deviation:
+    value = bProb * prob + bSetSize * setSize + bProbxSetSize * prob * setSize + u
+(prob and setSize centred on 0.5 and 3.5). u is shrunk towards 0 (ridge penalty, as a normal prior),
+so a picture seen in only a few pairs stays close to what its probability and set size predict.
+bProb is how well the learned values are retained; bProbxSetSize how that changes with the load during learning.
+
+All participants are fit together: the trials are padded into (participants x trials) arrays,
+and the penalised likelihood and its exact gradient are evaluated for the whole cohort in one set of array operations
+(the same approach as Episodic_Memory/analysis_demo/em_mixture_fit.py). Participants do not share parameters.
+
+Usage (from this folder):
+    python rl_test_values.py path/to/data/*.arrows
+    (task output files; old .csv/.xlsx outputs of the task work as well)
+'''
+
+import glob, os, sys
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from scipy.special import expit, log_expit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # rl_output.py, in the task folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # session_ids.py, in the repository folder
+from session_ids import session_ids
+
+covariateNames = ['bProb', 'bSetSize', 'bProbxSetSize']
+probCentre, setSizeCentre = 0.5, 3.5
+ridge = 1.0 # penalty on the picture-specific deviations (1 / prior variance)
+weakRidge = 0.01 # on the bias and coefficients, only keeps them finite when a participant's picks are perfectly separated
+
+## Data ##
+
+def load_test_data(files):
+    # test trials of any number of task output files, with the choice coded as chooseLeft (1 -> left, 0 -> right)
+    frames = []
+    for f in files:
+        if f.endswith('.arrows'):
+            from rl_output import load_rl_data
+            frames.append(load_rl_data([f]).to_pandas().rename(columns={'phase': 'blockType'}))
+        elif f.endswith('.xlsx'):
+            frames.append(pd.read_excel(f))
+        else:
+            frames.append(pd.read_csv(f))
+    dat = pd.concat(frames, ignore_index=True)
+    dat = dat[dat['blockType'].astype(str) == 'test'].copy()
+    dat['Participant'] = session_ids(dat)
+
+    key = dat['respKey'].astype(str)
+    dat = dat[key.isin(['0', '1'])].copy() # a single key (no mashing)
+    dat['chooseLeft'] = (dat['respKey'].astype(str) == '1').astype(float)
+    for col in ['trialStimOverallID_Left', 'trialStimOverallID_Right', 'trialSetSize_Left', 'trialSetSize_Right',
+                'trialCorrectProb_Left', 'trialCorrectProb_Right']:
+        dat[col] = dat[col].astype(float)
+    return dat.reset_index(drop=True)
+
+def compile_cohort(dat):
+    # padded (participants x trials x parameters) design: [bias, covariate differences, picture indicators (+1 left, -1 right)]
+    participants = list(dat['Participant'].unique())
+    groups = dat.groupby('Participant', sort=False).indices
+
+    stims = {} # per participant: its pictures (id, prob, set size), row c is picture column c in the design
+    for p in participants:
+        sub = dat.iloc[groups[p]]
+        table = pd.DataFrame({
+            'id': np.r_[sub['trialStimOverallID_Left'], sub['trialStimOverallID_Right']],
+            'prob': np.r_[sub['trialCorrectProb_Left'], sub['trialCorrectProb_Right']],
+            'setSize': np.r_[sub['trialSetSize_Left'], sub['trialSetSize_Right']],
+            }).drop_duplicates('id').sort_values('id').reset_index(drop=True)
+        stims[p] = table
+
+    nTrials = max(len(groups[p]) for p in participants)
+    nStims = max(len(stims[p]) for p in participants)
+    nCov = len(covariateNames)
+    nParams = 1 + nCov + nStims
+
+    X = np.zeros((len(participants), nTrials, nParams))
+    y = np.zeros((len(participants), nTrials))
+    mask = np.zeros((len(participants), nTrials), dtype=bool)
+    for i, p in enumerate(participants):
+        sub = dat.iloc[groups[p]]
+        n = len(sub)
+        column = {stimID: c for c, stimID in enumerate(stims[p]['id'])}
+        left = np.array([column[s] for s in sub['trialStimOverallID_Left']])
+        right = np.array([column[s] for s in sub['trialStimOverallID_Right']])
+
+        X[i, :n, 0] = 1
+        X[i, :n, 1:1 + nCov] = covariates(sub['trialCorrectProb_Left'], sub['trialSetSize_Left']) - \
+                               covariates(sub['trialCorrectProb_Right'], sub['trialSetSize_Right'])
+        X[i, np.arange(n), 1 + nCov + left] += 1
+        X[i, np.arange(n), 1 + nCov + right] -= 1
+        y[i, :n] = sub['chooseLeft']
+        mask[i, :n] = True
+
+    penalty = np.r_[np.full(1 + nCov, weakRidge), np.full(nStims, ridge)]
+    return {'participants': participants, 'stims': stims, 'X': X, 'y': y, 'mask': mask, 'penalty': penalty}
+
+def covariates(prob, setSize):
+    prob = np.asarray(prob, dtype=float) - probCentre
+    setSize = np.asarray(setSize, dtype=float) - setSizeCentre
+    return np.column_stack([prob, setSize, prob * setSize])
+
+## Model ##
+
+def choice_negLL(theta, cohort):
+    # penalised negative log likelihood (per participant) and its gradient, for all participants at once
+    # theta: (participants, parameters) -> [bias, bProb, bSetSize, bProbxSetSize, u...]
+    X, y, mask, penalty = cohort['X'], cohort['y'], cohort['mask'], cohort['penalty']
+    logit = np.einsum('ptc,pc->pt', X, theta)
+
+    # log P(choice), written with log_expit so large logits don't overflow
+    logLik = y * log_expit(logit) + (1 - y) * log_expit(-logit)
+    negLL = -np.sum(logLik * mask, axis=1) + 0.5 * np.sum(penalty * theta**2, axis=1)
+
+    resid = (y - expit(logit)) * mask
+    grad = -np.einsum('pt,ptc->pc', resid, X) + penalty * theta
+    return negLL, grad
+
+def fit_cohort(cohort):
+    nPart, nParams = len(cohort['participants']), cohort['X'].shape[2]
+
+    def objective(flat):
+        negLL, grad = choice_negLL(flat.reshape(nPart, nParams), cohort)
+        return negLL.sum(), grad.ravel()
+
+    res = minimize(objective, np.zeros(nPart * nParams), jac=True, method='L-BFGS-B', options={'maxiter': 5000})
+    theta = res.x.reshape(nPart, nParams)
+    return theta, choice_negLL(theta, cohort)[0]
+
+def fit_test_values(dat):
+    # returns one row per participant (coefficients and retention metrics) and one row per participant and picture (values)
+    cohort = compile_cohort(dat)
+    theta, negLL = fit_cohort(cohort)
+    nCov = len(covariateNames)
+
+    # the picked picture had the higher reward probability (pairs with equal probabilities left out)
+    diff = dat['trialCorrectProb_Left'] - dat['trialCorrectProb_Right']
+    scored = dat[diff != 0].assign(correct=lambda d: (d['chooseLeft'] == (d['trialCorrectProb_Left'] > d['trialCorrectProb_Right'])).astype(float))
+    lowLoad = (scored['trialSetSize_Left'] <= 3) & (scored['trialSetSize_Right'] <= 3)
+    highLoad = (scored['trialSetSize_Left'] >= 4) & (scored['trialSetSize_Right'] >= 4)
+    accuracy = scored.groupby('Participant')['correct'].mean()
+    accuracyLow = scored[lowLoad].groupby('Participant')['correct'].mean()
+    accuracyHigh = scored[highLoad].groupby('Participant')['correct'].mean()
+
+    rows, valueRows = [], []
+    for i, p in enumerate(cohort['participants']):
+        row = {'Participant': p, 'nTrials': int(cohort['mask'][i].sum()), 'bias': theta[i, 0]}
+        row.update(zip(covariateNames, theta[i, 1:1 + nCov]))
+        row['testAccuracy'] = accuracy.get(p, np.nan)
+        row['accuracyLowLoad'] = accuracyLow.get(p, np.nan) # both pictures from set size 2-3 blocks
+        row['accuracyHighLoad'] = accuracyHigh.get(p, np.nan) # both from set size 4-5 blocks
+        row['NLL'] = negLL[i]
+        rows.append(row)
+
+        stims = cohort['stims'][p]
+        values = covariates(stims['prob'], stims['setSize']) @ theta[i, 1:1 + nCov] + theta[i, 1 + nCov:1 + nCov + len(stims)]
+        valueRows.append(stims.rename(columns={'id': 'stimulusID'}).assign(Participant=p, value=values))
+
+    return pd.DataFrame(rows), pd.concat(valueRows, ignore_index=True)[['Participant', 'stimulusID', 'prob', 'setSize', 'value']]
+
+if __name__ == '__main__':
+    files = [f for a in sys.argv[1:] for f in glob.glob(a)]
+    if not files:
+        print(__doc__)
+        sys.exit()
+    summary, values = fit_test_values(load_test_data(files))
+    print(summary)
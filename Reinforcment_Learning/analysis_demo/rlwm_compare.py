@@ -0,0 +1,97 @@
+'''
+Model comparison for the RL task: every model of model_config_rl, every participant
+
+For each participant and model:
+    AIC  = 2 k + 2 negLL
+    BIC  = k log(n) + 2 negLL            (k free parameters including C, n training trials)
+    cvLL = blocked cross-validated log likelihood: the blocks are split into nFolds folds (block i in fold i % nFolds),
+           the model is fit without each fold and the held-out blocks are scored with that fit.
+           Blocks are independent in these models (the Q values start again every block), so leaving out blocks is clean.
+
+Each participant is compiled once (rlwm_likelihood.compile_participant); every model and fold works on those arrays
+(select_blocks for the folds). Fits run in parallel and go through the rlwm_pipeline.py cache,
+keyed on the data, the model (including its update rule), beta, the optimizer settings and the held-out blocks,
+so re-running after adding a model or participants only fits what is new, and an interrupted run resumes.
+
+Usage (from this folder):
+    python rlwm_compare.py path/to/data                           # all models, 5 folds, results in rlwm_compare.feather
+    python rlwm_compare.py path/to/data RLWM,RL,WM 8              # some models, with 8 processes
+'''
+
+import os, sys
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from rlwm_data import find_output_files, load_model_data
+from rlwm_likelihood import compile_participant, select_blocks, rlwm_negLL, model_config_rl, n_params, beta
+from rlwm_pipeline import cache_key, cache_file, load_result, run_tasks, optimizerSettings
+
+nFolds = 5
+
+def fold_blocks(nBlocks, nFolds=nFolds):
+    # block indices held out in each fold
+    return [np.arange(f, nBlocks, nFolds) for f in range(nFolds)]
+
+def compare_models(paths, models=None, nFolds=nFolds, resultsFile='rlwm_compare.feather', cacheDir='rlwm_cache',
+                   processes=None, settings=optimizerSettings):
+    models = models or list(model_config_rl)
+    participants = load_model_data(find_output_files(paths))
+    compiled = {p: compile_participant(dat) for p, dat in participants.items()}
+    os.makedirs(cacheDir, exist_ok=True)
+
+    # one fit to all the data, and one per fold, for every participant and model
+    fits = {} # (participant, model, fold) -> cache key, fold None for all the data
+    tasks = []
+    for p, dat in participants.items():
+        data = compiled[p]
+        folds = fold_blocks(len(data['blocks']), nFolds)
+        for model in models:
+            for fold in [None] + list(range(nFolds)):
+                heldOut = None if fold is None else data['blocks'][folds[fold]]
+                key = cache_key(dat, model, beta, settings, heldOut)
+                fits[p, model, fold] = key
+                if not os.path.exists(cache_file(cacheDir, key)):
+                    kept = data if fold is None else select_blocks(data, np.setdiff1d(np.arange(len(data['blocks'])), folds[fold]))
+                    tasks.append((p, key, kept, settings, model))
+    print('%d participants, %d models, %d fits (%d cached)' % (len(participants), len(models), len(fits), len(fits) - len(tasks)))
+    run_tasks(tasks, cacheDir, processes)
+
+    rows = []
+    for p in participants:
+        data = compiled[p]
+        n = int(data['maskT'].sum())
+        folds = fold_blocks(len(data['blocks']), nFolds)
+        for model in models:
+            fit = load_result(cacheDir, fits[p, model, None])['fit']
+            k = n_params(model)
+            row = {'subj_idx': p, 'model': model, 'k': k, 'nTrials': n, 'negLL': fit['negLL'],
+                   'AIC': 2 * k + 2 * fit['negLL'], 'BIC': k * np.log(n) + 2 * fit['negLL']}
+            row['cvLL'] = -sum(heldout_negLL(load_result(cacheDir, fits[p, model, fold])['fit'], select_blocks(data, folds[fold]), model)
+                               for fold in range(nFolds))
+            row.update((name, fit[name]) for name in model_config_rl[model]['params'] + ['C'])
+            rows.append(row)
+
+    results = pd.DataFrame(rows)
+    feather.write_feather(pa.Table.from_pandas(results, preserve_index=False), resultsFile)
+    return results
+
+def heldout_negLL(fit, data, model):
+    C = fit['C'] if model_config_rl[model]['C'] else np.inf
+    return rlwm_negLL([fit[name] for name in model_config_rl[model]['params']], data, C, beta, model)
+
+def summarize(results):
+    # totals over participants, and how many participants each model fits best
+    summary = results.groupby('model')[['negLL', 'AIC', 'BIC', 'cvLL']].sum()
+    for measure, best in [('AIC', 'idxmin'), ('BIC', 'idxmin'), ('cvLL', 'idxmax')]:
+        winners = results.loc[getattr(results.groupby('subj_idx')[measure], best)(), 'model']
+        summary['best' + measure] = winners.value_counts().reindex(summary.index, fill_value=0)
+    return summary.sort_values('BIC')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit()
+    models = sys.argv[2].split(',') if len(sys.argv) > 2 else None
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    print(summarize(compare_models([sys.argv[1]], models, processes=processes)))
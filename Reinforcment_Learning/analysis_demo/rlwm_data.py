@@ -0,0 +1,212 @@
+'''
+RL task output -> RLWM model format
+
+The model fits (rlwm_likelihood.py, rlwm_fit.py) take one participant's training trials with the columns of demo_data.csv:
+    block_id   block number
+    stim_id    stimulus within the block, from 0
+    resp       action, from 0 (keys j, k, l -> 0, 1, 2)
+    feedback   points given (trialCorrectFBVal x respACC: 0, 1 or 2)
+This converts the task's output files to that format: .arrows written by rl_output.py, and the older outputs
+(one .csv/.xlsx per phase, or all phases in one file, with 'NA' strings for empty values).
+Only the training phase is used. respKey comes in several forms, all normalised:
+    'j'                     one key
+    '?' / empty             no response (timeout)
+    "['j', 'k']" or 'j,k'   several keys pressed (mashing; the list as written by the old outputs, comma-joined in .arrows)
+Timeout and mashed trials are flagged (timeout, mashed, resp = -1); the fits leave them out.
+
+convert_study() converts a whole study folder into one compact .npz per participant (int8/int16 arrays),
+reading the files in parallel and only the columns it needs. It is idempotent: a manifest in the output folder records
+every file it read (size, modification time, participants), so running it again only reads new or changed files and
+only rewrites the participants they contain. A participant whose session is split over several files
+(e.g. resumed after a crash) is merged, in trial order. Files no longer found are dropped from the manifest:
+their participants are rewritten from their remaining files, or their .npz removed if none are left.
+
+Usage:
+    python rlwm_data.py path/to/study path/to/converted [processes]
+    from rlwm_data import find_output_files, load_model_data
+    participants = load_model_data(find_output_files(['path/to/converted']))   # {participant: DataFrame}, also works on raw outputs
+'''
+
+import ast, glob, hashlib, json, multiprocessing, os, sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # rl_output.py, in the task folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # session_ids.py, in the repository folder
+from session_ids import session_ids
+
+keyActions = {'j': 0, 'k': 1, 'l': 2}
+modelColumns = ['block_id', 'stim_id', 'resp', 'feedback']
+outputExtensions = ['.arrows', '.csv', '.xlsx', '.npz']
+taskColumns = ['Participant', 'Date', 'blockType', 'blockNumber', 'trialNumber', 'trialStimInBlockID',
+               'respKey', 'trialCorrectFBVal', 'respACC']
+manifestName = 'manifest.json'
+
+# compact types of the converted arrays
+arrayTypes = {'block_id': np.int16, 'stim_id': np.int8, 'resp': np.int8, 'feedback': np.int8,
+              'trialNumber': np.int32, 'mashed': bool, 'timeout': bool}
+
+## Reading task output ##
+
+def find_output_files(paths):
+    # task output (or converted) files from any mix of files, glob patterns and folders
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for ext in outputExtensions:
+                files.extend(glob.glob(os.path.join(path, '*' + ext)))
+        else:
+            files.extend(glob.glob(path))
+    return sorted(set(files))
+
+def load_task_output(fileName):
+    # training trials of one output file, only the columns needed here
+    if fileName.endswith('.arrows'):
+        from rl_output import read_session
+        table, session = read_session(fileName)
+        dat = table.select([c for c in taskColumns if c in table.column_names] + ['phase']).to_pandas()
+        dat = dat.rename(columns={'phase': 'blockType'}).assign(Participant=session['Participant'], Date=session['Date'])
+    elif fileName.endswith('.xlsx'):
+        dat = pd.read_excel(fileName, usecols=lambda c: c in taskColumns)
+    else:
+        dat = pd.read_csv(fileName, usecols=lambda c: c in taskColumns)
+    if 'blockType' in dat:
+        dat = dat[dat['blockType'].astype(str) == 'train']
+    elif '_training_' not in os.path.basename(fileName): # old outputs were split by phase
+        return dat.iloc[:0]
+    return dat
+
+def parse_keys(value):
+    # respKey in any of its forms -> list of key names ([] for no response)
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [str(k) for k in value]
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return []
+    value = str(value).strip()
+    if value in ['', '?', 'NA', 'nan']:
+        return []
+    if value.startswith('['):
+        return [str(k) for k in ast.literal_eval(value)]
+    return value.split(',')
+
+def to_model_format(dat):
+    # training trials of task output -> model columns and flags, one participant id per session
+    keys = [parse_keys(k) for k in dat['respKey']]
+    timeout = np.array([len(k) == 0 for k in keys], dtype=bool)
+    mashed = np.array([len(k) > 1 for k in keys], dtype=bool)
+    resp = np.array([keyActions.get(k[0], -1) if len(k) == 1 else -1 for k in keys])
+    fbValue = pd.to_numeric(dat['trialCorrectFBVal'], errors='coerce').fillna(0).astype(int)
+    accuracy = pd.to_numeric(dat['respACC'], errors='coerce').fillna(0).astype(int)
+    return pd.DataFrame({
+        'subj_idx': session_ids(dat),
+        'block_id': dat['blockNumber'].astype(int).values,
+        'stim_id': dat['trialStimInBlockID'].astype(int).values - 1,
+        'resp': resp,
+        'feedback': (fbValue * accuracy).values,
+        'trialNumber': dat['trialNumber'].astype(int).values,
+        'mashed': mashed,
+        'timeout': timeout,
+        })
+
+def valid_trials(dat):
+    # the trials the fits use: one of the response keys, pressed alone
+    return dat[dat['resp'] >= 0].reset_index(drop=True)
+
+## Converted participants ##
+
+def save_participant(fileName, participant, dat, sources):
+    # one participant's arrays, written to a temporary file and renamed (a crash never leaves a broken file)
+    tmpFile = fileName + '.tmp'
+    with open(tmpFile, 'wb') as f:
+        np.savez(f, participant=participant, sources=np.array(sources),
+            **{name: dat[name].to_numpy(arrayType) for name, arrayType in arrayTypes.items()})
+    os.replace(tmpFile, fileName)
+
+def load_participant(fileName):
+    with np.load(fileName) as arrays:
+        dat = pd.DataFrame({name: arrays[name] for name in arrayTypes})
+        dat.insert(0, 'subj_idx', str(arrays['participant']))
+    return dat
+
+def load_model_data(files):
+    # {participant: model format DataFrame (valid trials)}, from task outputs and/or converted .npz files
+    frames = [load_participant(f) if f.endswith('.npz') else to_model_format(load_task_output(f)) for f in files]
+    dat = pd.concat(frames, ignore_index=True)
+    dat = dat.sort_values(['subj_idx', 'trialNumber'], kind='stable').drop_duplicates(['subj_idx', 'trialNumber'], keep='last')
+    return {p: valid_trials(sub) for p, sub in dat.groupby('subj_idx', sort=False)}
+
+def data_hash(dat):
+    # content hash of one participant's model data (what the fit sees, not the file it came from)
+    return hashlib.sha256(np.ascontiguousarray(dat[modelColumns].to_numpy(np.int64)).tobytes()).hexdigest()
+
+## Converting a study ##
+
+def file_state(fileName):
+    stat = os.stat(fileName)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _read_file(fileName):
+    # (file, {participant: trials}) for the pool
+    dat = to_model_format(load_task_output(fileName))
+    return fileName, {p: sub.drop(columns='subj_idx') for p, sub in dat.groupby('subj_idx', sort=False)}
+
+def participant_file(outDir, participant):
+    return os.path.join(outDir, participant.replace(os.sep, '_') + '.npz')
+
+def convert_study(paths, outDir, processes=None):
+    # converts every task output file found in paths, returns the participants (re)written
+    files = [f for f in find_output_files(paths) if not f.endswith('.npz')]
+    os.makedirs(outDir, exist_ok=True)
+    manifestFile = os.path.join(outDir, manifestName)
+    manifest = {}
+    if os.path.exists(manifestFile):
+        with open(manifestFile) as f:
+            manifest = json.load(f)
+
+    def read(fileNames):
+        if processes == 1 or len(fileNames) < 2:
+            return dict(map(_read_file, fileNames))
+        with multiprocessing.Pool(processes) as pool:
+            return dict(pool.imap_unordered(_read_file, fileNames))
+
+    # files gone since the last run: their participants are rewritten from what is left, or removed
+    removed = [f for f in manifest if f not in files]
+    stale = {p for f in removed for p in manifest.pop(f)['participants']}
+
+    # pass 1: new or changed files
+    changed = [f for f in files if manifest.get(f, {}).get('state') != file_state(f)]
+    chunks = read(changed)
+    for f in changed:
+        manifest[f] = {'state': file_state(f), 'participants': list(chunks[f])}
+
+    # participants to (re)write: those in changed files, and any whose output is missing
+    owners = {}
+    for f in files:
+        for p in manifest[f]['participants']:
+            owners.setdefault(p, []).append(f)
+    todo = [p for p in owners if p in stale or any(f in chunks for f in owners[p]) or not os.path.exists(participant_file(outDir, p))]
+    for p in stale - set(owners):
+        if os.path.exists(participant_file(outDir, p)):
+            os.remove(participant_file(outDir, p))
+
+    # pass 2: unchanged files that hold part of a participant being rewritten
+    chunks.update(read(sorted({f for p in todo for f in owners[p] if f not in chunks})))
+
+    for p in todo:
+        dat = pd.concat([chunks[f][p] for f in owners[p]], ignore_index=True)
+        dat = dat.sort_values('trialNumber', kind='stable').drop_duplicates('trialNumber', keep='last')
+        save_participant(participant_file(outDir, p), p, dat, owners[p])
+
+    tmpFile = manifestFile + '.tmp'
+    with open(tmpFile, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmpFile, manifestFile)
+    print('%d files (%d read, %d removed), %d participants, %d written' % (len(files), len(chunks), len(removed), len(owners), len(todo)))
+    return todo
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit()
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    convert_study([sys.argv[1]], sys.argv[2], processes)
@@ -0,0 +1,195 @@
+'''
+Parallel multi-start fitting of the RLWM model
+
+Same procedure as the fit cell of RLWM_model_fit.ipynb: for each C in C_list, n_restarts Nelder-Mead runs
+from uniform starting points, the best negative log likelihood over all of them is the fit.
+Here the restarts are spread over worker processes:
+    - the participant's trials are compiled once (rlwm_likelihood.compile_participant) and the arrays are handed
+      to each worker when the pool starts, so no DataFrame is pickled and nothing is sent again per restart.
+    - restarts are queued restart by restart across the C values, so every C gets early results.
+    - once nConverged restarts of a C have reached the same optimum (negLL within negLLTol and parameters within paramTol
+      of the best for that C), the remaining restarts of that C are cancelled: queued ones are skipped and
+      running ones stop at their next iteration.
+    - every restart is returned in a table (starting point, estimate, negLL, iterations, status, time).
+
+Restarts don't depend on each other, so the wall time per participant drops close to linearly with the number of processes
+(as long as there are more restarts than processes).
+On demo_data.csv the Nelder-Mead restarts rarely land on exactly the same point, so with the default tolerances
+most restarts still run; loosen negLLTol/paramTol (or lower nConverged) to cancel sooner.
+
+screen=N starts each C from the best of N random points, all scored for every C in one rlwm_negLL_profile call,
+so a few restarts per C do what many random restarts do; the C profile is table.groupby('C')['negLL'].min().
+method='L-BFGS-B' fits on the logit scale with the exact gradient (rlwm_likelihood.theta_negLL_grad) instead of Nelder-Mead.
+
+Usage (from this folder):
+    python rlwm_fit.py                                  # fits demo_data.csv with all cores
+    python rlwm_fit.py demo_data.csv 4                  # with 4 processes
+    python rlwm_fit.py demo_data.csv 4 L-BFGS-B         # quasi-Newton with exact gradients
+    python rlwm_fit.py benchmark                        # Nelder-Mead vs L-BFGS-B (and screened), evaluations and time per restart
+'''
+
+import multiprocessing, os, sys, time
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from rlwm_likelihood import compile_participant, compile_profile, rlwm_negLL, rlwm_negLL_batch, rlwm_negLL_profile, theta_negLL_grad, to_params, to_theta, model_config_rl, beta
+
+C_list = [2, 3, 4, 5]
+n_restarts = 20
+thetaMax = 10 # L-BFGS-B works on theta (logit scale) within +-thetaMax, i.e. up to ~5e-5 from the bounds
+
+## Workers ##
+
+# set in each worker by _init_worker
+_data = None
+_cancelled = None # one flag per C value, shared by all processes
+
+def _init_worker(data, cancelled):
+    global _data, _cancelled
+    _data, _cancelled = data, cancelled
+
+def _stop_if_cancelled(cIndex):
+    def callback(intermediate_result):
+        if _cancelled[cIndex]:
+            raise StopIteration # minimize returns the current estimate
+    return callback
+
+def _fit_restart(task):
+    model, method, cIndex, C, restart, x0 = task
+    paramNames = model_config_rl[model]['params']
+    bounds = model_config_rl[model]['param_bounds']
+    row = {'C': C, 'restart': restart, 'pid': os.getpid()}
+    row.update(('x0_' + name, value) for name, value in zip(paramNames, x0))
+    if _cancelled[cIndex]:
+        row['status'] = 'cancelled'
+        return row
+
+    t0 = time.perf_counter()
+    if method == 'L-BFGS-B':
+        # exact gradient, on the logit scale, so the bounds never need the np.inf penalty
+        res = minimize(theta_negLL_grad, to_theta(x0, bounds), args=(_data, C, beta, model), jac=True, method='L-BFGS-B',
+            bounds=[(-thetaMax, thetaMax)] * len(x0), callback=_stop_if_cancelled(cIndex))
+        estimate = to_params(res.x, bounds)
+    else:
+        res = minimize(rlwm_negLL, x0, args=(_data, C, beta, model), method='Nelder-Mead', callback=_stop_if_cancelled(cIndex))
+        estimate = res.x
+    row.update(zip(paramNames, estimate))
+    row['negLL'] = rlwm_negLL(estimate, _data, C, beta, model)
+    row['nit'] = res.nit
+    row['nfev'] = res.nfev
+    row['status'] = 'stopped' if res.status == 99 else ('converged' if res.success else 'maxiter')
+    row['time'] = time.perf_counter() - t0
+    return row
+
+## Fitting ##
+
+def starting_points(nPoints, rng, bounds):
+    # uniform within the bounds, as sample_uniform_starting_pts in the notebook
+    return rng.uniform(bounds[0], bounds[1], (nPoints, len(bounds[0])))
+
+def same_optimum(rows, best, paramNames, negLLTol, paramTol):
+    # restarts that ended at the best optimum of their C
+    return [r for r in rows if r['negLL'] - best['negLL'] <= negLLTol and
+            max(abs(r[name] - best[name]) for name in paramNames) <= paramTol]
+
+def fit_participant(dat, model='RLWM', C_list=C_list, n_restarts=n_restarts, processes=None, seed=None,
+                    nConverged=3, negLLTol=1e-2, paramTol=0.05, method='Nelder-Mead', screen=None):
+    # dat: one participant's trials (block_id, stim_id, resp, feedback) or compile_participant() arrays
+    # model: a key of model_config_rl (models without C are fit once, with no capacity limit)
+    # method: 'Nelder-Mead' (as in the notebook) or 'L-BFGS-B' (exact gradient, see rlwm_likelihood.rlwm_negLL_grad)
+    # screen: if set, the restarts of each C start from the best n_restarts of `screen` random points,
+    #         scored for every C at once (rlwm_negLL_profile), instead of n_restarts random points
+    # returns the best fit (dict) and the restart table (one row per C and restart)
+    # nConverged=None runs every restart
+    data = dat if isinstance(dat, dict) else compile_participant(dat)
+    config = model_config_rl[model]
+    paramNames = config['params']
+    C_list = list(C_list) if config['C'] else [np.inf]
+    rng = np.random.default_rng(seed)
+    if screen:
+        points = starting_points(screen, rng, config['param_bounds'])
+        ranked = np.argsort(rlwm_negLL_profile(points, compile_profile(data, C_list), beta, model), axis=0)
+    tasks = []
+    for restart in range(n_restarts):
+        for cIndex, C in enumerate(C_list):
+            x0 = points[ranked[restart, cIndex]] if screen else starting_points(1, rng, config['param_bounds'])[0]
+            tasks.append((model, method, cIndex, C, restart, x0))
+
+    cancelled = multiprocessing.Array('b', len(C_list))
+    finished = {C: [] for C in C_list}
+    rows = []
+
+    def collect(row):
+        rows.append(row)
+        if row['status'] == 'cancelled' or nConverged is None:
+            return
+        done = finished[row['C']]
+        done.append(row)
+        best = min(done, key=lambda r: r['negLL'])
+        if len(same_optimum(done, best, paramNames, negLLTol, paramTol)) >= nConverged:
+            cancelled[C_list.index(row['C'])] = 1
+
+    t0 = time.perf_counter()
+    if processes == 1:
+        # no pool, same code path (easier to debug)
+        _init_worker(data, cancelled)
+        for task in tasks:
+            collect(_fit_restart(task))
+    else:
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(data, cancelled)) as pool:
+            for row in pool.imap_unordered(_fit_restart, tasks):
+                collect(row)
+    wallTime = time.perf_counter() - t0
+
+    table = pd.DataFrame(rows).sort_values(['C', 'restart']).reset_index(drop=True)
+    # likelihood at each starting point, all in one batch
+    table['negLL0'] = rlwm_negLL_batch(table[['x0_' + name for name in paramNames]].values, data, table['C'].values, beta, model)
+
+    best = table.loc[table['negLL'].idxmin()]
+    fit = {'model': model}
+    fit.update((name, float(best[name])) for name in paramNames)
+    fit['C'] = int(best['C']) if config['C'] else None
+    fit['negLL'] = float(best['negLL'])
+    fit['nRestarts'] = int((table['status'] != 'cancelled').sum())
+    fit['wallTime'] = wallTime
+    return fit, table
+
+## Benchmark ##
+
+def benchmark(dataFile='demo_data.csv', n_restarts=10, seed=0):
+    # Nelder-Mead vs L-BFGS-B from the same starting points, all restarts run (no cancellation), in this process
+    data = compile_participant(pd.read_csv(dataFile))
+    rows = []
+    for method in ['Nelder-Mead', 'L-BFGS-B']:
+        fit, table = fit_participant(data, n_restarts=n_restarts, processes=1, seed=seed, nConverged=None, method=method)
+        rows.append(table.assign(method=method))
+    # the whole C profile from a screen: 3 restarts per C from the best of 1000 points scored for every C at once
+    t0 = time.perf_counter()
+    fit, table = fit_participant(data, n_restarts=3, processes=1, seed=seed, nConverged=None, method='L-BFGS-B', screen=1000)
+    rows.append(table.assign(method='L-BFGS-B, screened'))
+    print('screened C profile: %.1f s in total (screen and fits)' % (time.perf_counter() - t0))
+    table = pd.concat(rows, ignore_index=True)
+    best = table.groupby('C')['negLL'].transform('min') # best of both methods for each C
+    table['atBest'] = table['negLL'] - best < 0.01
+    summary = table.groupby('method').agg(medianEvaluations=('nfev', 'median'), meanEvaluations=('nfev', 'mean'),
+        secondsPerRestart=('time', 'mean'), totalSeconds=('time', 'sum'), bestNegLL=('negLL', 'min'),
+        fractionAtBest=('atBest', 'mean'))
+    print(summary.to_string())
+    print('(an L-BFGS-B evaluation computes the likelihood and its gradient)')
+    return summary, table
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['benchmark']:
+        benchmark()
+        sys.exit()
+    dataFile = sys.argv[1] if len(sys.argv) > 1 else 'demo_data.csv'
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    method = sys.argv[3] if len(sys.argv) > 3 else 'Nelder-Mead'
+    fit, table = fit_participant(pd.read_csv(dataFile), processes=processes, seed=0, method=method)
+
+    print(table.groupby('C')['status'].value_counts().unstack(fill_value=0))
+    print('Best fit parameters: \n')
+    for name in model_config_rl['RLWM']['params']:
+        print(name, " - ", np.round(fit[name], 5))
+    print("C - ", fit['C'])
+    print('negLL %.3f, %d restarts run, %.1f s' % (fit['negLL'], fit['nRestarts'], fit['wallTime']))
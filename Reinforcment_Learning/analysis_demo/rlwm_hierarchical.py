@@ -0,0 +1,190 @@
+'''
+Hierarchical (population) RLWM fits by expectation-maximization
+
+Fitting 5 parameters + C from ~360 trials one participant at a time is noisy. Here every participant's parameters
+are drawn from a group distribution, and the two are estimated together (as in Huys et al. 2011, emfit):
+    - parameters are fit on an unbounded scale: theta = logit((param - low) / (high - low)), so the bounds of
+      model_config_rl always hold and a normal group prior fits: theta ~ N(mu, sd^2), one mu and sd per parameter.
+      C gets a categorical group prior over C_list.
+    - E-step: each participant's MAP fit under the current prior (negLL + prior), for every C, with L-BFGS-B on the
+      exact gradient (rlwm_likelihood.theta_negLL_grad plus the gradient of the prior), and the posterior spread from
+      the Hessian at the MAP (evaluated in one rlwm_negLL_batch call). method='Nelder-Mead' is kept for comparison.
+    - M-step: mu and sd from the participants' MAP estimates and posterior spreads (Laplace approximation),
+      and the C probabilities from the participants' best C.
+    - repeated until the total negative log posterior changes by less than tol.
+
+The E-steps run in parallel, one participant per task. The compiled arrays of the whole cohort are handed to each worker
+once, when the pool starts; a task only carries the prior and the participant's estimates from the previous sweep.
+Those estimates are the starting points of the next sweep (warm starts), so after the first sweep each MAP fit
+starts close to its optimum and a sweep costs about as much as one restart per C of an individual fit.
+The first sweep starts from the best of seedPoints random points per C, scored for every C in one rlwm_negLL_profile call.
+
+Measured on one core with 30 simulated agents (rlwm_simulate.py, S_1, 6 sweeps), seconds per participant and sweep:
+    L-BFGS-B      0.54 on the first sweep, 0.20-0.47 after (warm starts)
+    Nelder-Mead   3.35 on the first sweep, 1.41-2.38 after
+L-BFGS-B also ended at a lower negative log posterior (6269.5 vs 6276.0). A sweep of N participants on P cores
+takes about 0.4 N / P s (these times are per participant and the E-steps are independent).
+
+Usage (from this folder):
+    python rlwm_hierarchical.py path/to/data          # all participants found there (rlwm_data.py), all cores
+'''
+
+import multiprocessing, sys, time
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from rlwm_likelihood import compile_participant, compile_profile, rlwm_negLL_batch, rlwm_negLL_profile, theta_negLL_grad, to_params, model_config_rl, beta
+from rlwm_fit import C_list, thetaMax
+
+priorSD = 3.0 # sd of the group prior on the first sweep (wide, so the first sweep is close to individual fits)
+minSD = 0.05 # floor on the group sd, so the prior never collapses
+seedPoints = 50 # random starting points scored per participant and C on the first sweep
+hessianStep = 1e-3
+
+## E-step (in the workers) ##
+
+_participants = None # compiled arrays of the whole cohort, set in each worker by _init_worker
+
+def _init_worker(participants):
+    global _participants
+    _participants = participants
+
+def neg_posterior(thetas, data, C, mu, var, model):
+    # negLL + negative log prior (up to a constant) of (K x params) theta vectors, all in one batch
+    thetas = np.atleast_2d(thetas)
+    params = to_params(thetas, model_config_rl[model]['param_bounds'])
+    return rlwm_negLL_batch(params, data, C, beta, model) + 0.5 * np.sum((thetas - mu)**2 / var, axis=1)
+
+def neg_posterior_grad(theta, data, C, mu, var, model):
+    # negLL + negative log prior of one theta vector, and its exact gradient
+    negLL, grad = theta_negLL_grad(theta, data, C, beta, model)
+    return negLL + 0.5 * np.sum((theta - mu)**2 / var), grad + (theta - mu) / var
+
+def hessian(f, x, h=hessianStep):
+    # finite difference Hessian of f at x, every point evaluated in one call of f (which takes a batch of points)
+    n = len(x)
+    steps = np.eye(n) * h
+    points = [x] + [x + s for s in steps] + [x - s for s in steps]
+    pairs = [(i, j) for i in range(n) for j in range(i + 1, n)]
+    for i, j in pairs:
+        points += [x + steps[i] + steps[j], x + steps[i] - steps[j], x - steps[i] + steps[j], x - steps[i] - steps[j]]
+    values = f(np.array(points))
+
+    H = np.zeros((n, n))
+    H[np.arange(n), np.arange(n)] = (values[1:n + 1] - 2 * values[0] + values[n + 1:2 * n + 1]) / h**2
+    for k, (i, j) in enumerate(pairs):
+        pp, pm, mp, mm = values[2 * n + 1 + 4 * k:2 * n + 5 + 4 * k]
+        H[i, j] = H[j, i] = (pp - pm - mp + mm) / (4 * h**2)
+    return H
+
+def posterior_covariance(H):
+    # inverse Hessian, with eigenvalues floored so a flat or badly estimated direction can't give a negative variance
+    values, vectors = np.linalg.eigh((H + H.T) / 2)
+    return (vectors / np.maximum(values, 1e-6)) @ vectors.T
+
+def _e_step(task):
+    # one participant: MAP for every C (warm started), best C under the C prior, posterior covariance at the best
+    index, mu, var, logPriorC, warm, model, C_list, maxiter, method, seed = task
+    data = _participants[index]
+    nParams = len(mu)
+    if warm is None:
+        rng = np.random.default_rng(seed)
+        seeds = mu + np.sqrt(var) * rng.standard_normal((seedPoints, nParams))
+        # every C at once (rlwm_negLL_profile), the prior term is the same for all C
+        scores = rlwm_negLL_profile(to_params(seeds, model_config_rl[model]['param_bounds']), compile_profile(data, C_list), beta, model)
+        scores += 0.5 * np.sum((seeds - mu)**2 / var, axis=1)[:, None]
+        warm = seeds[np.argmin(scores, axis=0)]
+
+    thetas = np.zeros((len(C_list), nParams))
+    values = np.zeros(len(C_list))
+    for c, C in enumerate(C_list):
+        if method == 'L-BFGS-B':
+            res = minimize(neg_posterior_grad, np.clip(warm[c], -thetaMax, thetaMax), args=(data, C, mu, var, model), jac=True,
+                method='L-BFGS-B', bounds=[(-thetaMax, thetaMax)] * nParams, options={'maxiter': maxiter})
+        else:
+            res = minimize(lambda x: neg_posterior(x, data, C, mu, var, model)[0], warm[c], method='Nelder-Mead',
+                options={'maxiter': maxiter, 'xatol': 1e-3, 'fatol': 1e-3})
+        thetas[c], values[c] = res.x, res.fun
+
+    best = np.argmin(values - logPriorC)
+    H = hessian(lambda x: neg_posterior(x, data, C_list[best], mu, var, model), thetas[best])
+    return {'index': index, 'thetas': thetas, 'values': values, 'best': best, 'covariance': posterior_covariance(H)}
+
+## EM ##
+
+def fit_hierarchical(participants, model='RLWM', C_list=C_list, processes=None, maxIter=30, tol=0.1, maxiterE=300, seed=0,
+                     method='L-BFGS-B'):
+    # participants: {id: model format DataFrame (rlwm_data.load_model_data) or compile_participant() arrays}
+    # returns the group prior (one row per parameter), the individual MAP fits and the history of the sweeps
+    # method: 'L-BFGS-B' (exact gradient) or 'Nelder-Mead' for the E-step MAP fits
+    config = model_config_rl[model]
+    paramNames, bounds = config['params'], config['param_bounds']
+    C_list = list(C_list) if config['C'] else [np.inf]
+    ids = list(participants)
+    compiled = [p if isinstance(p, dict) else compile_participant(p) for p in participants.values()]
+    nPart, nParams = len(ids), len(paramNames)
+
+    mu = np.zeros(nParams)
+    var = np.full(nParams, priorSD**2)
+    priorC = np.full(len(C_list), 1 / len(C_list))
+    warm = [None] * nPart
+    history = []
+    previous = np.inf
+
+    pool = None if processes == 1 else multiprocessing.Pool(processes, initializer=_init_worker, initargs=(compiled,))
+    if pool is None:
+        _init_worker(compiled)
+    try:
+        for iteration in range(maxIter):
+            t0 = time.time()
+            tasks = [(i, mu, var, np.log(priorC), warm[i], model, C_list, maxiterE, method, seed + i) for i in range(nPart)]
+            results = pool.map(_e_step, tasks) if pool else list(map(_e_step, tasks))
+
+            thetas = np.array([r['thetas'][r['best']] for r in results])
+            covariances = np.array([r['covariance'] for r in results])
+            bestC = np.array([r['best'] for r in results])
+            warm = [r['thetas'] for r in results]
+
+            # total negative log posterior under the prior used in this sweep
+            values = np.array([r['values'][r['best']] for r in results])
+            total = values.sum() + 0.5 * nPart * np.sum(np.log(2 * np.pi * var)) - np.log(priorC[bestC]).sum()
+
+            # M-step
+            mu = thetas.mean(axis=0)
+            var = np.maximum((thetas**2 + np.diagonal(covariances, axis1=1, axis2=2)).mean(axis=0) - mu**2, minSD**2)
+            priorC = (np.bincount(bestC, minlength=len(C_list)) + 1) / (nPart + len(C_list)) # +1 so no C gets probability 0
+
+            history.append(dict(iteration=iteration, negLogPosterior=total, time=time.time() - t0,
+                **{'mu_' + name: value for name, value in zip(paramNames, mu)},
+                **{'sd_' + name: value for name, value in zip(paramNames, np.sqrt(var))}))
+            print('sweep %d: negative log posterior %.2f (%.1f s)' % (iteration, total, time.time() - t0))
+            if abs(previous - total) < tol:
+                break
+            previous = total
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    # group prior on the parameter scale: the median participant (mu) and the range of the middle 68% (mu -/+ sd)
+    group = pd.DataFrame({'parameter': paramNames, 'mu': mu, 'sd': np.sqrt(var),
+        'median': to_params(mu, bounds), 'low': to_params(mu - np.sqrt(var), bounds), 'high': to_params(mu + np.sqrt(var), bounds)})
+    if config['C']:
+        group = pd.concat([group, pd.DataFrame({'parameter': ['P(C=%d)' % C for C in C_list], 'median': priorC})], ignore_index=True)
+
+    individual = pd.DataFrame(to_params(thetas, bounds), columns=paramNames)
+    individual.insert(0, 'subj_idx', ids)
+    individual['C'] = [C_list[c] if config['C'] else None for c in bestC]
+    individual['negLL'] = [rlwm_negLL_batch(to_params(theta, bounds)[None], data, C_list[c], beta, model)[0]
+        for theta, data, c in zip(thetas, compiled, bestC)]
+    individual['negLogPosterior'] = values
+    return group, individual, pd.DataFrame(history)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit()
+    from rlwm_data import find_output_files, load_model_data
+    group, individual, history = fit_hierarchical(load_model_data(find_output_files(sys.argv[1:])))
+    print(group)
+    print(individual)
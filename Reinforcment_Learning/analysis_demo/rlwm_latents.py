@@ -0,0 +1,134 @@
+'''
+Trial-by-trial latent variables of fitted RL models (e.g. as regressors for EEG)
+
+Replays each participant's fitted model over their training trials and returns, for every trial, the model's state
+before the choice and what it learned from the feedback:
+    Q_RL_0..2, Q_WM_0..2    Q values of the presented stimulus, for each action (0, 1, 2 = keys j, k, l)
+    Q_RL, Q_WM              Q values of the chosen action
+    wmWeight                weight of WM in the choice, rho * min(1, C / set size)
+    p_0..2, pChosen         choice probabilities (mixture of both systems plus epsilon noise) and that of the choice
+    entropy                 entropy of the choice probabilities (nats)
+    RPE_RL, RPE_WM          prediction errors of the chosen action (reward - Q before the update)
+The rows line up with the participant's trials as given (the model format DataFrame from rlwm_data.py,
+with trialNumber when there is one), so they can be joined back to the task output or to EEG events.
+
+All participants are replayed together: their blocks are stacked side by side (blocks don't interact in the model),
+with each block carrying its participant's parameters, so the replay is one pass over the trials of the longest block
+whatever the number of participants. Any model of model_config_rl can be used (its own update rule is applied).
+The output is a Feather file (columnar, pd.read_feather / pyarrow).
+
+Usage (from this folder):
+    python rlwm_latents.py path/to/data rlwm_fits.feather                     # fits from rlwm_pipeline.py, latents in rlwm_latents.feather
+    python rlwm_latents.py path/to/data fits.feather latents.feather WM       # another model
+'''
+
+import sys, time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from rlwm_likelihood import compile_participant, model_config_rl, defaultValues, numActions, beta
+
+## Replay ##
+
+def stack_participants(compiled):
+    # every participant's blocks side by side, trials padded to the longest block: (trials x all blocks) arrays
+    nTrials = max(data['stateT'].shape[0] for data in compiled)
+    def pad(array):
+        return np.pad(array, ((0, nTrials - array.shape[0]), (0, 0)))
+    stacked = {name: np.concatenate([pad(data[name]) for data in compiled], axis=1)
+               for name in ['stateT', 'actionT', 'rewardT', 'magnitudeT', 'maskT']}
+    stacked['trialIndexT'] = np.concatenate([pad(data['trialIndex'].T + 1) for data in compiled], axis=1) - 1 # -1 for padding
+    stacked['setSize'] = np.concatenate([data['setSize'] for data in compiled])
+    stacked['participant'] = np.concatenate([np.full(len(data['setSize']), i) for i, data in enumerate(compiled)])
+    return stacked
+
+def replay(stacked, params, C, beta=beta, model='RLWM'):
+    # params: {name: one value per participant}, C: one per participant -> {latent: (trials x all blocks) array}
+    config = model_config_rl[model]
+    column = stacked['participant']
+    values = dict(defaultValues, **config.get('fixed', {}))
+    values.update(params)
+    # one candidate (the fit), parameters varying by block: shapes (1, blocks, 1) as the update rules expect
+    p = {name: np.broadcast_to(np.asarray(value, dtype=float), len(C))[column][None, :, None] for name, value in values.items()}
+    p['rates'] = np.concatenate([p['alpha'], np.ones_like(p['alpha'])], axis=2)
+    update = config['update']
+
+    state, action, reward = stacked['stateT'], stacked['actionT'], stacked[config['reward']]
+    nTrials, nBlocks = state.shape
+    blocks = np.arange(nBlocks)
+    q = np.full((1, nBlocks, stacked['setSize'].max(), 2, numActions), 1 / numActions)
+    weight = p['rho'][0, :, 0] * np.minimum(1, np.asarray(C, dtype=float)[column] / stacked['setSize'])
+    epsilon = p['epsilon'][0]
+    decay = p['phi'][..., None]
+
+    latents = {name: np.zeros((nTrials, nBlocks, numActions)) for name in ['Q_RL', 'Q_WM', 'p']}
+    latents.update((name, np.zeros((nTrials, nBlocks))) for name in ['RPE_RL', 'RPE_WM'])
+    for t in range(nTrials):
+        s, a, r = state[t], action[t], reward[t]
+        qs = q[0, blocks, s] # (blocks, 2, actions)
+        e = np.exp(beta * (qs - qs.max(axis=2, keepdims=True)))
+        soft = e / e.sum(axis=2, keepdims=True)
+        pol = (1 - weight)[:, None] * soft[:, 0] + weight[:, None] * soft[:, 1]
+        latents['p'][t] = (1 - epsilon) * pol + epsilon / numActions
+        latents['Q_RL'][t], latents['Q_WM'][t] = qs[:, 0], qs[:, 1]
+
+        qa = qs[blocks, :, a]
+        latents['RPE_RL'][t], latents['RPE_WM'][t] = (r[:, None] - qa).T
+        q[0, blocks, s, :, a] = update(qa[None], r[None, :, None], p)[0]
+        q[:, :, :, 1] += decay * (1 / numActions - q[:, :, :, 1])
+
+    latents['wmWeight'] = np.broadcast_to(weight, (nTrials, nBlocks))
+    return latents
+
+## Extraction ##
+
+def extract_latents(participants, fits, model='RLWM', beta=beta):
+    # participants: {id: model format DataFrame}, fits: one row per participant (subj_idx, the model's params, C)
+    # returns one row per trial, participants in the order of fits, trials in their original order
+    fits = fits.set_index('subj_idx').loc[[p for p in fits['subj_idx'] if p in participants]]
+    ids = list(fits.index)
+    frames = [participants[p].reset_index(drop=True) for p in ids]
+    stacked = stack_participants([compile_participant(dat) for dat in frames])
+    C = fits['C'].astype(float).values if model_config_rl[model]['C'] else np.full(len(ids), np.inf)
+    latents = replay(stacked, {name: fits[name].values for name in model_config_rl[model]['params']}, C, beta, model)
+
+    # back to one row per trial: (trial, block) cells with a trial, ordered by participant then original row
+    mask = stacked['maskT']
+    participant = np.broadcast_to(stacked['participant'], mask.shape)[mask]
+    row = stacked['trialIndexT'][mask]
+    order = np.lexsort((row, participant))
+    participant, row = participant[order], row[order]
+    action = stacked['actionT'][mask][order]
+
+    columns = {'subj_idx': np.array(ids, dtype=object)[participant]}
+    trials = pd.concat(frames, ignore_index=True)
+    for name in ['trialNumber', 'block_id', 'stim_id', 'resp', 'feedback']:
+        if name in trials:
+            columns[name] = trials[name].values # same order: participants in order, rows in order
+    for name in ['Q_RL', 'Q_WM', 'p']:
+        values = latents[name][mask][order]
+        for k in range(numActions):
+            columns['%s_%d' % (name, k)] = values[:, k]
+        columns['pChosen' if name == 'p' else name] = values[np.arange(len(action)), action]
+    p = np.column_stack([columns['p_%d' % k] for k in range(numActions)])
+    columns['entropy'] = -np.sum(p * np.log(p), axis=1)
+    for name in ['wmWeight', 'RPE_RL', 'RPE_WM']:
+        columns[name] = latents[name][mask][order]
+    return pd.DataFrame(columns)
+
+def write_latents(latents, fileName):
+    feather.write_feather(pa.Table.from_pandas(latents, preserve_index=False), fileName)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit()
+    from rlwm_data import find_output_files, load_model_data
+    outFile = sys.argv[3] if len(sys.argv) > 3 else 'rlwm_latents.feather'
+    model = sys.argv[4] if len(sys.argv) > 4 else 'RLWM'
+    participants = load_model_data(find_output_files([sys.argv[1]]))
+    t0 = time.time()
+    latents = extract_latents(participants, pd.read_feather(sys.argv[2]), model)
+    write_latents(latents, outFile)
+    print('%d trials of %d participants in %.1f s -> %s' % (len(latents), latents['subj_idx'].nunique(), time.time() - t0, outFile))
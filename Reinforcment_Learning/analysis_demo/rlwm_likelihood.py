@@ -0,0 +1,380 @@
+'''
+RLWM likelihood over precompiled arrays
+
+Same model and likelihood as RLWM_LL in RLWM_model_fit.ipynb, written to be called thousands of times per fit:
+    - compile_participant() turns one participant's trials (columns block_id, stim_id, resp, feedback) into arrays once.
+      Blocks are padded to the longest block, giving (trials x blocks) arrays of state, action and reward with a mask,
+      plus each block's set size and where its trials start in the original trial order.
+    - rlwm_negLL() runs the Q_RL / Q_WM recursion for all blocks at the same time (blocks don't share anything),
+      so the Python loop is over the trials of the longest block (50) rather than every trial (360),
+      and there is no DataFrame filtering inside the likelihood.
+    - the softmax subtracts the largest Q value before exponentiating, so it can't overflow whatever beta is.
+    - rlwm_negLL_batch() does the same for a (K x 5) matrix of parameter vectors, each with its own C,
+      with the K candidates along a leading axis: a grid search, the starting points of a multi-start fit
+      or a profile likelihood cost about one sweep over the trials instead of K.
+    - rlwm_negLL_profile() gives the likelihood for every C of C_list at once: blocks whose set size is <= C don't
+      depend on C, so only the distinct (block, capacity) pairs are run, all in one sweep (with an optional memo).
+    - rlwm_negLL_grad() also returns the exact gradient (derivatives carried through the recursion), and
+      theta_negLL_grad() the same on an unbounded logit scale, for quasi-Newton fits (rlwm_fit.py, method='L-BFGS-B').
+    - model_config_rl also holds simpler and alternative models (RL only, WM only, no gamma, reward magnitude),
+      all run by the same code on the same compiled arrays; a model only brings its parameters and its update rule.
+
+The results match the notebook's RLWM_LL up to floating point rounding (relative differences ~1e-15),
+not bit for bit: the stable softmax and the per-block sums round differently.
+
+Benchmark against the notebook's own function (read from the notebook), on demo_data.csv:
+    python rlwm_likelihood.py
+'''
+
+import json, os, time
+import numpy as np
+import pandas as pd
+from scipy.special import expit, logit
+
+numActions = 3
+beta = 100 # fixed inverse temperature, as in the notebook
+paramNames = ['alpha', 'phi', 'rho', 'gamma', 'epsilon'] # C is fit separately, over C_list
+paramBounds = [[0.0, 0.0, 0.0, 0.0, 0.0], [1.0, 1.0, 1.0, 1.0, 1.0]]
+
+## Models ##
+
+# Every model has the same structure: an RL and a WM system, mixed with weight rho * min(1, C / set size),
+# plus epsilon noise, and WM decaying by phi on every trial. What a model changes is
+#     params        the parameters it fits (the others take their value from 'fixed', or defaultValues)
+#     C             whether it has a capacity (fit over C_list)
+#     reward        the compiled array used as the reward: 'rewardT' (1 for 1 or 2 points) or 'magnitudeT' (points / 2)
+#     update        its update rule: (Q values of the chosen action of both systems, reward, parameters) -> new Q values
+# so adding a model means writing its update rule and one entry here.
+# In an update rule qa is (candidates, blocks, [RL, WM]), the parameters are (candidates, 1, 1) and
+# p['rates'] is the learning rate of each system (alpha, 1).
+
+defaultValues = {'alpha': 0.0, 'phi': 0.0, 'rho': 0.0, 'gamma': 1.0, 'epsilon': 0.0}
+
+def rlwm_update(qa, reward, p):
+    # RL learns at alpha, WM at 1, both scaled by gamma after a negative RL prediction error (the notebook's model)
+    rpe = reward - qa
+    scale = np.where(rpe[..., :1] >= 0, 1, p['gamma'])
+    return qa + scale * p['rates'] * rpe
+
+def delta_update(qa, reward, p):
+    # same learning rates after positive and negative prediction errors
+    return qa + p['rates'] * (reward - qa)
+
+model_config_rl = {
+    'RLWM': { # as in the notebook
+        'params': paramNames, 'param_bounds': paramBounds, 'C': True, 'reward': 'rewardT', 'update': rlwm_update,
+        },
+    'RLWM_noGamma': {
+        'params': ['alpha', 'phi', 'rho', 'epsilon'], 'param_bounds': [[0.0] * 4, [1.0] * 4],
+        'C': True, 'reward': 'rewardT', 'update': delta_update,
+        },
+    'RLWM_magnitude': { # 2 points is a bigger reward than 1 point
+        'params': paramNames, 'param_bounds': paramBounds, 'C': True, 'reward': 'magnitudeT', 'update': rlwm_update,
+        },
+    'RL': { # RL only
+        'params': ['alpha', 'gamma', 'epsilon'], 'param_bounds': [[0.0] * 3, [1.0] * 3], 'fixed': {'rho': 0.0},
+        'C': False, 'reward': 'rewardT', 'update': rlwm_update,
+        },
+    'WM': { # WM only: the RL values stay at 1/numActions, so what WM doesn't cover is a random choice
+        'params': ['phi', 'rho', 'gamma', 'epsilon'], 'param_bounds': [[0.0] * 4, [1.0] * 4], 'fixed': {'alpha': 0.0},
+        'C': True, 'reward': 'rewardT', 'update': rlwm_update,
+        },
+    }
+
+def n_params(model):
+    # number of free parameters, counting C
+    return len(model_config_rl[model]['params']) + model_config_rl[model]['C']
+
+## Data ##
+
+def compile_participant(dat):
+    # one participant's trials -> arrays padded to the longest block, blocks in the same (sorted) order as the notebook
+    blocks = np.unique(dat['block_id'])
+    blockID = dat['block_id'].values
+    rows = [np.flatnonzero(blockID == b) for b in blocks]
+    nTrials = max(len(r) for r in rows)
+
+    state = np.zeros((len(blocks), nTrials), dtype=np.intp)
+    action = np.zeros((len(blocks), nTrials), dtype=np.intp)
+    reward = np.zeros((len(blocks), nTrials))
+    points = np.zeros((len(blocks), nTrials))
+    mask = np.zeros((len(blocks), nTrials), dtype=bool)
+    trialIndex = np.full((len(blocks), nTrials), -1, dtype=np.intp) # row of each trial in dat (-1 for padding)
+    setSize = np.zeros(len(blocks), dtype=np.intp)
+    for b, r in enumerate(rows):
+        stims = dat['stim_id'].values[r]
+        setSize[b] = len(np.unique(stims))
+        state[b, :len(r)] = stims
+        action[b, :len(r)] = dat['resp'].values[r]
+        reward[b, :len(r)] = dat['feedback'].values[r] > 0 # 1 or 2 points -> reward 1
+        points[b, :len(r)] = dat['feedback'].values[r]
+        mask[b, :len(r)] = True
+        trialIndex[b, :len(r)] = r
+
+    blockOffsets = np.r_[0, np.cumsum([len(r) for r in rows])[:-1]]
+    # the likelihood steps through the trials, so they are stored trial-major (trials x blocks), contiguous per trial
+    return {'blocks': blocks, 'setSize': setSize, 'blockOffsets': blockOffsets, 'trialIndex': trialIndex,
+            'stateT': np.ascontiguousarray(state.T), 'actionT': np.ascontiguousarray(action.T),
+            'rewardT': np.ascontiguousarray(reward.T), 'magnitudeT': np.ascontiguousarray(points.T / 2),
+            'maskT': np.ascontiguousarray(mask.T)}
+
+def select_blocks(data, blockIndex):
+    # compiled data of some of the blocks only (blocks are independent in the model), e.g. for cross-validation
+    blockIndex = np.asarray(blockIndex)
+    return {name: (array[:, blockIndex] if name.endswith('T') else array[blockIndex]) for name, array in data.items()}
+
+## Likelihood ##
+
+def out_of_bounds(params, bounds=paramBounds):
+    # True for each parameter vector (last axis) with a value outside the bounds
+    return np.any(params < bounds[0], axis=-1) | np.any(params > bounds[1], axis=-1)
+
+def rlwm_negLL(params, data, C, beta=beta, model='RLWM'):
+    # negative log likelihood of one parameter vector (the model's params, in order) for capacity C,
+    # np.inf outside the bounds (as in the notebook)
+    return rlwm_negLL_batch(np.asarray(params, dtype=float)[None], data, C, beta, model)[0]
+
+def rlwm_negLL_batch(paramSets, data, C, beta=beta, model='RLWM'):
+    # negative log likelihoods of K parameter vectors at once: paramSets (K x number of params), C one capacity or one per row
+    # the K candidates run through the trials together (leading axis of every array), so the cost is one sweep over the trials
+    C = np.asarray(C, dtype=float)
+    return rlwm_block_negLL(paramSets, data, C[..., None] if C.ndim else C, beta, model).sum(axis=1)
+
+def rlwm_block_negLL(paramSets, data, C, beta=beta, model='RLWM'):
+    # negative log likelihood of every block for K parameter vectors: (K x blocks), rows outside the bounds np.inf
+    # C can differ by block as well as by row (anything that broadcasts to K x blocks)
+    config = model_config_rl[model]
+    paramSets = np.atleast_2d(np.asarray(paramSets, dtype=float))
+    nBlocks = data['stateT'].shape[1]
+    C = np.broadcast_to(np.asarray(C, dtype=float), (len(paramSets), nBlocks))
+    negLL = np.full((len(paramSets), nBlocks), np.inf)
+    inside = ~out_of_bounds(paramSets, config['param_bounds'])
+    if not inside.any():
+        return negLL
+    nSets = inside.sum()
+    values = dict(defaultValues, **config.get('fixed', {}))
+    values.update(zip(config['params'], paramSets[inside].T))
+    p = {name: np.broadcast_to(value, nSets)[:, None, None] for name, value in values.items()}
+    p['rates'] = np.concatenate([p['alpha'], np.ones((nSets, 1, 1))], axis=2)
+    C = C[inside]
+
+    state, action, reward, mask = data['stateT'], data['actionT'], data[config['reward']], data['maskT']
+    nTrials, nBlocks = state.shape
+    sets = np.arange(nSets)[:, None]
+    blocks = np.arange(nBlocks)[None, :]
+    update = config['update']
+
+    # Q values of both systems in one array: (candidates, blocks, states, [RL, WM], actions)
+    q = np.full((nSets, nBlocks, data['setSize'].max(), 2, numActions), 1 / numActions)
+    weight = p['rho'][:, :, 0] * np.minimum(1, C / data['setSize'])
+    systemWeights = np.stack([1 - weight, weight], axis=2) # (candidates, blocks, 2)
+    epsilon = p['epsilon'][:, :, 0]
+    decay = p['phi'][..., None]
+
+    logLik = np.zeros((nSets, nBlocks))
+    for t in range(nTrials):
+        s, a, r = state[t], action[t], reward[t]
+        qs = q[sets, blocks, s] # (candidates, blocks, 2, actions)
+
+        # softmax of both systems, shifted by the max so exp() stays <= 1, evaluated at the chosen action
+        e = np.exp(beta * (qs - qs.max(axis=3, keepdims=True)))
+        pol = (systemWeights * e[sets, blocks, :, a] / e.sum(axis=3)).sum(axis=2)
+        logLik += np.log(np.where(mask[t], (1 - epsilon) * pol + epsilon / numActions, 1))
+
+        # the model's update of the chosen action
+        # (padding is only at the end of a block, so updates there don't matter)
+        q[sets, blocks, s, :, a] = update(qs[sets, blocks, :, a], r[None, :, None], p)
+
+        # WM decay towards 1/numActions on every trial
+        q[:, :, :, 1] += decay * (1 / numActions - q[:, :, :, 1])
+
+    negLL[inside] = -logLik
+    return negLL
+
+## C profile ##
+
+# C only enters through weight = rho * min(1, C / set size), so a block with set size <= C has the same likelihood
+# for every such C. Over C_list = [2, 3, 4, 5] the V4 blocks (set sizes 2,2,3,3,3,4,4,5,5,5) only have 26 distinct
+# (block, capacity) pairs instead of 40, and all of them can run through the recursion together.
+
+def compile_profile(data, C_list):
+    # the distinct (block, capacity) pairs of a C sweep, as compiled data with one column per pair
+    capacity = np.minimum(1, np.asarray(C_list, dtype=float)[:, None] / data['setSize'])
+    pairs = {}
+    pairBlocks, pairC = [], []
+    index = np.zeros(capacity.shape, dtype=np.intp) # (C, block) -> pair
+    for c, C in enumerate(C_list):
+        for b in range(len(data['setSize'])):
+            key = (b, capacity[c, b])
+            if key not in pairs:
+                pairs[key] = len(pairBlocks)
+                pairBlocks.append(b)
+                pairC.append(C)
+            index[c, b] = pairs[key]
+    return {'C_list': list(C_list), 'data': select_blocks(data, pairBlocks), 'C': np.array(pairC, dtype=float), 'index': index}
+
+def rlwm_negLL_profile(paramSets, profile, beta=beta, model='RLWM', cache=None):
+    # negLL of K parameter vectors for every C of the profile (K x len(C_list)), in one sweep over the trials
+    # cache: a dict kept by the caller (one per participant and profile), memoizing the per-block results of each
+    # parameter vector, so points scored before (e.g. shared starting points, a grid scored again) are not recomputed
+    paramSets = np.atleast_2d(np.asarray(paramSets, dtype=float))
+    blockNegLL = np.zeros((len(paramSets), len(profile['C'])))
+    keys = [(model, beta, x.tobytes()) for x in paramSets]
+    todo = [k for k, key in enumerate(keys) if cache is None or key not in cache]
+    for k in set(range(len(keys))) - set(todo):
+        blockNegLL[k] = cache[keys[k]]
+    if todo:
+        blockNegLL[todo] = rlwm_block_negLL(paramSets[todo], profile['data'], profile['C'], beta, model)
+        if cache is not None:
+            cache.update((keys[k], blockNegLL[k]) for k in todo)
+    return blockNegLL[:, profile['index']].sum(axis=2)
+
+## Gradient ##
+
+def rlwm_negLL_grad(params, data, C, beta=beta, model='RLWM'):
+    # negative log likelihood and its exact gradient with respect to the model's params,
+    # by carrying the derivatives of every Q value along the recursion (forward mode)
+    # for models whose update rule is rlwm_update or delta_update (delta_update is rlwm_update with gamma fixed at 1)
+    config = model_config_rl[model]
+    if config['update'] not in (rlwm_update, delta_update):
+        raise ValueError('No gradient for the update rule of %s' % model)
+    params = np.asarray(params, dtype=float)
+    if out_of_bounds(params, config['param_bounds']):
+        return np.inf, np.full(len(params), np.nan)
+    values = dict(defaultValues, **config.get('fixed', {}))
+    values.update(zip(config['params'], params))
+    alpha, phi, rho, gamma, epsilon = [values[name] for name in paramNames]
+    if config['update'] is delta_update:
+        gamma = 1.0
+    iAlpha, iPhi, iRho, iGamma, iEpsilon = range(len(paramNames))
+
+    state, action, reward, mask = data['stateT'], data['actionT'], data[config['reward']], data['maskT']
+    nTrials, nBlocks = state.shape
+    nFull = len(paramNames)
+    blocks = np.arange(nBlocks)
+
+    q = np.full((nBlocks, data['setSize'].max(), 2, numActions), 1 / numActions)
+    dq = np.zeros(q.shape + (nFull,)) # derivative of every Q value with respect to every parameter
+    capacity = np.minimum(1, C / data['setSize'])
+    systemWeights = np.column_stack([1 - rho * capacity, rho * capacity])
+    learningRates = np.array([alpha, 1.0])
+
+    logLik = 0.0
+    grad = np.zeros(nFull)
+    for t in range(nTrials):
+        s, a, r, m = state[t], action[t], reward[t], mask[t]
+        qs, dqs = q[blocks, s], dq[blocks, s] # (blocks, 2, actions), (blocks, 2, actions, params)
+
+        # probability of the chosen action under each system, and its derivative:
+        # d softmax_a = beta * softmax_a * (dq_a - sum_k softmax_k dq_k)
+        e = np.exp(beta * (qs - qs.max(axis=2, keepdims=True)))
+        soft = e / e.sum(axis=2, keepdims=True)
+        softA = soft[blocks, :, a] # (blocks, 2)
+        dSoftA = beta * softA[..., None] * (dqs[blocks, :, a] - np.einsum('bsk,bskp->bsp', soft, dqs))
+
+        pol = (systemWeights * softA).sum(axis=1)
+        dPol = np.einsum('bs,bsp->bp', systemWeights, dSoftA)
+        dPol[:, iRho] += capacity * (softA[:, 1] - softA[:, 0])
+        polFinal = (1 - epsilon) * pol + epsilon / numActions
+        dPolFinal = (1 - epsilon) * dPol
+        dPolFinal[:, iEpsilon] += 1 / numActions - pol
+
+        logLik += np.log(polFinal[m]).sum()
+        grad += (dPolFinal[m] / polFinal[m, None]).sum(axis=0)
+
+        # update of the chosen action: new = qa + scale * rates * rpe
+        qa, dqa = qs[blocks, :, a], dqs[blocks, :, a]
+        rpe = r[:, None] - qa
+        negative = rpe[:, :1] < 0
+        scale = np.where(negative, gamma, 1.0)
+        step = scale * learningRates # (blocks, 2)
+        newDq = (1 - step)[..., None] * dqa
+        newDq[:, 0, iAlpha] += scale[:, 0] * rpe[:, 0]
+        newDq[:, :, iGamma] += np.where(negative, learningRates * rpe, 0)
+        q[blocks, s, :, a] = qa + step * rpe
+        dq[blocks, s, :, a] = newDq
+
+        # WM decay towards 1/numActions on every trial
+        dq[:, :, 1] *= 1 - phi
+        dq[:, :, 1, :, iPhi] += 1 / numActions - q[:, :, 1]
+        q[:, :, 1] += phi * (1 / numActions - q[:, :, 1])
+
+    free = [paramNames.index(name) for name in config['params']]
+    return -logLik, -grad[free]
+
+## Unbounded parameter scale ##
+
+# theta = logit((param - low) / (high - low)): any theta is inside the bounds, so an optimizer (or a normal prior) can work on theta
+
+def to_params(theta, bounds):
+    low, high = np.asarray(bounds[0]), np.asarray(bounds[1])
+    return low + (high - low) * expit(theta)
+
+def to_theta(params, bounds):
+    low, high = np.asarray(bounds[0]), np.asarray(bounds[1])
+    return logit(np.clip((np.asarray(params) - low) / (high - low), 1e-6, 1 - 1e-6))
+
+def theta_negLL_grad(theta, data, C, beta=beta, model='RLWM'):
+    # rlwm_negLL_grad on the theta scale (chain rule through the logistic)
+    bounds = model_config_rl[model]['param_bounds']
+    negLL, grad = rlwm_negLL_grad(to_params(theta, bounds), data, C, beta, model)
+    sig = expit(theta)
+    return negLL, grad * (np.asarray(bounds[1]) - np.asarray(bounds[0])) * sig * (1 - sig)
+
+## Benchmark ##
+
+def notebook_functions(notebookFile=None):
+    # runs the notebook's code cells up to the one that loads the data, returns its namespace (RLWM_LL, softmax...)
+    notebookFile = notebookFile or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'RLWM_model_fit.ipynb')
+    with open(notebookFile) as f:
+        cells = [''.join(c['source']) for c in json.load(f)['cells'] if c['cell_type'] == 'code']
+    namespace = {}
+    for source in cells:
+        if 'read_csv' in source:
+            break
+        exec(source, namespace)
+    return namespace
+
+def benchmark(dataFile=None, nParams=200, seed=0):
+    dataFile = dataFile or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'demo_data.csv')
+    dat = pd.read_csv(dataFile)
+    notebook = notebook_functions()
+    rng = np.random.default_rng(seed)
+    paramSets = rng.uniform(0, 1, (nParams, 5))
+    Cs = rng.choice([2, 3, 4, 5], nParams)
+
+    t0 = time.perf_counter()
+    expected = np.array([notebook['RLWM_LL'](p, dat, numActions, C, beta) for p, C in zip(paramSets, Cs)])
+    tNotebook = (time.perf_counter() - t0) / nParams
+
+    t0 = time.perf_counter()
+    data = compile_participant(dat)
+    tCompile = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    result = np.array([rlwm_negLL(p, data, C) for p, C in zip(paramSets, Cs)])
+    tCompiled = (time.perf_counter() - t0) / nParams
+
+    t0 = time.perf_counter()
+    batch = rlwm_negLL_batch(paramSets, data, Cs)
+    tBatch = (time.perf_counter() - t0) / nParams
+
+    print('max relative difference to the notebook: %.1e' % np.max(np.abs(result - expected) / np.abs(expected)))
+    print('max relative difference, batch vs one at a time: %.1e' % np.max(np.abs(batch - result) / np.abs(result)))
+    print('notebook RLWM_LL: %.2f ms per call' % (tNotebook * 1000))
+    print('rlwm_negLL:       %.2f ms per call (+ %.2f ms to compile the data once), %.0fx faster' % (tCompiled * 1000, tCompile * 1000, tNotebook / tCompiled))
+    print('rlwm_negLL_batch: %.3f ms per parameter vector (%d at once), %.0fx faster' % (tBatch * 1000, nParams, tNotebook / tBatch))
+
+    # every C for every parameter vector: one batch call per C vs the profile (distinct block/capacity pairs only)
+    C_list = [2, 3, 4, 5]
+    t0 = time.perf_counter()
+    separate = np.column_stack([rlwm_negLL_batch(paramSets, data, C) for C in C_list])
+    tSeparate = time.perf_counter() - t0
+    profile = compile_profile(data, C_list)
+    t0 = time.perf_counter()
+    profiled = rlwm_negLL_profile(paramSets, profile)
+    tProfile = time.perf_counter() - t0
+    print('C profile (%d parameter vectors x %d C): %.0f ms with one batch per C, %.0f ms with rlwm_negLL_profile (%d of %d blocks run), max difference %.1e'
+        % (nParams, len(C_list), tSeparate * 1000, tProfile * 1000, len(profile['C']), profile['index'].size, np.max(np.abs(profiled - separate))))
+
+if __name__ == '__main__':
+    benchmark()
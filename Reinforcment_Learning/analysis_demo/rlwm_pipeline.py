@@ -0,0 +1,124 @@
+'''
+RLWM fits for a whole cohort, with cached results
+
+    1. finds the task output files (rlwm_data.find_output_files) and converts them to model format (one entry per session)
+    2. fits every participant not already in the cache, participants in parallel (one process each, rlwm_fit.fit_participant)
+    3. writes one row per participant to a columnar results table (Feather, read with pd.read_feather)
+
+Each fit is cached in cacheDir under a key that hashes everything the result depends on:
+the participant's model data (block_id, stim_id, resp, feedback), the model config (model_config_rl), beta and the optimizer settings.
+Re-running after adding participants only fits the new ones; changing a bound, beta or a setting refits everyone (new keys),
+and the old results stay in the cache under their own keys.
+Each result is written (atomically) as soon as its participant is done, so an interrupted run resumes where it stopped.
+Any model of model_config_rl can be fit (model='RLWM' by default); rlwm_compare.py uses the same cache.
+
+Usage (from this folder):
+    python rlwm_pipeline.py path/to/data                           # results in rlwm_fits.feather, cache in rlwm_cache/
+    python rlwm_pipeline.py path/to/data results.feather 8         # with 8 processes
+'''
+
+import hashlib, inspect, json, multiprocessing, os, sys, time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from rlwm_data import find_output_files, load_model_data, data_hash
+from rlwm_likelihood import compile_participant, model_config_rl, beta
+from rlwm_fit import fit_participant, C_list, n_restarts
+
+optimizerSettings = {
+    'method'    :   'Nelder-Mead', # or 'L-BFGS-B'
+    'C_list'    :   C_list,
+    'n_restarts':   n_restarts,
+    'nConverged':   3,
+    'negLLTol'  :   1e-2,
+    'paramTol'  :   0.05,
+    'seed'      :   0, # same starting points for every participant, so results are reproducible
+    }
+
+## Cache ##
+
+def model_signature(model):
+    # the model's config with its update rule as source code, so editing the rule changes the key
+    config = dict(model_config_rl[model])
+    config['update'] = inspect.getsource(config['update'])
+    return config
+
+def cache_key(dat, model='RLWM', beta=beta, settings=optimizerSettings, heldOut=None):
+    # heldOut: blocks left out of the fit (cross-validation), None for a fit to all the data
+    config = {'data': data_hash(dat), 'model': model_signature(model), 'beta': beta, 'optimizer': settings}
+    if heldOut is not None:
+        config['heldOut'] = [int(b) for b in heldOut]
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+def cache_file(cacheDir, key):
+    return os.path.join(cacheDir, key + '.json')
+
+def save_result(cacheDir, key, participant, fit, table):
+    # written to a temporary name and renamed, so an interrupted write never leaves a broken result
+    fileName = cache_file(cacheDir, key)
+    tmpFile = fileName + '.tmp'
+    with open(tmpFile, 'w') as f:
+        json.dump({'participant': participant, 'key': key, 'fit': fit, 'restarts': table.to_dict('list')}, f,
+            default=lambda x: x.item()) # numpy numbers -> python numbers
+    os.replace(tmpFile, fileName)
+
+def load_result(cacheDir, key):
+    with open(cache_file(cacheDir, key)) as f:
+        return json.load(f)
+
+## Fitting ##
+
+def fit_task(task):
+    # one participant, restarts run in this process (the participants are what runs in parallel)
+    participant, key, data, settings, model = task
+    fit, table = fit_participant(data, model, C_list=settings['C_list'], n_restarts=settings['n_restarts'], processes=1,
+        seed=settings['seed'], nConverged=settings['nConverged'], negLLTol=settings['negLLTol'], paramTol=settings['paramTol'],
+        method=settings['method'])
+    return participant, key, fit, table
+
+def run_tasks(tasks, cacheDir, processes=None):
+    # fits (participant, key, compiled data, settings, model) tasks in parallel, each result cached as soon as it is done
+    t0 = time.time()
+    def save(n, result):
+        participant, key, fit, table = result
+        save_result(cacheDir, key, participant, fit, table)
+        print('%d/%d %s %s: negLL %.2f (%.0f s)' % (n, len(tasks), participant, fit['model'], fit['negLL'], time.time() - t0))
+
+    if processes == 1:
+        for n, task in enumerate(tasks, start=1):
+            save(n, fit_task(task))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            for n, result in enumerate(pool.imap_unordered(fit_task, tasks), start=1):
+                save(n, result)
+
+def fit_cohort(paths, resultsFile='rlwm_fits.feather', cacheDir='rlwm_cache', processes=None, settings=optimizerSettings, model='RLWM'):
+    participants = load_model_data(find_output_files(paths))
+    keys = {p: cache_key(dat, model, settings=settings) for p, dat in participants.items()}
+    os.makedirs(cacheDir, exist_ok=True)
+
+    todo = [p for p in participants if not os.path.exists(cache_file(cacheDir, keys[p]))]
+    print('%d participants, %d cached, %d to fit' % (len(participants), len(participants) - len(todo), len(todo)))
+    # compiled arrays go to the workers, not DataFrames
+    run_tasks([(p, keys[p], compile_participant(participants[p]), settings, model) for p in todo], cacheDir, processes)
+
+    results = pd.DataFrame(results_rows(participants, keys, cacheDir, model))
+    feather.write_feather(pa.Table.from_pandas(results, preserve_index=False), resultsFile)
+    return results
+
+def results_rows(participants, keys, cacheDir, model='RLWM'):
+    rows = []
+    for p, dat in participants.items():
+        result = load_result(cacheDir, keys[p])
+        row = {'subj_idx': p, 'key': keys[p], 'model': model, 'nTrials': len(dat), 'nBlocks': dat['block_id'].nunique()}
+        row.update((name, result['fit'][name]) for name in model_config_rl[model]['params'] + ['C', 'negLL', 'nRestarts', 'wallTime'])
+        rows.append(row)
+    return rows
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit()
+    resultsFile = sys.argv[2] if len(sys.argv) > 2 else 'rlwm_fits.feather'
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    print(fit_cohort([sys.argv[1]], resultsFile, processes=processes))
@@ -0,0 +1,167 @@
+'''
+RLWM simulations on the task's real schedules, and parameter recovery
+
+simulate() generates choices from the RLWM model (same model as rlwm_likelihood.py) for many synthetic agents at once,
+on the training trials of rlwmpst/V4/S_n/train.csv: the same blocks, set sizes, stimulus orders, correct keys and
+2/1 point values a participant would get. Agents and blocks run together along the leading axes of the Q arrays,
+so thousands of agents cost about one pass over the trials of the longest block.
+The simulated data are already compiled (rlwm_likelihood.compile_participant arrays), ready for the fits.
+
+recover_parameters() draws true parameters (uniform within the bounds, C from C_list), simulates one agent per draw,
+fits every agent in parallel (rlwm_fit.fit_participant, one process per agent) and reports how well each parameter
+is recovered: the correlation between true and fitted values, and for C also how often it is recovered exactly.
+
+The V4 sets have 10 training blocks. To check recovery with more blocks (e.g. 12), pass several sets to load_schedule:
+their blocks are appended in order and the first nBlocks are kept.
+
+Usage (from this folder):
+    python rlwm_simulate.py                       # 200 agents on S_1, 5 restarts per C
+    python rlwm_simulate.py 200 12                # 12 blocks (S_1 + the first 2 blocks of S_2)
+'''
+
+import multiprocessing, os, sys, time
+import numpy as np
+import pandas as pd
+from rlwm_likelihood import compile_participant, numActions, paramNames, paramBounds, beta
+from rlwm_fit import fit_participant, C_list
+
+versionPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rlwmpst', 'V4')
+firstKeyCode = 13 # j, k, l -> actions 0, 1, 2 (as in rlwm_data.py)
+
+## Schedules ##
+
+def load_schedule(setPaths, nBlocks=None):
+    # training trials of one or more S_n folders, blocks renumbered 1..n in order, compiled like a participant's data
+    frames = []
+    for setPath in setPaths:
+        train = pd.read_csv(os.path.join(setPath, 'train.csv'), index_col=0)
+        frames.append(pd.DataFrame({
+            'set': os.path.basename(setPath),
+            'block': train['block #'].astype(int),
+            'stim_id': train['in block stim #'].astype(int) - 1,
+            'correct': train['correct key#'].astype(int) - firstKeyCode,
+            'fbValue': train['CorrectFB value'].astype(int),
+            }))
+    schedule = pd.concat(frames, ignore_index=True)
+    schedule['block_id'] = schedule.groupby(['set', 'block'], sort=False).ngroup() + 1
+    if nBlocks is not None:
+        if nBlocks > schedule['block_id'].max():
+            raise ValueError('The schedule only has %d blocks' % schedule['block_id'].max())
+        schedule = schedule[schedule['block_id'] <= nBlocks].reset_index(drop=True)
+
+    schedule['resp'] = 0 # filled in by the simulation
+    schedule['feedback'] = 0
+    data = compile_participant(schedule)
+    # correct action and point value per trial, in the same (trials x blocks) layout
+    rows = np.maximum(data['trialIndex'].T, 0)
+    data['correctT'] = np.ascontiguousarray(schedule['correct'].values[rows])
+    data['fbValueT'] = np.ascontiguousarray(schedule['fbValue'].values[rows])
+    return data
+
+## Simulation ##
+
+def simulate(paramSets, C, schedule, rng, beta=beta):
+    # paramSets (agents x 5) and one C per agent (or one for all) -> actions and feedback, (trials x agents x blocks)
+    paramSets = np.atleast_2d(np.asarray(paramSets, dtype=float))
+    nAgents = len(paramSets)
+    C = np.broadcast_to(np.asarray(C, dtype=float), nAgents)
+    alpha, phi, rho, gamma, epsilon = paramSets.T
+
+    state, correct, fbValue = schedule['stateT'], schedule['correctT'], schedule['fbValueT']
+    nTrials, nBlocks = state.shape
+    agents = np.arange(nAgents)[:, None]
+    blocks = np.arange(nBlocks)[None, :]
+
+    q = np.full((nAgents, nBlocks, schedule['setSize'].max(), 2, numActions), 1 / numActions)
+    weight = rho[:, None] * np.minimum(1, C[:, None] / schedule['setSize'])
+    systemWeights = np.stack([1 - weight, weight], axis=2)[..., None] # (agents, blocks, 2, 1)
+    learningRates = np.column_stack([alpha, np.ones(nAgents)])[:, None, :]
+    gamma, epsilon = gamma[:, None, None], epsilon[:, None, None]
+    decay = phi[:, None, None, None]
+
+    actions = np.zeros((nTrials, nAgents, nBlocks), dtype=np.intp)
+    feedback = np.zeros((nTrials, nAgents, nBlocks), dtype=np.intp)
+    for t in range(nTrials):
+        s = state[t]
+        qs = q[agents, blocks, s] # (agents, blocks, 2, actions)
+
+        # policy over all actions, then one draw per agent and block
+        e = np.exp(beta * (qs - qs.max(axis=3, keepdims=True)))
+        pol = (systemWeights * e / e.sum(axis=3, keepdims=True)).sum(axis=2)
+        pol = (1 - epsilon) * pol + epsilon / numActions
+        a = np.minimum((pol.cumsum(axis=2) < rng.random((nAgents, nBlocks, 1))).sum(axis=2), numActions - 1)
+        fb = np.where(a == correct[t], fbValue[t], 0)
+        actions[t], feedback[t] = a, fb
+
+        # same updates as the RLWM model in rlwm_likelihood.py
+        qa = qs[agents, blocks, :, a]
+        rpe = (fb > 0)[:, :, None] - qa
+        scale = np.where(rpe[:, :, :1] >= 0, 1, gamma)
+        q[agents, blocks, s, :, a] = qa + scale * learningRates * rpe
+        q[:, :, :, 1] += decay * (1 / numActions - q[:, :, :, 1])
+
+    return actions, feedback
+
+def agent_data(schedule, actions, feedback, agent):
+    # compiled data of one simulated agent (what rlwm_negLL / fit_participant take)
+    data = dict(schedule)
+    data['actionT'] = np.ascontiguousarray(actions[:, agent])
+    data['rewardT'] = np.ascontiguousarray(feedback[:, agent] > 0, dtype=float)
+    data['magnitudeT'] = np.ascontiguousarray(feedback[:, agent] / 2)
+    return data
+
+def agent_dataframe(schedule, actions, feedback, agent):
+    # one simulated agent in model format (block_id, stim_id, resp, feedback), e.g. to save it or fit it with the notebook
+    mask = schedule['maskT']
+    order = np.argsort(schedule['trialIndex'].T[mask])
+    return pd.DataFrame({
+        'block_id': np.broadcast_to(schedule['blocks'], mask.shape)[mask][order],
+        'stim_id': schedule['stateT'][mask][order],
+        'resp': actions[:, agent][mask][order],
+        'feedback': feedback[:, agent][mask][order],
+        })
+
+## Parameter recovery ##
+
+def _fit_agent(task):
+    data, n_restarts, seed = task
+    fit, table = fit_participant(data, n_restarts=n_restarts, processes=1, seed=seed)
+    return fit
+
+def recover_parameters(nAgents=200, setPaths=None, nBlocks=None, n_restarts=5, processes=None, seed=0):
+    setPaths = setPaths or [os.path.join(versionPath, 'S_1')]
+    schedule = load_schedule(setPaths, nBlocks)
+    rng = np.random.default_rng(seed)
+    trueParams = rng.uniform(paramBounds[0], paramBounds[1], (nAgents, len(paramNames)))
+    trueC = rng.choice(C_list, nAgents)
+
+    t0 = time.time()
+    actions, feedback = simulate(trueParams, trueC, schedule, rng)
+    print('%d agents simulated in %.2f s' % (nAgents, time.time() - t0))
+
+    tasks = [(agent_data(schedule, actions, feedback, i), n_restarts, seed + i) for i in range(nAgents)]
+    t0 = time.time()
+    if processes == 1:
+        fits = list(map(_fit_agent, tasks))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            fits = pool.map(_fit_agent, tasks)
+    print('%d agents fitted in %.0f s' % (nAgents, time.time() - t0))
+
+    results = pd.DataFrame(trueParams, columns=['true_' + name for name in paramNames])
+    results['true_C'] = trueC
+    for name in paramNames + ['C', 'negLL']:
+        results[name] = [fit[name] for fit in fits]
+
+    summary = pd.DataFrame([{'parameter': name, 'r': np.corrcoef(results['true_' + name], results[name])[0, 1]}
+        for name in paramNames + ['C']])
+    summary['exact'] = np.where(summary['parameter'] == 'C', np.mean(results['true_C'] == results['C']), np.nan)
+    summary['nBlocks'] = len(schedule['blocks'])
+    return summary, results
+
+if __name__ == '__main__':
+    nAgents = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    nBlocks = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    setPaths = [os.path.join(versionPath, 'S_1'), os.path.join(versionPath, 'S_2')] if nBlocks and nBlocks > 10 else None
+    summary, results = recover_parameters(nAgents, setPaths, nBlocks)
+    print(summary)
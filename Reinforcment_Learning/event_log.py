@@ -0,0 +1,97 @@
+'''
+Event log for the RL task
+
+Diagnostics that used to be printed to the console during trials (keys pressed, mashing, points...)
+go through log_event() instead. log_event() only puts the event on a queue;
+a background thread writes it to a JSON lines file (one JSON object per line), so a slow console (e.g. on Windows)
+can't hold up a flip. start_log(..., echo=True) also prints every event, for debugging only (console I/O during trials).
+
+Each line holds:
+    t     -> time.perf_counter() when the event was logged (monotonic, high resolution, seconds)
+    event -> event name
+    and any fields passed to log_event()
+
+The file is flushed whenever the queue is empty, and closed at exit (including core.quit()).
+
+Running this script compares the time a print() and a log_event() call take inside a simulated 60 Hz frame loop:
+    python event_log.py
+'''
+
+import atexit, json, queue, sys, threading, time
+
+_queue = queue.Queue()
+_thread = None
+
+def _writer(logFile, echo):
+    with open(logFile, 'a') as f:
+        while True:
+            item = _queue.get()
+            if item is None:
+                break
+            t, event, fields = item
+            line = json.dumps(dict(t=round(t, 6), event=event, **fields), default=str)
+            f.write(line + '\n')
+            if echo:
+                print(line)
+            if _queue.empty():
+                f.flush()
+
+def start_log(logFile, echo=False):
+    # starts the writer thread; events logged before this are kept in the queue and written once it starts
+    global _thread
+    if _thread is not None:
+        return
+    _thread = threading.Thread(target=_writer, args=(logFile, echo), daemon=True)
+    _thread.start()
+    atexit.register(stop_log)
+
+def log_event(event, **fields):
+    # safe to call from the render loop: no I/O, just a queue put
+    # field values should not be changed after logging (they are serialised later, on the writer thread)
+    _queue.put((time.perf_counter(), event, fields))
+
+def stop_log():
+    # writes what is left in the queue and closes the file
+    global _thread
+    if _thread is None:
+        return
+    _queue.put(None)
+    _thread.join()
+    _thread = None
+
+## Benchmark ##
+
+def benchmark(nFrames=600, frameDur=1/60.0):
+    # simulated frame loop: wait for the next frame deadline, then log one diagnostic message
+    # reports how long the logging call took and how late the next frame deadline was hit
+    import os, tempfile
+    import numpy as np
+
+    def run(report):
+        callTimes, lateness = [], []
+        nextFrame = time.perf_counter() + frameDur
+        for frame in range(nFrames):
+            while time.perf_counter() < nextFrame: # stands in for win.flip()
+                pass
+            lateness.append(time.perf_counter() - nextFrame)
+            t0 = time.perf_counter()
+            report(frame)
+            callTimes.append(time.perf_counter() - t0)
+            nextFrame += frameDur
+        return np.array(callTimes)*1000, np.array(lateness)*1000
+
+    results = {}
+    results['print'] = run(lambda frame: print('frame %d keys %s total points accumulated: %d' % (frame, ['j'], frame)))
+    logFile = os.path.join(tempfile.mkdtemp(), 'benchmark_events.jsonl')
+    start_log(logFile, echo=False)
+    results['log_event'] = run(lambda frame: log_event('trial', frame=frame, keys=['j'], totalPoints=frame))
+    stop_log()
+
+    sys.stderr.write('\n%-10s %28s %28s\n' % ('', 'call time (ms) median/p99/max', 'frame lateness (ms) p99/max'))
+    for name, (callTimes, lateness) in results.items():
+        sys.stderr.write('%-10s %12.3f %7.3f %7.3f %20.3f %7.3f\n' % (name,
+            np.median(callTimes), np.percentile(callTimes, 99), callTimes.max(),
+            np.percentile(lateness, 99), lateness.max()))
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,249 @@
+'''
+Generator for new RLWM stimulus sets (rlwmpst/V4/S_n folders)
+
+Writes train_instruction_10blocks.csv, train.csv and test.csv in the same format as the existing sets,
+then compiles the new folder (stimulus_sets.py), which also validates it.
+
+Each set follows the V4 design:
+    - 10 blocks, set sizes 2,2,3,3,3,4,4,5,5,5 in a random order (as in S_1-S_9, blocks of the same set size can follow each other)
+    - a different image folder per block, setSize random pictures from it
+    - every stimulus is shown 10 times (setSize*10 trials per block)
+    - correct actions as balanced as possible within each block
+    - 2/1 feedback probabilities (0.2/0.5/0.8) as balanced as possible within each block and across the blocks of
+      each set size (e.g. 5 stimuli of each probability over the three set size 5 blocks), and exactly round(p*10)
+      of a stimulus' correct trials give 2 points
+    - delays (trials since the same stimulus was last shown) balanced across the stimuli of a block:
+      many random trial orders are scored at once and the best is kept
+    - the test design of the existing sets: for set sizes 3-5, 2 pairs for every combination of (set size, probability)
+      (e.g. 2 pairs of a set size 3, p=0.2 stimulus with a set size 5, p=0.8 stimulus), 90 pairs; for set size 2,
+      whose stimuli don't cover every probability, a fixed number of pairs per set size combination (testPairs);
+      stimuli shown as evenly as possible
+    - a random mapping of actions to the j/k/l keys
+
+Many candidate sets are generated in parallel (one process per core) and scored;
+the best ones are kept, skipping any that share too many stimulus-action pairs
+((image folder, image, correct action)) with the existing sets or with each other,
+so a participant tested again with another set does not relearn the same associations.
+
+Usage (from the task folder):
+    python generate_stimulus_sets.py 20            # adds 20 sets after the last existing S_n, best of 2000 candidates
+    python generate_stimulus_sets.py 20 5000       # best of 5000 candidates
+'''
+
+import glob, multiprocessing, os, sys, time
+import numpy as np
+import pandas as pd
+from stimulus_sets import compile_stimulus_set
+
+design = {
+    'setSizes'      :   [2, 2, 3, 3, 3, 4, 4, 5, 5, 5],
+    'presentations' :   10, # per stimulus
+    'probabilities' :   [0.2, 0.5, 0.8],
+    'numFolders'    :   19, # rlwmpst/images1..19
+    'imagesPerFolder':  6,
+    'keyCodes'      :   [13, 14, 15], # j, k, l
+    'orderCandidates':  2000, # random trial orders scored per block
+    # test pairs per unordered ((set size, probability), (set size, probability)) combination, for these set sizes
+    'cellPairs'     :   2,
+    'cellSetSizes'  :   [3, 4, 5],
+    # and for set size 2, per unordered (set size, set size) combination: these vary between the V4 sets
+    # (S_1-S_9 have 1-4, 6-11, 8-10 and 7-11), the counts here are their means, 29 pairs (119 test trials, as in S_1-S_4)
+    'testPairs'     :   {(2,2): 2, (2,3): 9, (2,4): 9, (2,5): 9},
+    'maxOverlap'    :   0.2, # max fraction of stimulus-action pairs shared with another set
+    }
+
+## Trial orders ##
+
+def stimulus_delays(orders, setSize):
+    # trials since the same stimulus was last shown (0 for its first presentation), for many orders at once
+    nOrders, nTrials = orders.shape
+    rows = np.arange(nOrders)
+    lastSeen = np.full((nOrders, setSize), -1)
+    delays = np.zeros(orders.shape, dtype=int)
+    for t in range(nTrials):
+        previous = lastSeen[rows, orders[:, t]]
+        delays[:, t] = np.where(previous >= 0, t - previous, 0)
+        lastSeen[rows, orders[:, t]] = t
+    return delays
+
+def best_trial_order(setSize, rng):
+    # scores design['orderCandidates'] random orders of the block, returns the best order and its delay spread
+    # orders with a delay over 2 x setSize are only used if none avoid it; among the rest, the one whose
+    # stimuli have the most similar mean delays is kept
+    presentations = design['presentations']
+    base = np.repeat(np.arange(setSize), presentations)
+    orders = base[np.argsort(rng.random((design['orderCandidates'], len(base))), axis=1)]
+    delays = stimulus_delays(orders, setSize)
+
+    onehot = orders[:, :, None] == np.arange(setSize)
+    meanDelays = (delays[:, :, None] * onehot).sum(axis=1) / (presentations - 1)
+    spread = meanDelays.max(axis=1) - meanDelays.min(axis=1)
+    numLong = (delays > 2 * setSize).sum(axis=1)
+
+    best = np.lexsort((spread, numLong))[0]
+    return orders[best], spread[best]
+
+## Sets ##
+
+def balanced(values, n, rng):
+    # n values cycling through a shuffled copy of values, so counts differ by at most one, in random order
+    return rng.permutation(np.resize(rng.permutation(values), n))
+
+def block_probabilities(setSizes, rng):
+    # probabilities of each block's stimuli, balanced within every block and across the blocks of each set size
+    probs = [None] * len(setSizes)
+    for setSize in set(setSizes):
+        blocks = np.flatnonzero(setSizes == setSize)
+        while True:
+            values = balanced(design['probabilities'], setSize * len(blocks), rng).reshape(len(blocks), setSize)
+            counts = (values[:, :, None] == design['probabilities']).sum(axis=1)
+            if (np.ptp(counts, axis=1) <= 1).all():
+                break
+        for b, v in zip(blocks, values):
+            probs[b] = v
+    return probs
+
+def generate_set(seed):
+    # one candidate set, returns its three tables and its score (lower is better)
+    rng = np.random.default_rng(seed)
+    setSizes = rng.permutation(design['setSizes'])
+    folders = rng.choice(design['numFolders'], len(setSizes), replace=False) + 1
+    actionKeys = rng.permutation(design['keyCodes']) # key code of actions 1, 2, 3
+    blockProbs = block_probabilities(setSizes, rng)
+
+    blocks, trains, stims = [], [], []
+    spreads = []
+    overallID = 0
+    for b, (setSize, folder) in enumerate(zip(setSizes, folders)):
+        images = rng.choice(design['imagesPerFolder'], setSize, replace=False) + 1
+        actions = balanced([1, 2, 3], setSize, rng)
+        probs = blockProbs[b]
+        order, spread = best_trial_order(setSize, rng)
+        spreads.append(spread)
+
+        feedback = np.ones(len(order))
+        for s in range(setSize):
+            trials = np.flatnonzero(order == s)
+            feedback[rng.permutation(trials)[:int(round(probs[s] * len(trials)))]] = 2
+            stims.append((overallID + s + 1, folder, images[s], setSize, probs[s], b + 1, actions[s]))
+
+        blocks.append([setSize, folder] + list(images))
+        trains.append(pd.DataFrame({
+            'block #': b + 1,
+            'set size': setSize,
+            'overall stimulus id': overallID + order + 1,
+            'image folder': folder,
+            'image number': images[order],
+            'in block stim #': order + 1,
+            'correct action #': actions[order],
+            'correct key#': actionKeys[actions[order] - 1],
+            '2/1 correct FB proba': probs[order],
+            'CorrectFB value': feedback,
+            }))
+        overallID += setSize
+
+    maxSetSize = max(design['setSizes'])
+    instructions = pd.DataFrame([row + [np.nan] * (2 + maxSetSize - len(row)) for row in blocks],
+        columns=['set size', 'image folder'] + ['image%d' % i for i in range(1, maxSetSize + 1)])
+    train = pd.concat(trains, ignore_index=True).astype(float)
+    stims = pd.DataFrame(stims, columns=['stimulus id', 'image folder', 'image number', 'set size', 'stim value', 'block number', 'action'])
+    test, appearanceSpread = generate_test(stims, rng)
+
+    score = np.mean(spreads) + appearanceSpread
+    return {'instructions': instructions, 'train': train, 'test': test, 'stims': stims, 'score': score, 'seed': seed}
+
+def draw_pairs(poolA, poolB, n, rng, maxAttempts=100):
+    # n pairs of a stimulus of poolA with one of poolB, each stimulus drawn as evenly as possible within its pool,
+    # no stimulus paired with itself and no pair repeated (unless the pools don't have n distinct pairs)
+    same = set(poolA) == set(poolB)
+    numDistinct = len(poolA) * (len(poolA) - 1) // 2 if same else len(poolA) * len(poolB)
+    for attempt in range(maxAttempts):
+        left = balanced(poolA, n, rng)
+        right = balanced(poolB, n, rng)
+        keys = set(zip(np.minimum(left, right), np.maximum(left, right)))
+        if (left != right).all() and len(keys) == min(n, numDistinct):
+            return list(zip(left, right))
+    raise RuntimeError('Could not draw %d distinct test pairs' % n)
+
+def generate_test(stims, rng):
+    # the test design of the existing sets (see design['cellPairs'] and design['testPairs'])
+    pairs = []
+    cells = [(setSize, p) for setSize in design['cellSetSizes'] for p in design['probabilities']]
+    for i, (sizeA, pA) in enumerate(cells):
+        for sizeB, pB in cells[i:]:
+            poolA = stims.index[(stims['set size'] == sizeA) & (stims['stim value'] == pA)].values
+            poolB = stims.index[(stims['set size'] == sizeB) & (stims['stim value'] == pB)].values
+            pairs.extend(draw_pairs(poolA, poolB, design['cellPairs'], rng))
+    for (sizeA, sizeB), n in design['testPairs'].items():
+        pairs.extend(draw_pairs(stims.index[stims['set size'] == sizeA].values, stims.index[stims['set size'] == sizeB].values, n, rng))
+    pairs = np.array(pairs)[rng.permutation(len(pairs))]
+    swap = rng.random(len(pairs)) < 0.5 # random sides
+    pairs[swap] = pairs[swap, ::-1]
+
+    counts = np.bincount(pairs.ravel(), minlength=len(stims))
+    appearanceSpread = max(np.ptp(counts[stims['set size'].values == s]) for s in set(design['setSizes']))
+
+    cols = {}
+    for side, idx in [('left', pairs[:, 0]), ('right', pairs[:, 1])]:
+        rows = stims.loc[idx].reset_index(drop=True)
+        for name in ['stimulus id', 'image folder', 'image number', 'set size', 'stim value', 'block number']:
+            cols[side + ' ' + name] = rows[name].values
+    return pd.DataFrame(cols).astype(float), appearanceSpread
+
+## Choosing and writing sets ##
+
+def stimulus_actions(train):
+    return set(zip(train['image folder'].astype(int), train['image number'].astype(int), train['correct action #'].astype(int)))
+
+def existing_stimulus_actions(versionPath):
+    # stimulus-action pairs of the sets already there
+    existing = []
+    for setPath in sorted(glob.glob(os.path.join(versionPath, 'S_*'))):
+        train = pd.read_csv(os.path.join(setPath, 'train.csv'), index_col=0)
+        existing.append(stimulus_actions(train))
+    return existing
+
+def select_sets(candidates, numSets, existing):
+    # best scoring candidates first, skipping those that overlap too much with the sets already kept
+    kept = []
+    for candidate in sorted(candidates, key=lambda c: c['score']):
+        pairs = stimulus_actions(candidate['train'])
+        if all(len(pairs & other) <= design['maxOverlap'] * len(pairs) for other in existing):
+            kept.append(candidate)
+            existing = existing + [pairs]
+            if len(kept) == numSets:
+                break
+    return kept
+
+def write_set(setPath, candidate, taskPath):
+    os.makedirs(setPath)
+    candidate['instructions'].to_csv(os.path.join(setPath, 'train_instruction_10blocks.csv'))
+    candidate['train'].to_csv(os.path.join(setPath, 'train.csv'))
+    candidate['test'].to_csv(os.path.join(setPath, 'test.csv'))
+    return compile_stimulus_set(setPath, taskPath)
+
+def generate_sets(numSets, numCandidates=2000, taskPath=None, version=4, seed=None, processes=None):
+    # generates numCandidates sets in parallel and writes the best numSets as new S_n folders
+    taskPath = taskPath or os.path.dirname(os.path.abspath(__file__))
+    versionPath = os.path.join(taskPath, 'rlwmpst', 'V%d' % version)
+    seeds = np.random.SeedSequence(seed).generate_state(numCandidates)
+
+    t0 = time.time()
+    with multiprocessing.Pool(processes) as pool:
+        candidates = pool.map(generate_set, seeds, chunksize=max(1, numCandidates // (4 * (processes or os.cpu_count()))))
+    print('%d candidate sets generated and scored in %.1f s' % (numCandidates, time.time() - t0))
+
+    kept = select_sets(candidates, numSets, existing_stimulus_actions(versionPath))
+    if len(kept) < numSets:
+        print('Only %d sets met maxOverlap=%.2f, try more candidates' % (len(kept), design['maxOverlap']))
+
+    lastSet = max([int(os.path.basename(p)[2:]) for p in glob.glob(os.path.join(versionPath, 'S_*'))] or [0])
+    for n, candidate in enumerate(kept, start=lastSet + 1):
+        setPath = os.path.join(versionPath, 'S_%d' % n)
+        arrays = write_set(setPath, candidate, taskPath)
+        print('%s: score %.2f, seed %d, %d training trials, %d test trials' % (setPath, candidate['score'], candidate['seed'], len(arrays['train']), len(arrays['test'])))
+
+if __name__ == '__main__':
+    numSets = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    numCandidates = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    generate_sets(numSets, numCandidates)
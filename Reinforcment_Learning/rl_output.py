@@ -0,0 +1,134 @@
+'''
+Long-format output for the RL task
+
+All phases (practice, training, test) go in one file per session, one row per trial,
+with a 'phase' column and typed columns. Columns that don't apply to a phase are left empty (null),
+rather than filled with 'NA' strings. The session information (participant, date, seed, set_id, timings...)
+is stored once, in the file's metadata, not on every row.
+
+The file is an Arrow IPC stream ('.arrows'), written in batches as the task goes (after the practice, each training block, and the test),
+so everything up to the last completed batch is readable even if the task crashes.
+Needs pyarrow (pip install pyarrow).
+
+To load the data of a whole study into one table (session information added as columns):
+    from rl_output import load_rl_data
+    dat = load_rl_data(glob.glob('data/*.arrows')).to_pandas()
+'''
+
+import json
+import pyarrow as pa
+
+# trial columns and their types (session information is in the metadata)
+trialSchema = pa.schema([
+    ('phase', pa.string()), # blockType: practice, train or test
+    ('blockNumber', pa.int16()),
+    ('trialNumber', pa.int32()),
+    ('trialSetSize', pa.int8()),
+    ('trialStimFolder', pa.int16()),
+    ('trialStimID', pa.int16()),
+    ('trialStimInBlockID', pa.int8()),
+    ('trialStimOverallID', pa.int16()),
+    ('trialCorrectKey', pa.string()),
+    ('trialCorrectProb', pa.float32()),
+    ('trialCorrectFBVal', pa.int8()),
+    ('trialSetSize_Left', pa.int8()),
+    ('trialSetSize_Right', pa.int8()),
+    ('trialStimBlockNum_Left', pa.int16()),
+    ('trialStimBlockNum_Right', pa.int16()),
+    ('trialStimFolder_Left', pa.int16()),
+    ('trialStimFolder_Right', pa.int16()),
+    ('trialStimID_Left', pa.int16()),
+    ('trialStimID_Right', pa.int16()),
+    ('trialStimOverallID_Left', pa.int16()),
+    ('trialStimOverallID_Right', pa.int16()),
+    ('trialCorrectProb_Left', pa.float32()),
+    ('trialCorrectProb_Right', pa.float32()),
+    ('trialOnset', pa.float64()),
+    ('resp', pa.int8()),
+    ('respACC', pa.int8()),
+    ('respKey', pa.string()), # '?' for no response, keys joined with ',' when several were pressed
+    ('respMashed', pa.bool_()),
+    ('respRT', pa.float64()),
+    ('achievedITI', pa.float64()),
+    ('achievedFeedbackDelay', pa.float64()),
+    ('achievedFeedbackDuration', pa.float64()),
+    ('totalPoints', pa.int32()),
+    ])
+
+# session information and its type once loaded as columns
+sessionFields = [
+    ('Participant', pa.string()),
+    ('Date', pa.string()),
+    ('Seed', pa.int64()),
+    ('TaskFile', pa.string()),
+    ('set_id', pa.int16()),
+    ('task_id', pa.int16()),
+    ('responseWindow', pa.float32()),
+    ('feedbackDelay', pa.float32()),
+    ('feedbackDuration', pa.float32()),
+    ('trainITI', pa.float32()),
+    ('testITI', pa.float32()),
+    ('Resume', pa.bool_()), # continued from a checkpoint, see session_checkpoint.py
+    ]
+
+def _value(trial, name):
+    if name == 'phase':
+        return trial['blockType']
+    if name == 'respKey':
+        return ','.join(trial['respKey']) if isinstance(trial['respKey'], list) else trial['respKey']
+    if name == 'respMashed':
+        return isinstance(trial['respKey'], list)
+    value = trial.get(name, 'NA')
+    return None if value == 'NA' else value
+
+def open_output(fileName, sessionInfo):
+    # returns the output (a dict holding the open stream), session information goes in the schema metadata
+    session = {field: sessionInfo[field] for field, _ in sessionFields if field in sessionInfo}
+    schema = trialSchema.with_metadata({'session': json.dumps(session, default=str)})
+    sink = pa.OSFile(fileName, 'wb')
+    return {'fileName': fileName, 'sink': sink, 'writer': pa.ipc.new_stream(sink, schema), 'schema': schema, 'nRows': 0}
+
+def write_trials(output, trials):
+    # appends one batch (e.g. one block) of completed trial dicts
+    if not trials:
+        return
+    batch = pa.record_batch([pa.array([_value(t, field.name) for t in trials], type=field.type) for field in trialSchema],
+        schema=output['schema'])
+    output['writer'].write_batch(batch)
+    output['sink'].flush()
+    output['nRows'] += len(trials)
+
+def close_output(output):
+    if output['writer'] is not None:
+        output['writer'].close()
+        output['sink'].close()
+        output['writer'] = None
+
+## Loading ##
+
+def read_session(fileName):
+    # returns the session's trials and its session information
+    # a stream cut short by a crash is read up to the last complete batch
+    with pa.OSFile(fileName, 'rb') as source:
+        reader = pa.ipc.open_stream(source)
+        batches = []
+        try:
+            for batch in reader:
+                batches.append(batch)
+        except (pa.ArrowInvalid, OSError):
+            pass
+        session = json.loads(reader.schema.metadata[b'session'])
+        return pa.Table.from_batches(batches, schema=reader.schema), session
+
+def load_rl_data(fileNames):
+    # all sessions in one table, with the session information as columns (strings dictionary encoded)
+    tables = []
+    for fileName in fileNames:
+        table, session = read_session(fileName)
+        for field, fieldType in sessionFields:
+            column = pa.array([session.get(field)] * table.num_rows, type=fieldType)
+            if fieldType == pa.string():
+                column = column.dictionary_encode()
+            table = table.append_column(field, column)
+        tables.append(table.replace_schema_metadata(None))
+    return pa.concat_tables(tables)
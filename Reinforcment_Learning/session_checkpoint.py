@@ -0,0 +1,45 @@
+'''
+Checkpoints for the RL task
+
+At every "End of block" screen the task writes a small JSON snapshot of where the session is:
+the session's set_id and date, how many blocks are done, the total points, and the results of the completed training trials.
+The file is written to a temporary name and then renamed over the previous checkpoint,
+so a crash while writing leaves the previous checkpoint intact.
+
+Starting the task with 'Resume' ticked (same Participant) reads the checkpoint and continues at the next block,
+with the same set_id (trial orders come from the set, nothing in the task depends on a seed). The checkpoint is removed when the session ends normally.
+'''
+
+import json, os
+
+# trial fields saved for the completed training trials (the rest comes from the stimulus set)
+resultFields = ['trialNumber', 'trialOnset', 'resp', 'respACC', 'respKey', 'respRT',
+    'achievedITI', 'achievedFeedbackDelay', 'achievedFeedbackDuration', 'totalPoints']
+sessionFields = ['Participant', 'Date', 'set_id', 'task_id']
+
+def checkpoint_file(sessionInfo):
+    return sessionInfo['TaskFile'][:-3]+"_checkpoint_"+sessionInfo['Participant']+'.json'
+
+def save_checkpoint(fileName, sessionInfo, blocksCompleted, nextTrial, totalPoints, trials):
+    checkpoint = {field: sessionInfo[field] for field in sessionFields}
+    checkpoint['blocksCompleted'] = blocksCompleted
+    checkpoint['nextTrial'] = nextTrial
+    checkpoint['totalPoints'] = totalPoints
+    checkpoint['trials'] = [{field: trial[field] for field in resultFields} for trial in trials]
+
+    tmpFile = fileName + '.tmp'
+    with open(tmpFile, 'w') as f:
+        json.dump(checkpoint, f, default=lambda x: x.item()) # numpy numbers -> python numbers
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpFile, fileName)
+
+def load_checkpoint(fileName):
+    if not os.path.exists(fileName):
+        raise IOError('No checkpoint to resume from (%s), check the Participant id' % fileName)
+    with open(fileName) as f:
+        return json.load(f)
+
+def remove_checkpoint(fileName):
+    if os.path.exists(fileName):
+        os.remove(fileName)
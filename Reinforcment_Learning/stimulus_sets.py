@@ -0,0 +1,185 @@
+'''
+Compiled stimulus sets for the RLWM task
+
+Each rlwmpst/V4/S_n folder holds the trial orders as three CSVs
+(train_instruction_10blocks.csv, train.csv, test.csv).
+Running this script compiles every S_n folder into one binary bundle ('stimulus_set.npz') next to the CSVs,
+holding typed numpy structured arrays with everything the task needs already worked out:
+    blocks -> set size, image folder, preview images, and the range of training trials that belong to the block
+    train  -> one row per training trial, including the correct key letter and the image path
+    test   -> one row per test trial, including both image paths
+The CSVs are validated while compiling (block lengths, preview images, keys, feedback values, image files...),
+so the task only has to load the bundle (numpy only, no pandas) and check its checksums.
+
+To (re)compile after changing or adding S_n folders, run this script from the task folder:
+    python stimulus_sets.py
+'''
+
+import glob, hashlib, os
+import numpy as np
+
+bundleName = 'stimulus_set.npz'
+sourceFiles = ['train_instruction_10blocks.csv', 'train.csv', 'test.csv']
+keyLetters = {13: 'j', 14: 'k', 15: 'l'} # key codes used in the CSVs
+maxSetSize = 6
+
+blockDtype = np.dtype([
+    ('blockNumber', 'i2'), # 'block #' in train.csv
+    ('setSize', 'i1'),
+    ('imageFolder', 'i2'),
+    ('images', 'i2', (maxSetSize,)), # preview images in in-block stimulus order, 0 past the set size
+    ('trialStart', 'i4'), # training trials of the block are train[trialStart:trialStop]
+    ('trialStop', 'i4'),
+    ])
+trainDtype = np.dtype([
+    ('blockNumber', 'i2'),
+    ('setSize', 'i1'),
+    ('imageFolder', 'i2'),
+    ('imageNumber', 'i2'),
+    ('imagePath', 'U32'),
+    ('inBlockStimID', 'i1'),
+    ('overallStimID', 'i2'),
+    ('correctKey', 'U1'),
+    ('correctProb', 'f4'),
+    ('correctFBVal', 'i1'),
+    ])
+testDtype = np.dtype([(side + name, dt) for side in ['left_', 'right_'] for name, dt in [
+    ('setSize', 'i1'),
+    ('blockNumber', 'i2'),
+    ('imageFolder', 'i2'),
+    ('imageNumber', 'i2'),
+    ('imagePath', 'U32'),
+    ('overallStimID', 'i2'),
+    ('stimValue', 'f4'),
+    ]])
+
+def image_path(folder, number):
+    # relative to the task folder, '/' separated (split and re-joined with os.path.join when used)
+    return 'rlwmpst/images%d/image%d.jpg' % (folder, number)
+
+def file_checksum(path):
+    # line endings are normalised first, so a checkout that converts them (e.g. git on Windows) doesn't look like a change
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read().replace(b'\r\n', b'\n').replace(b'\r', b'\n')).hexdigest()
+
+def array_checksum(arrays):
+    h = hashlib.sha256()
+    for name in ['blocks', 'train', 'test']:
+        h.update(np.ascontiguousarray(arrays[name]).tobytes())
+    return h.hexdigest()
+
+## Compiling (needs pandas) ##
+
+def compile_stimulus_set(setPath, taskPath):
+    import pandas as pd
+
+    instr = pd.read_csv(os.path.join(setPath, 'train_instruction_10blocks.csv'), index_col=0)
+    train = pd.read_csv(os.path.join(setPath, 'train.csv'), index_col=0)
+    test = pd.read_csv(os.path.join(setPath, 'test.csv'), index_col=0)
+    problems = []
+
+    # training trials
+    trainArr = np.zeros(len(train), dtype=trainDtype)
+    trainArr['blockNumber'] = train['block #']
+    trainArr['setSize'] = train['set size']
+    trainArr['imageFolder'] = train['image folder']
+    trainArr['imageNumber'] = train['image number']
+    trainArr['inBlockStimID'] = train['in block stim #']
+    trainArr['overallStimID'] = train['overall stimulus id']
+    trainArr['correctProb'] = train['2/1 correct FB proba']
+    trainArr['correctFBVal'] = train['CorrectFB value']
+    trainArr['imagePath'] = [image_path(f, n) for f, n in zip(trainArr['imageFolder'], trainArr['imageNumber'])]
+    if not set(train['correct key#']) <= set(keyLetters):
+        problems.append('unknown key codes %s' % sorted(set(train['correct key#']) - set(keyLetters)))
+    trainArr['correctKey'] = [keyLetters.get(int(k), '?') for k in train['correct key#']]
+    if not set(trainArr['correctFBVal']) <= {1, 2}:
+        problems.append('correct feedback values other than 1 or 2')
+
+    # blocks, in the order they are run (training trials of a block must be contiguous)
+    starts = np.flatnonzero(np.r_[True, np.diff(trainArr['blockNumber']) != 0])
+    stops = np.r_[starts[1:], len(trainArr)]
+    if len(np.unique(trainArr['blockNumber'][starts])) != len(starts):
+        problems.append('training trials of a block are not contiguous')
+    if len(starts) != len(instr):
+        problems.append('%d blocks in train.csv but %d in train_instruction_10blocks.csv' % (len(starts), len(instr)))
+
+    blockArr = np.zeros(min(len(starts), len(instr)), dtype=blockDtype)
+    for b in range(len(blockArr)):
+        trials = trainArr[starts[b]:stops[b]]
+        setSize = int(instr['set size'].iloc[b])
+        previewImages = instr.iloc[b][['image%d' % i for i in range(1, maxSetSize + 1) if 'image%d' % i in instr.columns]].dropna().astype(int).tolist()
+        blockArr[b] = (trials['blockNumber'][0], setSize, instr['image folder'].iloc[b],
+                       previewImages + [0] * (maxSetSize - len(previewImages)), starts[b], stops[b])
+
+        if len(trials) != setSize * 10:
+            problems.append('block %d has %d trials, expected set size x 10 = %d' % (b, len(trials), setSize * 10))
+        if len(previewImages) != setSize or (trials['setSize'] != setSize).any():
+            problems.append('block %d set size does not match its preview images/trials' % b)
+        if (trials['imageFolder'] != blockArr['imageFolder'][b]).any():
+            problems.append('block %d image folder does not match train.csv' % b)
+        for stim in np.unique(trials['inBlockStimID']):
+            stimTrials = trials[trials['inBlockStimID'] == stim]
+            if len(np.unique(stimTrials['correctKey'])) != 1:
+                problems.append('block %d stimulus %d has more than one correct key' % (b, stim))
+            if stim > len(previewImages) or (stimTrials['imageNumber'] != previewImages[stim - 1]).any():
+                problems.append('block %d stimulus %d does not match the preview images' % (b, stim))
+
+    if len(np.unique(blockArr['imageFolder'])) != len(blockArr):
+        problems.append('an image folder is used by more than one block')
+
+    # test trials
+    testArr = np.zeros(len(test), dtype=testDtype)
+    for side in ['left', 'right']:
+        testArr[side + '_setSize'] = test[side + ' set size']
+        testArr[side + '_blockNumber'] = test[side + ' block number']
+        testArr[side + '_imageFolder'] = test[side + ' image folder']
+        testArr[side + '_imageNumber'] = test[side + ' image number']
+        testArr[side + '_overallStimID'] = test[side + ' stimulus id']
+        testArr[side + '_stimValue'] = test[side + ' stim value']
+        testArr[side + '_imagePath'] = [image_path(f, n) for f, n in zip(testArr[side + '_imageFolder'], testArr[side + '_imageNumber'])]
+        trainedStims = set(zip(trainArr['overallStimID'], trainArr['imageFolder'], trainArr['imageNumber']))
+        for row in testArr:
+            if (row[side + '_overallStimID'], row[side + '_imageFolder'], row[side + '_imageNumber']) not in trainedStims:
+                problems.append('test %s stimulus %d was not in training' % (side, row[side + '_overallStimID']))
+
+    # image files
+    for path in set(trainArr['imagePath']) | set(testArr['left_imagePath']) | set(testArr['right_imagePath']):
+        if not os.path.exists(os.path.join(taskPath, *path.split('/'))):
+            problems.append('missing image ' + path)
+
+    if problems:
+        raise ValueError('Problems in %s:\n    ' % setPath + '\n    '.join(problems))
+
+    arrays = {'blocks': blockArr, 'train': trainArr, 'test': testArr}
+    tmpFile = os.path.join(setPath, bundleName + '.tmp.npz')
+    np.savez(tmpFile,
+        checksum=np.array(array_checksum(arrays)),
+        sourceChecksums=np.array([file_checksum(os.path.join(setPath, f)) for f in sourceFiles]),
+        **arrays)
+    os.replace(tmpFile, os.path.join(setPath, bundleName))
+    return arrays
+
+def compile_all(taskPath, version=4):
+    for setPath in sorted(glob.glob(os.path.join(taskPath, 'rlwmpst', 'V%d' % version, 'S_*'))):
+        arrays = compile_stimulus_set(setPath, taskPath)
+        print('%s: %d blocks, %d training trials, %d test trials' % (setPath, len(arrays['blocks']), len(arrays['train']), len(arrays['test'])))
+
+## Loading (numpy only) ##
+
+def load_stimulus_set(setPath):
+    # returns the blocks, train and test arrays of a compiled set
+    bundleFile = os.path.join(setPath, bundleName)
+    if not os.path.exists(bundleFile):
+        raise IOError('No compiled stimulus set in %s, run "python stimulus_sets.py" in the task folder' % setPath)
+
+    with np.load(bundleFile, allow_pickle=False) as bundle:
+        arrays = {name: bundle[name] for name in ['blocks', 'train', 'test']}
+        if array_checksum(arrays) != str(bundle['checksum']):
+            raise IOError('%s is corrupted (checksum mismatch), recompile it with "python stimulus_sets.py"' % bundleFile)
+        if [file_checksum(os.path.join(setPath, f)) for f in sourceFiles] != bundle['sourceChecksums'].tolist():
+            raise IOError('The CSVs in %s changed since %s was compiled, recompile it with "python stimulus_sets.py"' % (setPath, bundleName))
+
+    return arrays
+
+if __name__ == '__main__':
+    compile_all(os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,14 @@
+'''
+Session ids for the analysis demos of all tasks
+
+Participant ids can repeat across sessions (e.g. a participant tested again), so the analyses
+identify a session by 'Participant_Date', both as written in the task output files.
+
+Usage (the analysis_demo scripts add the repository folder to sys.path):
+    from session_ids import session_ids
+    dat['Participant'] = session_ids(dat)
+'''
+
+def session_ids(dat):
+    # one id per session, from the Participant and Date columns of task output
+    return dat['Participant'].astype(str) + '_' + dat['Date'].astype(str)